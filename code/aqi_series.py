@@ -0,0 +1,246 @@
+"""
+Hourly air quality along the trail as compact binary time series
+
+Air quality contours are rasterized onto a fixed grid of cells along the trail
+corridor, as one AQI class per cell, and appended to time series stored on S3:
+
+- `{prefix}/{YYYY-MM-DD}.bin`: one chunk per UTC day, with 24 hourly rows
+- `{prefix}/latest.bin`: a rolling window of the most recent hours, so that
+  clients can download e.g. the last 48 hours along the trail in one small
+  file
+
+Each file is a header followed by a `uint8` array of shape (hours, cells), and
+is stored gzipped. The header is, little endian:
+
+| Field      | Type      | Description                             |
+|------------|-----------|-----------------------------------------|
+| magic      | 4 bytes   | `AQTS`                                  |
+| version    | uint8     | 1                                       |
+| start hour | uint32    | first hour, in hours since the epoch    |
+| hours      | uint16    | number of rows                          |
+| cells      | uint32    | number of columns                       |
+
+Cell values are 0 where no contour covers the cell, 1-6 for AQI levels from
+`good` to `hazardous`, and 255 for hours without data.
+
+The grid is a JSON file with `cell_size` in degrees and `cells`, a list of
+`[column, row]` indices of cells in a global grid with origin 0, 0, in order
+along the trail.
+
+This file depends only on NumPy and Shapely, so that it can be copied next to
+the AWS Lambda handlers.
+"""
+
+import gzip
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+from shapely.geometry import Point
+from shapely.prepared import prep
+
+try:
+    # Shapely 2.0+ can test many points at once
+    from shapely import contains_xy as _contains_xy
+except ImportError:
+    _contains_xy = None
+
+MAGIC = b'AQTS'
+VERSION = 1
+HEADER = struct.Struct('<4sBIHI')
+
+# Cell value for hours without data
+MISSING = 255
+
+
+def trail_grid(line, cell_size=0.05, buffer_cells=1):
+    """Find grid cells along trail
+
+    Args:
+        - line: LineString of trail in EPSG 4326, from its start
+        - cell_size: size of cells in degrees
+        - buffer_cells: number of cells to include on each side of the trail
+
+    Returns:
+        (N, 2) int32 array of [column, row] of cells, in order of their first
+        distance along the trail
+    """
+    coords = np.asarray(line.coords)[:, :2]
+    seg_lengths = np.hypot(*np.diff(coords, axis=0).T)
+    dist = np.concatenate([[0], np.cumsum(seg_lengths)])
+
+    # Sample at a quarter of the cell size, so that no crossed cell is skipped
+    samples = np.arange(0, dist[-1] + cell_size / 4, cell_size / 4)
+    x = np.interp(samples, dist, coords[:, 0])
+    y = np.interp(samples, dist, coords[:, 1])
+    base = np.column_stack([
+        np.floor(x / cell_size), np.floor(y / cell_size)]).astype(np.int32)
+
+    offsets = np.arange(-buffer_cells, buffer_cells + 1)
+    cells = []
+    order = []
+    for dx in offsets:
+        for dy in offsets:
+            cells.append(base + [dx, dy])
+            order.append(samples)
+
+    cells = np.concatenate(cells)
+    order = np.concatenate(order)
+
+    # Keep first occurrence of each cell along the trail
+    sort = np.argsort(order, kind='stable')
+    cells = cells[sort]
+    _, first = np.unique(cells, axis=0, return_index=True)
+    return cells[np.sort(first)]
+
+
+def cell_centers(cells, cell_size):
+    """Longitude and latitude of centers of grid cells
+
+    Returns:
+        (lon, lat) arrays
+    """
+    cells = np.asarray(cells)
+    return (cells[:, 0] + 0.5) * cell_size, (cells[:, 1] + 0.5) * cell_size
+
+
+def rasterize(geometries, classes, lon, lat):
+    """Find AQI class of each cell
+
+    Args:
+        - geometries: list of Polygons or MultiPolygons
+        - classes: AQI class of each geometry, from 1 for good to 6 for
+          hazardous
+        - lon: longitudes of cell centers
+        - lat: latitudes of cell centers
+
+    Returns:
+        uint8 array with the most severe class of the geometries that contain
+        each cell's center, or 0 where none do
+    """
+    values = np.zeros(len(lon), dtype=np.uint8)
+    for geometry, cls in zip(geometries, classes):
+        minx, miny, maxx, maxy = geometry.bounds
+        candidates = np.flatnonzero((lon >= minx) & (lon <= maxx) &
+                                    (lat >= miny) & (lat <= maxy))
+        if not len(candidates):
+            continue
+
+        if _contains_xy is not None:
+            inside = _contains_xy(geometry, lon[candidates], lat[candidates])
+        else:
+            prepared = prep(geometry)
+            inside = np.array([
+                prepared.contains(Point(lon[i], lat[i])) for i in candidates],
+                              dtype=bool)
+
+        idx = candidates[inside]
+        values[idx] = np.maximum(values[idx], cls)
+
+    return values
+
+
+def to_hour(date):
+    """Hours since the epoch of a naive UTC or aware datetime"""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return int(date.timestamp()) // 3600
+
+
+def encode_series(start_hour, values):
+    """Encode time series as bytes, with header
+
+    Args:
+        - start_hour: hour of first row, in hours since the epoch
+        - values: uint8 array of shape (hours, cells)
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint8)
+    n_hours, n_cells = values.shape
+    header = HEADER.pack(MAGIC, VERSION, start_hour, n_hours, n_cells)
+    return header + values.tobytes()
+
+
+def decode_series(data):
+    """Decode time series from bytes
+
+    Returns:
+        (start hour, uint8 array of shape (hours, cells))
+    """
+    magic, version, start_hour, n_hours, n_cells = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not an AQI time series')
+
+    values = np.frombuffer(
+        data, dtype=np.uint8, count=n_hours * n_cells, offset=HEADER.size)
+    return start_hour, values.reshape(n_hours, n_cells).copy()
+
+
+def append_snapshot(client, bucket, prefix, hour, values, window=48):
+    """Add one hour of cell values to the daily chunk and rolling window
+
+    Args:
+        - client: boto3 S3 client
+        - bucket: S3 bucket name
+        - prefix: S3 key prefix of time series, e.g. `airnow/series/PM25`
+        - hour: hour of snapshot, in hours since the epoch
+        - values: uint8 array of AQI class of each cell
+        - window: number of hours kept in `latest.bin`
+    """
+    n_cells = len(values)
+
+    # Daily chunk
+    day_start = hour - hour % 24
+    date = datetime.fromtimestamp(day_start * 3600, tz=timezone.utc)
+    key = f'{prefix}/{date:%Y-%m-%d}.bin'
+    chunk = _get_series(client, bucket, key)
+    if chunk is None or chunk[1].shape != (24, n_cells):
+        chunk = (day_start, np.full((24, n_cells), MISSING, dtype=np.uint8))
+    chunk[1][hour - day_start] = values
+    _put_series(client, bucket, key, *chunk)
+
+    # Rolling window, ending at the latest hour seen
+    key = f'{prefix}/latest.bin'
+    previous = _get_series(client, bucket, key)
+    end = hour + 1
+    if previous is not None and previous[1].shape[1] == n_cells:
+        end = max(end, previous[0] + len(previous[1]))
+    else:
+        previous = None
+
+    start = end - window
+    latest = np.full((window, n_cells), MISSING, dtype=np.uint8)
+    if previous is not None:
+        prev_start, prev_values = previous
+        lo = max(start, prev_start)
+        hi = min(end, prev_start + len(prev_values))
+        if lo < hi:
+            latest[lo - start:hi - start] = \
+                prev_values[lo - prev_start:hi - prev_start]
+    if hour >= start:
+        latest[hour - start] = values
+    _put_series(client, bucket, key, start, latest)
+
+
+def _get_series(client, bucket, key):
+    try:
+        r = client.get_object(Bucket=bucket, Key=key)
+    except client.exceptions.NoSuchKey:
+        return None
+
+    data = r['Body'].read()
+    if r.get('ContentEncoding') == 'gzip':
+        data = gzip.decompress(data)
+
+    return decode_series(data)
+
+
+def _put_series(client, bucket, key, start_hour, values):
+    client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=gzip.compress(encode_series(start_hour, values)),
+        ContentType='application/octet-stream',
+        ContentEncoding='gzip',
+        ACL='public-read',
+        CacheControl='public, max-age=3600')
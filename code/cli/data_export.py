@@ -1,3 +1,5 @@
+import json
+
 import click
 import geopandas as gpd
 
@@ -162,8 +164,8 @@ def wildfire_historical(trail_code):
 
     # Keep desired columns
     cols = [
-        'year', 'name', 'acres', 'inciwebid', 'geometry', 'length',
-        'wiki_image', 'wiki_url', 'wiki_summary'
+        'year', 'name', 'acres', 'inciwebid', 'rx', 'geometry', 'length',
+        'start_mile', 'end_mile', 'wiki_image', 'wiki_url', 'wiki_summary'
     ]
     gdf = gdf[cols]
 
@@ -256,3 +258,41 @@ def transit(trail_code, out_routes, out_stops):
     # Write GeoJSON files to disk
     stops_gdf.to_file(out_stops, driver='GeoJSON')
     routes_gdf.to_file(out_routes, driver='GeoJSON')
+
+
+@click.command()
+@click.option(
+    '-t',
+    '--trail-code',
+    required=True,
+    type=str,
+    help='Code for desired trail, .e.g "pct"')
+@click.option(
+    '--cell-size',
+    required=False,
+    default=0.05,
+    show_default=True,
+    type=float,
+    help='Size of grid cells in degrees')
+@click.option(
+    '--buffer-cells',
+    required=False,
+    default=1,
+    show_default=True,
+    type=int,
+    help='Number of cells to include on each side of the trail')
+def air_quality_grid(trail_code, cell_size, buffer_cells):
+    """Get grid of cells along trail for air quality time series
+
+    Upload the output to `airnow/series/grid.json` for the AirNow Lambda
+    function to start appending hourly snapshots.
+    """
+    if trail_code != 'pct':
+        raise ValueError('invalid trail_code')
+
+    trail = Trail()
+    grid = trail.air_quality_grid(
+        cell_size=cell_size, buffer_cells=buffer_cells)
+
+    # Print JSON to stdout
+    click.echo(json.dumps(grid, separators=(',', ':')))
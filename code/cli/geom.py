@@ -43,11 +43,18 @@ from geom import validate_geojson
     required=False,
     help='Only include labels for geometries of >= this rank, between 0 and 1.'
 )
+@click.option(
+    '--repair-report',
+    type=click.Path(file_okay=True, dir_okay=False, writable=True),
+    default=None,
+    required=False,
+    help='Write JSON report of input features with invalid geometries that were repaired to this path.'
+)
 @click.argument(
     'file',
     required=True,
     type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True))
-def polylabel(exclude, include, exclude_all, rank_filter, file):
+def polylabel(exclude, include, exclude_all, rank_filter, repair_report, file):
     """Create point labels for polygon features
 
     Adds the 'rank' property, which is the percentage of the total area of a
@@ -69,8 +76,8 @@ def polylabel(exclude, include, exclude_all, rank_filter, file):
     if gj['type'] != 'FeatureCollection':
         raise ValueError('GeoJSON must be FeatureCollection')
 
-    # For every geometry, make sure it is valid. If not, run buffer(0)
-    gj = validate_geojson(gj)
+    # For every geometry, make sure it is valid. If not, repair it
+    gj = validate_geojson(gj, report_path=repair_report)
 
     polylabel_features = []
     for feature in gj['features']:
@@ -2,12 +2,11 @@ import json
 import logging
 import sys
 from pathlib import Path
-from shutil import copyfile
-from subprocess import run
 
 import click
 
 from data_source import GPSTracks, PhotosLibrary
+from images import convert_photos
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 Log = logging.getLogger()
@@ -69,23 +68,32 @@ Log = logging.getLogger()
     type=click.Path(
         exists=False, file_okay=True, dir_okay=False, resolve_path=True),
     help='Output path for UUID-photo path crosswalk')
+@click.option(
+    '--max-gap',
+    required=False,
+    type=str,
+    default='10min',
+    help=
+    'Flag photos taken between GPS fixes further apart than this duration in the gps_gap property. Default: 10min'
+)
 def geotag_photos(
-        album, start_date, end_date, exif, all_cols, out_path, xw_path):
+        album, start_date, end_date, exif, all_cols, out_path, xw_path,
+        max_gap):
     """Geotag photos from album using watch's GPS tracks
     """
     # Instantiate Photos and GPSTracks classes
     photos_library = PhotosLibrary()
     tracks = GPSTracks()
 
-    # Get GeoDataFrame of GPS points
-    points = tracks.points_df()
+    # Get DataFrame of GPS points
+    points = tracks.points_df(geometry=False)
 
     # Get photos in given album
     photos = photos_library.find_photos(
         albums=album, exif=exif, start_date=start_date, end_date=end_date)
 
     # Geotag those photos
-    gdf = photos_library.geotag_photos(photos, points)
+    gdf = photos_library.geotag_photos(photos, points, max_gap=max_gap)
 
     # If path_edited exists, replace path with the edited path
     gdf.loc[gdf['path_edited'].notna(
@@ -104,7 +112,9 @@ def geotag_photos(
 
     # Generate features and uuid-path crosswalk
     gdf['date'] = gdf['date'].apply(lambda x: x.isoformat())
-    cols = ['uuid', 'favorite', 'keywords', 'description', 'date', 'geometry']
+    cols = [
+        'uuid', 'favorite', 'keywords', 'description', 'date', 'gps_gap',
+        'geometry']
     if all_cols:
         # Manually add a few more columns
         other_cols = [
@@ -137,15 +147,51 @@ def geotag_photos(
     type=click.Path(
         exists=False, file_okay=True, dir_okay=False, resolve_path=True),
     help='Output directory for copied photos')
+@click.option(
+    '-s',
+    '--size',
+    'sizes',
+    required=False,
+    type=(str, int),
+    multiple=True,
+    default=None,
+    help=
+    'Resized variant to create, as NAME MAX_PIXELS, saved to {uuid}_{NAME}.jpeg. Can be provided multiple times. Default: thumb 300 and medium 1200'
+)
+@click.option(
+    '--strip-exif',
+    is_flag=True,
+    default=False,
+    help='Remove EXIF metadata, including GPS position, from output photos')
+@click.option(
+    '-q',
+    '--quality',
+    required=False,
+    type=int,
+    default=90,
+    help='JPEG quality of converted photos. Default: 90')
+@click.option(
+    '--overwrite',
+    is_flag=True,
+    default=False,
+    help='Convert all photos, even if unchanged since the last run')
+@click.option(
+    '-j',
+    '--jobs',
+    required=False,
+    type=int,
+    default=None,
+    help='Number of processes to use. Default: number of CPUs')
 @click.argument(
     'file',
     type=click.Path(
         exists=True, file_okay=True, dir_okay=False, resolve_path=True),
     nargs=1)
-def copy_using_xw(file, out_dir):
+def copy_using_xw(file, out_dir, sizes, strip_exif, quality, overwrite, jobs):
     """Copy files to out_dir using JSON crosswalk
 
-    For any non-JPEG files, this calls `sips` (mac-cli) to convert them to JPEG.
+    Every photo is converted to JPEG, along with resized variants, in parallel.
+    Photos whose source file hasn't changed since the last run are skipped.
     """
     # Load JSON crosswalk
     with open(file) as f:
@@ -158,25 +204,17 @@ def copy_using_xw(file, out_dir):
     for key in xw.keys():
         assert Path(key).exists(), f'Key does not exist:\n{key}'
 
-    # Make out_dir
-    out_dir = Path(out_dir)
-    out_dir.mkdir(exist_ok=True, parents=True)
-
-    # Iterate over values; copying files
-    for existing_file, new_stub in xw.items():
-        # If the existing file extension is already jpeg, just copy the file and
-        # don't run `sips`
-        new_file = out_dir / (new_stub + '.jpeg')
-        if Path(existing_file).suffix == '.jpeg':
-            copyfile(existing_file, new_file)
-        # If the file extension is not jpeg, convert it to jpeg using `sips`
-        else:
-            cmd = [
-                'sips',
-                str(existing_file), '-s', 'format', 'jpeg', '--out',
-                str(new_file)
-            ]
-            run(cmd, check=True)
+    counts = convert_photos(
+        xw,
+        out_dir,
+        sizes=dict(sizes) if sizes else None,
+        strip_exif=strip_exif,
+        quality=quality,
+        overwrite=overwrite,
+        n_workers=jobs)
+    Log.info(
+        f'Converted {counts["converted"]} photos, skipped {counts["skipped"]} unchanged, {counts["failed"]} failed'
+    )
 
 
 # @main.command()
@@ -7,6 +7,7 @@ import geopandas as gpd
 import pandas as pd
 
 import geom
+from package_tiles import COPY_MODES, OUTPUT_FORMATS
 from package_tiles import package_tiles as _package_tiles
 from tiles import tiles_for_polygon
 from trail import Trail
@@ -128,7 +129,7 @@ def tiles_for_trail(
     default=(None, ),
     multiple=True,
     help=
-    'Paths to tile.json files for each directory. If not provided, assumes a tile JSON file is at directory/tile.json. Otherwise, the same number of options as directory must be provided.'
+    'Paths to tile.json files for each directory. If not provided, assumes a tile JSON file is at directory/tile.json, or a Tippecanoe metadata.json is at directory/metadata.json. Otherwise, the same number of options as directory must be provided. Zooms, bounds, and center in the packaged tile JSON are computed from the packaged tiles.'
 )
 @click.option(
     '-z',
@@ -159,11 +160,55 @@ def tiles_for_trail(
     help=
     'Whether to raise an error if a desired tile is not found in the directory.'
 )
+@click.option(
+    '-f',
+    '--format',
+    'output_format',
+    type=click.Choice(OUTPUT_FORMATS),
+    default='dir',
+    show_default=True,
+    help=
+    'Output format. dir writes {z}/{x}/{y} files; mbtiles and pmtiles write a single archive per tile source and buffer distance.'
+)
+@click.option(
+    '-m',
+    '--mode',
+    'copy_mode',
+    type=click.Choice(COPY_MODES),
+    default='copy',
+    show_default=True,
+    help=
+    'How to place tiles in the output directory. hardlink, reflink, and symlink require the source and output directories to be on the same filesystem.'
+)
+@click.option(
+    '-j',
+    '--jobs',
+    type=int,
+    required=False,
+    default=None,
+    help='Number of threads to use for copying tiles.')
+@click.option(
+    '--previous-manifest',
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, resolve_path=True),
+    required=False,
+    default=None,
+    help=
+    'Path to manifest.json of a previous package. If provided, only tiles that were added or changed since then are packaged, and the added, changed, and deleted tiles are listed in manifest_diff.json.'
+)
+@click.option(
+    '--write-manifest',
+    is_flag=True,
+    default=False,
+    help=
+    'Write manifest.json with the content hash of every tile, to use as --previous-manifest of a later package. Always written with --previous-manifest. Default: False'
+)
 @click.option(
     '-v', '--verbose', is_flag=True, default=False, help='Verbose output')
 def package_tiles(
         geometry, buffer, directory, tile_json, min_zoom, max_zoom, output,
-        raise_errors, verbose):
+        raise_errors, output_format, copy_mode, jobs, previous_manifest,
+        write_manifest, verbose):
     """Package tiles into directory based on distance from trail
 
     Example:
@@ -208,6 +253,11 @@ def package_tiles(
         Log.info(f'max_zooms={max_zoom}')
         Log.info(f'out_dir={output}')
         Log.info(f'raise_errors={raise_errors}')
+        Log.info(f'output_format={output_format}')
+        Log.info(f'copy_mode={copy_mode}')
+        Log.info(f'jobs={jobs}')
+        Log.info(f'previous_manifest={previous_manifest}')
+        Log.info(f'write_manifest={write_manifest}')
 
     _package_tiles(
         geometry_path=geometry,
@@ -218,4 +268,9 @@ def package_tiles(
         max_zooms=max_zoom,
         out_dir=output,
         raise_errors=raise_errors,
+        output_format=output_format,
+        copy_mode=copy_mode,
+        n_workers=jobs,
+        previous_manifest=previous_manifest,
+        write_manifest=write_manifest,
         verbose=verbose)
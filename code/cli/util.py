@@ -2,6 +2,8 @@ import json
 
 import click
 
+from tiles import tile_json_from_tippecanoe
+
 
 @click.command()
 @click.option(
@@ -45,15 +47,8 @@ def metadata_json_to_tile_json(name, desc, url, attribution, out_file, file):
     with open(file) as f:
         meta = json.load(f)
 
-    tj = {
-        'tilejson': '2.2.0',
-        'scheme': 'xyz',
-        'tiles': list(url),
-        'minzoom': int(meta['minzoom']),
-        'maxzoom': int(meta['maxzoom']),
-        'bounds': list(map(float, meta['bounds'].split(','))),
-        'center': list(map(float, meta['center'].split(','))),
-    }
+    tj = tile_json_from_tippecanoe(meta)
+    tj['tiles'] = list(url)
 
     if name is not None:
         tj['name'] = name
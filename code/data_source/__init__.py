@@ -1,5 +1,7 @@
 from .base import DataSource, find_data_dir
+from .calfire import CalFire
 from .epa import EPAAirNow
+from .fire_history import FireHistory
 from .gps_watch import GPSTracks
 from .halfmile import Halfmile
 from .manual import Towns
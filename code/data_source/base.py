@@ -97,8 +97,10 @@ class PolygonSource(DataSource):
         else:
             intersection = sjoin(gdf, trail, how='inner')
 
-        # Make sure I have valid geometries
-        intersection = geom.validate_geom_gdf(intersection)
+        # Make sure I have valid geometries, keeping a record of any repairs
+        report_path = self.raw_dir / f'{Path(self.filename).stem}_repaired.json'
+        intersection = geom.validate_geom_gdf(
+            intersection, report_path=report_path)
 
         # Do any specific steps, to be overloaded in subclasses
         intersection = self._post_download(intersection)
@@ -43,62 +43,62 @@ class CalFire(DataSource):
             - section: Halfmile section, i.e. `ca_a`
             - rx: if True, is a prescribed burn
         """
-        local_path = self.raw_dir / 'fire18_1.zip'
-        perims = gpd.read_file(
-            f'zip://{str(local_path)}!fire18_1.gdb', layer='firep18_1')
-
-        rxburn = gpd.read_file(
-            f'zip://{str(local_path)}!fire18_1.gdb', layer='rxburn18_1')
-
-        # Keep rows with non-null geometry
-        perims = perims[perims.geometry.notna()]
-        rxburn = rxburn[rxburn.geometry.notna()]
-
-        # Data goes back a long way. Keep fires since 2010
-        # Cast year column to numeric
-        perims['YEAR_'] = pd.to_numeric(perims['YEAR_'], errors='coerce')
-        rxburn['YEAR_'] = pd.to_numeric(rxburn['YEAR_'], errors='coerce')
-        # Keep since 2010
-        perims = perims[perims['YEAR_'] >= start_year]
-        rxburn = rxburn[rxburn['YEAR_'] >= start_year]
-
-        # Reproject to epsg 4326
-        perims = perims.to_crs(epsg=4326)
-        rxburn = rxburn.to_crs(epsg=4326)
+        combined = self.read(start_year=start_year)
         geometry = geometry.to_crs(epsg=4326)
 
         # Intersect with provided geometry
-        perims_intersection = sjoin(perims, geometry, how='inner')
-        rxburn_intersection = sjoin(rxburn, geometry, how='inner')
-
-        # Keep only necessary columns
         # 'section' is from the merge; is the Halfmile section
-        perims_cols_keep = [
-            'YEAR_', 'FIRE_NAME', 'GIS_ACRES', 'geometry', 'section'
-        ]
-        perims_intersection = perims_intersection[perims_cols_keep]
-        perims_intersection.loc[:, 'rx'] = False
-        perims_intersection = perims_intersection.rename(
-            columns={
-                'YEAR_': 'year',
-                'FIRE_NAME': 'name',
-                'GIS_ACRES': 'acres'
-            })
-
-        rxburn_cols_keep = [
-            'YEAR_', 'TREATMENT_NAME', 'GIS_ACRES', 'geometry', 'section'
-        ]
-        rxburn_intersection = rxburn_intersection[rxburn_cols_keep]
-        rxburn_intersection.loc[:, 'rx'] = True
-        rxburn_intersection = rxburn_intersection.rename(
-            columns={
-                'YEAR_': 'year',
-                'TREATMENT_NAME': 'name',
-                'GIS_ACRES': 'acres'
-            })
+        combined = sjoin(combined, geometry, how='inner')
+        cols_keep = ['year', 'name', 'acres', 'geometry', 'section', 'rx']
+        return combined[cols_keep]
+
+    def read(self, start_year=None):
+        """Read CalFire perimeters and prescribed burns
+
+        Args:
+            - start_year: first year (inclusive) to keep fire perimeters for. By
+              default keep all years.
+
+        Returns:
+            GeoDataFrame in EPSG 4326 with columns `year`, `name`, `acres`,
+            `rx`, `layer` and `geometry`. The index is the position of each
+            feature within its layer.
+        """
+        local_path = self.raw_dir / 'fire18_1.zip'
+        layers = {
+            'firep18_1': ('FIRE_NAME', False),
+            'rxburn18_1': ('TREATMENT_NAME', True)}
+
+        all_perims = []
+        for layer, (name_col, rx) in layers.items():
+            perims = gpd.read_file(
+                f'zip://{str(local_path)}!fire18_1.gdb', layer=layer)
+
+            # Keep rows with non-null geometry
+            perims = perims[perims.geometry.notna()]
+
+            # Data goes back a long way
+            # Cast year column to numeric
+            perims['YEAR_'] = pd.to_numeric(perims['YEAR_'], errors='coerce')
+            if start_year is not None:
+                perims = perims[perims['YEAR_'] >= start_year]
+
+            # Reproject to epsg 4326
+            perims = perims.to_crs(epsg=4326)
+
+            perims = perims[['YEAR_', name_col, 'GIS_ACRES', 'geometry']]
+            perims = perims.rename(
+                columns={
+                    'YEAR_': 'year',
+                    name_col: 'name',
+                    'GIS_ACRES': 'acres'
+                })
+            perims['rx'] = rx
+            perims['layer'] = layer
+            all_perims.append(perims)
 
         combined = gpd.GeoDataFrame(
-            pd.concat([perims_intersection, rxburn_intersection], sort=False))
+            pd.concat(all_perims, sort=False), crs='EPSG:4326')
         # Make the name Title Case instead of UPPER CASE
         combined['name'] = combined['name'].str.title()
 
@@ -6,12 +6,31 @@ to a minimum. Essentially no more dependencies can be added.
 """
 
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from io import BytesIO
 
 import geojson
+import numpy as np
 import requests
-from fastkml import kml
-from shapely.geometry import asShape, shape
+from shapely.geometry import MultiPolygon, Polygon
+from shapely.ops import unary_union
+
+try:
+    from lxml.etree import iterparse
+except ImportError:
+    # The standard library's parser has the same streaming interface
+    from xml.etree.ElementTree import iterparse
+
+try:
+    from geom.precision import round_geometries
+except ModuleNotFoundError:
+    # On AWS Lambda, geom/precision.py is copied next to this file
+    from precision import round_geometries
+
+# You can choose between just PM2.5, Ozone, and Combined
+AIR_MEASURES = ['PM25', 'Ozone', 'Combined']
 
 
 class EPAAirNow:
@@ -28,7 +47,7 @@ class EPAAirNow:
         self.api_key = os.getenv('EPA_AIRNOW_API_KEY')
         assert self.api_key is not None, 'EPA AIRNOW key missing'
 
-    def current_air_quality(self, bbox=None, air_measure='PM25'):
+    def current_air_quality(self, bbox=None, air_measure='PM25', time=None):
         """Get current air pollution conditions from EPA AirNow
 
         Args:
@@ -36,17 +55,57 @@ class EPAAirNow:
                 hour with your API key, so choose a large bounding box, i.e.
                 probably entire US.
             - air_measure: either 'PM25', 'Combined', or 'Ozone'
+            - time: UTC datetime of snapshot. Default: 3 hours ago
 
         Returns:
             geojson.FeatureCollection
         """
+        r = self.request(bbox=bbox, air_measure=air_measure, time=time)
+        if r.status_code != 200:
+            return None
+
+        return self.parse_response(r.content)
+
+    def current_air_quality_all(
+            self, bbox=None, air_measures=AIR_MEASURES, time=None):
+        """Get current conditions for several air measures in parallel
+
+        All measures are requested for the same hour, so that they describe the
+        same snapshot.
+
+        Args:
+            - bbox: Bounding box for API request
+            - air_measures: list of 'PM25', 'Combined', or 'Ozone'
+            - time: UTC datetime of snapshot. Default: 3 hours ago
+
+        Returns:
+            dict of air measure to geojson.FeatureCollection, or None if its
+            request failed
+        """
+        time = time or snapshot_time()
+        with ThreadPoolExecutor(max_workers=len(air_measures)) as executor:
+            results = executor.map(
+                lambda m: self.current_air_quality(
+                    bbox=bbox, air_measure=m, time=time), air_measures)
+            return dict(zip(air_measures, results))
+
+    def request(
+            self, bbox=None, air_measure='PM25', headers=None, time=None):
+        """Request current air quality KML from EPA AirNow
+
+        Args:
+            - bbox: Bounding box for API request
+            - air_measure: either 'PM25', 'Combined', or 'Ozone'
+            - headers: extra HTTP headers, e.g. for a conditional request
+            - time: UTC datetime of snapshot. Default: 3 hours ago
+
+        Returns:
+            requests.Response
+        """
         # Date string (yyyy-mm-ddTHH)
         # January 1, 2012 at 1PM would be sent as: 2012-01-01T13
-        # NOTE: they're generally a few hours behind, now - 3 hours should be
-        # good generally
-        time = datetime.utcnow()
-        fmt = '%Y-%m-%dT%H'
-        time_str = (time - timedelta(hours=3)).strftime(fmt)
+        time = time or snapshot_time()
+        time_str = time.strftime('%Y-%m-%dT%H')
 
         # This is a huge bounding box for all 50 US States, from here:
         # https://gist.github.com/graydon/11198540
@@ -54,10 +113,8 @@ class EPAAirNow:
             bbox = (-171.791110603, 18.91619, -66.96466, 71.3577635769)
         bbox_str = [str(x) for x in bbox]
 
-        # You can choose between just PM2.5, Ozone, and Combined
-        air_measure_valid_values = ['PM25', 'Combined', 'Ozone']
-        msg = 'air_measure must be one of {air_measure_valid_values}'
-        assert air_measure in air_measure_valid_values, msg
+        msg = f'air_measure must be one of {AIR_MEASURES}'
+        assert air_measure in AIR_MEASURES, msg
 
         url = f'http://www.airnowapi.org/aq/kml/{air_measure}/'
         params = {
@@ -68,23 +125,31 @@ class EPAAirNow:
         }
 
         # Send GET request
-        r = requests.get(url, params=params)
-        if r.status_code != 200:
-            return None
+        return requests.get(url, params=params, headers=headers)
+
+    def parse_response(self, content):
+        """Convert KML response into simplified GeoJSON
+
+        Args:
+            - content: KML bytes
 
+        Returns:
+            geojson.FeatureCollection
+        """
         # Parse KML response
-        geometries, properties = self.parse_kml(r.content)
+        geometries, properties = self.parse_kml(content)
 
         # Convert KML properties into rgb, aqi properties
         properties = self.parse_properties(properties)
 
-        # Simplify geometries
-        geometries = [g.simplify(0.001) for g in geometries]
+        # Contours of the same AQI level are merged into one geometry, so that
+        # shared edges are simplified and stored once
+        geometries, properties = dissolve_by_aqi(geometries, properties)
 
-        # Reduce coordinate precision
+        # Simplify geometries and reduce coordinate precision
         # 5 digits is still around 1m precision
         # https://en.wikipedia.org/wiki/Decimal_degrees
-        geometries = [round_geometry(geom=g, digits=5) for g in geometries]
+        geometries = round_geometries(geometries, digits=5, tolerance=0.001)
 
         # Coerce to GeoJSON FeatureCollection
         features = [
@@ -97,10 +162,11 @@ class EPAAirNow:
     def parse_kml(self, content):
         """Parse KML response
 
-        Not sure why, but must be _bytes_ not _text_.
+        The KML is streamed with `iterparse`, and each placemark's polygons are
+        built directly from arrays of its coordinates.
 
         Args:
-            - content: KML string
+            - content: KML bytes
 
         Returns:
             [List[Polygon], List[dict]]
@@ -108,35 +174,39 @@ class EPAAirNow:
             - list of shapely geometries;
             - list of dicts containing properties from KML file
         """
-        k = kml.KML()
-        k.from_string(content)
-
-        # Loop over kml objects and create a feature collection
+        all_styles = {}
         geometries = []
         properties = []
-        for document in k.features():
-            all_styles = {}
-            styles = list(document.styles())
-            for style in styles:
-                style_id = style.id
-                polystyle = list(style.styles())[0]
-                d = {
-                    'color': polystyle.color,
-                    'fill': polystyle.fill,
-                    'outline': polystyle.outline
+        for _, elem in iterparse(BytesIO(content), events=('end', )):
+            tag = _local_name(elem.tag)
+            if tag == 'Style':
+                polystyle = _find(elem, 'PolyStyle')
+                if polystyle is None:
+                    continue
+
+                all_styles[elem.get('id')] = {
+                    'color': _find_text(polystyle, 'color'),
+                    'fill': int(_find_text(polystyle, 'fill', '1')),
+                    'outline': int(_find_text(polystyle, 'outline', '1'))
                 }
-                all_styles[style_id] = d
+                elem.clear()
 
-            for folder in document.features():
-                for placemark in folder.features():
-                    style_id = placemark.styleUrl.replace('#', '')
-                    style = all_styles.get(style_id)
+            elif tag == 'Placemark':
+                style_id = _find_text(elem, 'styleUrl').replace('#', '')
+                style = all_styles.get(style_id)
 
-                    props = {'style_id': style_id}
-                    props.update(style)
+                props = {'style_id': style_id}
+                props.update(style)
 
-                    geometries.append(placemark.geometry)
-                    properties.append(props)
+                polygons = [
+                    _parse_polygon(e) for e in elem.iter()
+                    if _local_name(e.tag) == 'Polygon']
+                if len(polygons) == 1:
+                    geometries.append(polygons[0])
+                else:
+                    geometries.append(MultiPolygon(polygons))
+                properties.append(props)
+                elem.clear()
 
         return geometries, properties
 
@@ -176,17 +246,57 @@ class EPAAirNow:
             '126,0,35': 'hazardous',
         }
 
-        # Turn color property to rgb
-        rgb_colors = [kmlcolor_to_rgb(p['color']) for p in properties]
-
-        # Map using aqi_mapping
-        aqi_values = [aqi_mapping[c] for c in rgb_colors]
+        # Only a handful of colors are used, so convert and map each distinct
+        # color once, and look up the results for all features
+        colors, inverse = np.unique(
+            [p['color'] for p in properties], return_inverse=True)
+        rgb_colors = np.array([kmlcolor_to_rgb(c) for c in colors])
+        aqi_values = np.array([aqi_mapping[c] for c in rgb_colors])
 
         # Create properties dicts with only `aqi` and `rgb` keys
         return [{
             'aqi': aqi,
             'rgb': rgb
-        } for aqi, rgb in zip(aqi_values, rgb_colors)]
+        } for aqi, rgb in zip(aqi_values[inverse].tolist(),
+                              rgb_colors[inverse].tolist())]
+
+
+# AQI levels from least to most severe
+AQI_LEVELS = [
+    'good', 'moderate', 'usg', 'unhealthy', 'very_unhealthy', 'hazardous']
+
+
+def snapshot_time():
+    """UTC hour of the latest AirNow snapshot
+
+    AirNow is generally a few hours behind, so now - 3 hours should be good
+    generally.
+    """
+    time = datetime.utcnow() - timedelta(hours=3)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def dissolve_by_aqi(geometries, properties):
+    """Merge geometries with the same AQI level
+
+    Args:
+        - geometries: List[Polygon or MultiPolygon]
+        - properties: List[dict] with `aqi` and `rgb` keys
+
+    Returns:
+        [List[Polygon or MultiPolygon], List[dict]], one per AQI level present,
+        from least to most severe, so that the most severe levels are drawn on
+        top
+    """
+    groups = {}
+    for geometry, props in zip(geometries, properties):
+        if not geometry.is_valid:
+            geometry = geometry.buffer(0)
+        groups.setdefault(props['aqi'], ([], props))[0].append(geometry)
+
+    levels = sorted(groups, key=AQI_LEVELS.index)
+    dissolved = [unary_union(groups[level][0]) for level in levels]
+    return dissolved, [groups[level][1] for level in levels]
 
 
 def kmlcolor_to_rgb(s):
@@ -209,90 +319,48 @@ def kmlcolor_to_rgb(s):
     return f'{r},{g},{b}'
 
 
-def round_geometry(geom, digits):
-    """Round coordinates of geometry to desired digits
+def _local_name(tag):
+    """Tag name without XML namespace"""
+    return tag.rsplit('}', 1)[-1]
 
-    Args:
-        - geom: geometry to round coordinates of
-        - digits: number of decimal places to round
 
-    Returns:
-        geometry of same type as provided
-    """
-    gj = [geojson.Feature(geometry=geom)]
-    truncated = list(coord_precision(gj, precision=digits))
-    return shape(truncated[0].geometry)
+def _find(elem, name):
+    """Find first descendant of element with local name"""
+    for e in elem.iter():
+        if _local_name(e.tag) == name:
+            return e
 
+    return None
 
-def coord_precision(features, precision, validate=True):
-    """Truncate precision of GeoJSON features
 
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
+def _find_text(elem, name, default=None):
+    """Text of first descendant of element with local name"""
+    e = _find(elem, name)
+    if e is None or e.text is None:
+        return default
 
-    The MIT License (MIT)
+    return e.text.strip()
 
-    Copyright (c) 2016 Matthew Perry
 
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
+def _parse_polygon(elem):
+    """Create Polygon from KML Polygon element"""
+    exterior = None
+    interiors = []
+    for e in elem.iter():
+        name = _local_name(e.tag)
+        if name == 'outerBoundaryIs':
+            exterior = _parse_coordinates(_find_text(e, 'coordinates'))
+        elif name == 'innerBoundaryIs':
+            interiors.append(_parse_coordinates(_find_text(e, 'coordinates')))
 
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
+    return Polygon(exterior, interiors)
 
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
-    """
-    for feature in features:
-        coords = _set_precision(feature['geometry']['coordinates'], precision)
-        feature['geometry']['coordinates'] = coords
-        if validate:
-            geom = asShape(feature['geometry'])
-            geom.is_valid
-        yield feature
-
-
-def _set_precision(coords, precision):
-    """Truncate precision of coordinates
-
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
-
-    The MIT License (MIT)
-
-    Copyright (c) 2016 Matthew Perry
-
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
-
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
-
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
+
+def _parse_coordinates(text):
+    """Parse KML coordinates into (N, 2) array
+
+    KML coordinates are tuples of `lon,lat[,alt]` separated by whitespace.
     """
-    result = []
-    try:
-        return round(coords, int(precision))
-    except TypeError:
-        for coord in coords:
-            result.append(_set_precision(coord, precision))
-    return result
+    n_dims = text.split(None, 1)[0].count(',') + 1
+    values = np.array(re.split(r'[\s,]+', text), dtype=float)
+    return values.reshape(-1, n_dims)[:, :2]
@@ -0,0 +1,336 @@
+import hashlib
+import json
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from geopandas.tools import sjoin
+from shapely.geometry import LineString, Point
+from shapely.strtree import STRtree
+
+from .base import DataSource
+from .calfire import CalFire
+from .nifc import NIFC
+
+# Shapely 2.0+ can query an STRtree with a whole array of geometries
+_SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
+# Equal area projection for comparing areas of fires, CONUS Albers
+EQUAL_AREA_EPSG = 5070
+
+METERS_PER_MILE = 1609.344
+
+
+class FireHistory(DataSource):
+    """Historical fire perimeters from NIFC and CalFire
+
+    NIFC perimeters cover the whole country, but only 2000-2018; CalFire
+    perimeters and prescribed burns cover California back to the 1800s. The two
+    are combined into a single GeoParquet store. A CalFire fire is dropped when
+    it overlaps a NIFC fire of the same year, so that California fires aren't
+    counted twice.
+    """
+    def __init__(self):
+        super(FireHistory, self).__init__()
+
+        self.raw_dir = self.data_dir / 'raw' / 'fire_history'
+        self.raw_dir.mkdir(parents=True, exist_ok=True)
+
+        self.store_path = self.raw_dir / 'fires.parquet'
+        self.trail_path = self.raw_dir / 'trail_intersections.parquet'
+
+    def perimeters(self, geometry: gpd.GeoDataFrame, start_year=2010):
+        """Get historical fire perimeters that intersect geometry
+
+        Args:
+            - geometry: geometry to intersect with fires. No buffer is taken
+              within this command. If you want a buffer around the trail, take
+              the buffer before passing through here.
+            - start_year: first year (inclusive) to keep fire perimeters for
+
+        Returns:
+            GeoDataFrame with fire perimeters since `start_year`.
+
+            All columns are:
+            - fire_id: unique id of fire, prefixed by its source
+            - source: `nifc` or `calfire`
+            - year: year of burn
+            - name: name of burn in Title Case
+            - acres: acre count of burn
+            - firecode: NIFC identifier; None for CalFire fires
+            - inciwebid: link to inciweb database, i.e.
+              https://inciweb.nwcg.gov/incident/{inciwebid}/; None for CalFire
+              fires
+            - rx: if True, is a prescribed burn
+            - geometry: geometry of burn
+            - section: Halfmile section, i.e. `ca_a`
+        """
+        geometry = geometry.to_crs(epsg=4326)
+        fires = self.read(start_year=start_year, bbox=geometry.total_bounds)
+
+        # A fire that intersects more than one geometry, e.g. two trail
+        # sections, is only kept once
+        fires = sjoin(fires, geometry, how='inner')
+        fires = fires[~fires['fire_id'].duplicated()]
+        cols_keep = [
+            'fire_id', 'source', 'year', 'name', 'acres', 'firecode',
+            'inciwebid', 'rx', 'geometry', 'section']
+        return fires[cols_keep]
+
+    def read(self, start_year=None, bbox=None):
+        """Read fires from store
+
+        Args:
+            - start_year: first year (inclusive) to keep fire perimeters for
+            - bbox: (minx, miny, maxx, maxy) in EPSG 4326 that fires must
+              overlap
+
+        Returns:
+            GeoDataFrame of fires in EPSG 4326
+        """
+        filters = []
+        if start_year is not None:
+            filters.append(('year', '>=', start_year))
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            filters.extend([
+                ('maxx', '>=', minx),
+                ('minx', '<=', maxx),
+                ('maxy', '>=', miny),
+                ('miny', '<=', maxy),
+            ])
+
+        return gpd.read_parquet(self.store(), filters=filters or None)
+
+    def store(self, overwrite=False, min_overlap=0.5):
+        """Combine NIFC and CalFire perimeters into a single GeoParquet store
+
+        Like the NIFC cache, fires are sorted along a Hilbert curve with their
+        bounds stored as columns, so that reads can skip row groups by year and
+        bounding box. The store is rebuilt when either source is newer.
+
+        Args:
+            - overwrite: if True, rebuild store even if up to date
+            - min_overlap: minimum share of the area of the smaller of two fires
+              of the same year that must overlap for the CalFire fire to be
+              considered a duplicate of the NIFC fire
+
+        Returns:
+            path to store
+        """
+        calfire = CalFire()
+        calfire_path = calfire.raw_dir / 'fire18_1.zip'
+        nifc_path = NIFC().perimeters_cache()
+        if not overwrite and self.store_path.exists():
+            mtime = self.store_path.stat().st_mtime
+            if mtime >= max(calfire_path.stat().st_mtime,
+                            nifc_path.stat().st_mtime):
+                return self.store_path
+
+        nifc = gpd.read_parquet(nifc_path)
+        # The NIFC data can have several perimeters of a fire on different
+        # dates; keep the latest one
+        nifc = nifc.sort_values('datecurren').drop_duplicates(
+            subset=['uniquefire'], keep='last')
+        nifc = gpd.GeoDataFrame(
+            {
+                'fire_id': 'nifc-' + nifc['uniquefire'].astype(str),
+                'source': 'nifc',
+                'year': nifc['fireyear'].astype('int64'),
+                'name': nifc['incidentna'].str.title(),
+                'acres': nifc['gisacres'],
+                'firecode': nifc['firecode'],
+                'inciwebid': nifc['inciwebid'],
+                'rx': False,
+                'geometry': nifc.geometry},
+            crs=nifc.crs)
+
+        # The index of each CalFire layer is the position of each feature
+        cf = calfire.read()
+        cf['fire_id'] = 'calfire-' + cf['layer'] + '-' + cf.index.astype(str)
+        cf = cf[cf['year'].notna()].reset_index(drop=True)
+        cf = gpd.GeoDataFrame(
+            {
+                'fire_id': cf['fire_id'],
+                'source': 'calfire',
+                'year': cf['year'].astype('int64'),
+                'name': cf['name'],
+                'acres': cf['acres'],
+                'firecode': None,
+                'inciwebid': None,
+                'rx': cf['rx'],
+                'geometry': cf.geometry},
+            crs=cf.crs)
+
+        duplicated = find_overlapping(cf, nifc, min_overlap=min_overlap)
+        fires = pd.concat([nifc, cf[~duplicated]], ignore_index=True)
+        fires = gpd.GeoDataFrame(fires, crs='EPSG:4326')
+
+        bounds = fires.bounds
+        for col in ['minx', 'miny', 'maxx', 'maxy']:
+            fires[col] = bounds[col].to_numpy(dtype=np.float64)
+
+        order = np.argsort(fires.geometry.hilbert_distance(), kind='stable')
+        fires = fires.iloc[order].reset_index(drop=True)
+
+        tmp_path = self.store_path.with_suffix('.parquet.tmp')
+        fires.to_parquet(tmp_path, index=False, row_group_size=2000)
+        tmp_path.replace(self.store_path)
+        return self.store_path
+
+    def trail_intersections(
+            self, trail: LineString, crs: int, overwrite=False):
+        """Length and mile range of trail within each fire
+
+        Results are cached, and only recomputed when the trail or the store
+        changes.
+
+        Args:
+            - trail: LineString of trail in EPSG 4326, from its start at mile 0
+            - crs: EPSG code of projected coordinate system in meters
+            - overwrite: if True, recompute even if cached
+
+        Returns:
+            DataFrame indexed by `fire_id`, for fires that the trail passes
+            through, with columns:
+            - length: length of trail within fire in meters
+            - start_mile: first trail mile within fire
+            - end_mile: last trail mile within fire
+        """
+        store_path = self.store()
+        key = hashlib.md5(trail.wkb)
+        key.update(str(crs).encode())
+        key.update(str(store_path.stat().st_mtime_ns).encode())
+        key = key.hexdigest()
+
+        if not overwrite and self.trail_path.exists():
+            table = pq.read_table(self.trail_path)
+            metadata = table.schema.metadata or {}
+            if json.loads(metadata.get(b'key', b'null')) == key:
+                return table.to_pandas().set_index('fire_id')
+
+        fires = self.read(bbox=trail.bounds)
+        fires = fires.to_crs(epsg=crs)
+        projected = gpd.GeoSeries([trail], crs=4326).to_crs(epsg=crs).iloc[0]
+        df = intersect_line_with_polygons(projected, fires.geometry.values)
+        df.index = fires['fire_id'].values[df.index]
+        df.index.name = 'fire_id'
+        df['start_mile'] = df['start'] / METERS_PER_MILE
+        df['end_mile'] = df['end'] / METERS_PER_MILE
+        df = df[['length', 'start_mile', 'end_mile']]
+
+        table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+        table = table.replace_schema_metadata({'key': json.dumps(key)})
+        pq.write_table(table, self.trail_path)
+        return df
+
+
+def find_overlapping(left, right, min_overlap=0.5):
+    """Find fires in left that duplicate a fire of the same year in right
+
+    Candidate pairs come from an STRtree of `right`; only pairs of the same
+    year have their overlap computed.
+
+    Args:
+        - left: GeoDataFrame of fires with `year` column
+        - right: GeoDataFrame of fires with `year` column
+        - min_overlap: minimum area of intersection, as a share of the area of
+          the smaller fire
+
+    Returns:
+        boolean array, True for rows of left that are duplicates
+    """
+    left_geoms = left.to_crs(epsg=EQUAL_AREA_EPSG).geometry.values
+    right_geoms = right.to_crs(epsg=EQUAL_AREA_EPSG).geometry.values
+    left_years = left['year'].to_numpy()
+    right_years = right['year'].to_numpy()
+
+    duplicated = np.zeros(len(left), dtype=bool)
+    for i, j in zip(*_query_pairs(left_geoms, right_geoms)):
+        if duplicated[i] or left_years[i] != right_years[j]:
+            continue
+
+        a = left_geoms[i]
+        b = right_geoms[j]
+        smaller = min(a.area, b.area)
+        if smaller > 0 and a.intersection(b).area / smaller >= min_overlap:
+            duplicated[i] = True
+
+    return duplicated
+
+
+def intersect_line_with_polygons(line, polygons, n_coords=64):
+    """Find length and range of line within each polygon
+
+    The line is split into pieces of `n_coords` coordinates indexed by an
+    STRtree, so that each polygon is only intersected with the few pieces of
+    line that are near it, instead of the full line.
+
+    Args:
+        - line: projected LineString
+        - polygons: array of projected polygons
+        - n_coords: number of coordinates in each piece of line
+
+    Returns:
+        DataFrame indexed by position in `polygons`, for polygons that the
+        line intersects, with columns `length`, and `start` and `end`
+        distances along the line
+    """
+    coords = np.asarray(line.coords)
+    starts = np.arange(0, len(coords) - 1, n_coords - 1)
+    pieces = [LineString(coords[s:s + n_coords]) for s in starts]
+    offsets = np.concatenate([[0], np.cumsum([p.length for p in pieces])])
+
+    rows = []
+    for j, i in zip(*_query_pairs(polygons, pieces)):
+        piece = pieces[i]
+        inter = piece.intersection(polygons[j])
+        if inter.is_empty or inter.length == 0:
+            continue
+
+        # The ends of each part of the intersection bound its range along the
+        # piece
+        dists = [piece.project(Point(c)) for c in _part_ends(inter)]
+        rows.append((
+            j, inter.length, offsets[i] + min(dists),
+            offsets[i] + max(dists)))
+
+    df = pd.DataFrame(rows, columns=['polygon', 'length', 'start', 'end'])
+    return df.groupby('polygon').agg({
+        'length': 'sum',
+        'start': 'min',
+        'end': 'max'})
+
+
+def _query_pairs(geoms, tree_geoms):
+    """Find pairs of intersecting geometries with an STRtree
+
+    Returns:
+        (indices into geoms, indices into tree_geoms) of intersecting pairs
+    """
+    tree = STRtree(tree_geoms)
+    if _SHAPELY_2:
+        return tree.query(geoms, predicate='intersects')
+
+    # Shapely 1.8 queries one geometry at a time and only by bounding box
+    pairs = []
+    for i, geom in enumerate(geoms):
+        for j in tree.query_items(geom):
+            if geom.intersects(tree_geoms[j]):
+                pairs.append((i, j))
+
+    return np.array(pairs, dtype=int).reshape(-1, 2).T
+
+
+def _part_ends(geom):
+    """First and last coordinates of each line in geometry"""
+    if hasattr(geom, 'geoms'):
+        return [c for g in geom.geoms for c in _part_ends(g)]
+
+    if geom.geom_type != 'LineString':
+        return []
+
+    return [geom.coords[0], geom.coords[-1]]
@@ -1,56 +1,59 @@
-from subprocess import run
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 import geojson
 import geopandas as gpd
-import gpxpy
-import gpxpy.gpx
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lxml import etree
 
 from .base import DataSource
 
+try:
+    from fit import read_fit_points
+except ModuleNotFoundError:
+    # Development in IPython
+    import sys
+    sys.path.append('../')
+    from fit import read_fit_points
+
 
 class GPSTracks(DataSource):
     def __init__(self):
         super(GPSTracks, self).__init__()
         self.raw_dir = self.data_dir / 'raw' / 'tracks'
+        self.points_cache_path = (
+            self.data_dir / 'pct' / 'point' / 'gps_track' / 'points.parquet')
 
-    def convert_fit(self):
+    def convert_fit(self, n_workers=None):
         """
         The raw files of these GPS tracks are stored in the Git repository, but
         they still need to be converted into a helpful format.
 
-        There doesn't appear to be a great Python package to work with .fit
-        files, so I'm using [GPSBabel][gpsbabel] to do the conversion.
+        FIT files are decoded natively with `fit.read_fit_points`, in parallel
+        across files, and joined into a single GeoJSON file with one LineString
+        per FIT file.
 
-        [gpsbabel]: https://www.gpsbabel.org
+        Args:
+            - n_workers: number of processes for decoding FIT files; by default
+              the number of CPUs
         """
+        fit_files = sorted(self.raw_dir.glob('*.fit'))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(read_fit_points, fit_files))
 
-        gpsbabel_path = '/Applications/GPSBabelFE.app/Contents/MacOS/gpsbabel'
-
-        for fit_file in self.raw_dir.glob('*.fit'):
-            geojson_path = fit_file.parents[0] / (fit_file.stem + '.geojson')
-            cmd = [
-                gpsbabel_path, '-i', 'garmin_fit', '-f',
-                str(fit_file), '-o', 'geojson', '-F',
-                str(geojson_path)
-            ]
-            run(cmd, check=True)
-
-            gpx_path = fit_file.parents[0] / (fit_file.stem + '.gpx')
-            cmd = [
-                gpsbabel_path, '-i', 'garmin_fit', '-f',
-                str(fit_file), '-o', 'gpx', '-F',
-                str(gpx_path)
-            ]
-            run(cmd, check=True)
-
-        # Now join all of these together
         features = []
-        for geojson_file in self.raw_dir.glob('*.geojson'):
-            with open(geojson_file) as f:
-                d = geojson.load(f)
+        for fit_file, points in zip(fit_files, results):
+            if len(points['time']) < 2:
+                continue
 
-            features.extend(d['features'])
+            coords = np.column_stack([points['lon'], points['lat']])
+            line = geojson.LineString(np.round(coords, 6).tolist())
+            props = {'name': fit_file.stem}
+            features.append(geojson.Feature(geometry=line, properties=props))
 
         fc = geojson.FeatureCollection(features)
         save_dir = self.data_dir / 'pct' / 'line' / 'gps_track'
@@ -63,8 +66,8 @@ class GPSTracks(DataSource):
             self.data_dir / 'pct' / 'line' / 'gps_track' / 'gps_track.geojson')
         return gdf
 
-    def points_df(self):
-        """Load GPX track points into Pandas DataFrame
+    def points_df(self, geometry=True, overwrite=False, n_workers=None):
+        """Load FIT and GPX track points into Pandas DataFrame
 
         GeoJSON files don't store other helpful information like time or
         altitude, which are stored in a GPX file. This creates a pandas
@@ -78,41 +81,175 @@ class GPSTracks(DataSource):
         All track points should have a latitude, longitude, and timestamp. Some,
         but not all, track points also have an elevation.
 
+        Points are read from the `Move_*.fit` files from the watch, and from any
+        `Move_*.gpx` files that don't have a matching FIT file. Files are
+        parsed in parallel and the sorted points are cached in
+        `self.points_cache_path` as a Parquet file. The cache is used as long
+        as the names, sizes, and modification times of the files are
+        unchanged.
+
+        Args:
+            - geometry: if True, return GeoDataFrame with Point geometries.
+              Otherwise return DataFrame with `lat` and `lon` columns, which
+              is much cheaper to create.
+            - overwrite: if True, reparse track files even if cache is current
+            - n_workers: number of processes for parsing track files; by
+              default the number of CPUs
+
         Returns:
-            DataFrame with columns
-            - time: tz aware column of timestamps
+            DataFrame indexed by `time`, a tz aware index of UTC timestamps,
+            with columns
             - ele: elevation in m; often missing
-            - lat: latitude
-            - lon: longitude
+            - lat: latitude (float32, only if `geometry` is False)
+            - lon: longitude (float32, only if `geometry` is False)
+            - geometry: Point (only if `geometry` is True)
         """
-        points = []
-        for gpx_file in self.raw_dir.glob('Move_*.gpx'):
-            with gpx_file.open() as f:
-                gpx = gpxpy.parse(f)
-
-                for track in gpx.tracks:
-                    for segment in track.segments:
-                        for point in segment.points:
-                            points.append(point)
-
-        rows = [{
-            'time': p.time,
-            'ele': p.elevation,
-            'lat': p.latitude,
-            'lon': p.longitude
-        } for p in points]
-        df = pd.DataFrame.from_records(rows)
-
-        # Sort df on timestamp
-        df = df.sort_values('time')
+        fit_paths = sorted(self.raw_dir.glob('Move_*.fit'))
+        fit_stems = {p.stem for p in fit_paths}
+        gpx_paths = [
+            p for p in sorted(self.raw_dir.glob('Move_*.gpx'))
+            if p.stem not in fit_stems]
+        paths = fit_paths + gpx_paths
+        sources = [[p.name, p.stat().st_size, p.stat().st_mtime_ns]
+                   for p in paths]
+
+        points = None
+        if not overwrite:
+            points = self._load_points_cache(sources)
+
+        if points is None:
+            points = read_track_points(paths, n_workers=n_workers)
+            self._save_points_cache(points, sources)
+
+        index = pd.to_datetime(points['time'], utc=True).rename('time')
+        columns = {name: points[name] for name in ['ele', 'lat', 'lon']}
+        df = pd.DataFrame(columns, index=index)
+
+        if not geometry:
+            return df
 
         # Coerce lat/lon columns to GeoDataFrame geometry
         df = gpd.GeoDataFrame(
             df,
             geometry=gpd.points_from_xy(df['lon'], df['lat']),
-            crs={'init': 'epsg:4326'})
+            crs='EPSG:4326')
         df = df.drop(['lat', 'lon'], axis=1)
-
-        # Set timestamp as index
-        df = df.set_index('time')
         return df
+
+    def _load_points_cache(self, sources):
+        """Load cached point arrays if created from the same source files
+
+        Returns:
+            dict of point arrays, or None if cache is missing or stale
+        """
+        if not self.points_cache_path.exists():
+            return None
+
+        table = pq.read_table(self.points_cache_path)
+        metadata = table.schema.metadata or {}
+        if json.loads(metadata.get(b'sources', b'null')) != sources:
+            return None
+
+        points = {
+            name: table.column(name).to_numpy()
+            for name in POINT_DTYPES.keys()}
+        points['time'] = points['time'].view('int64')
+        return points
+
+    def _save_points_cache(self, points, sources):
+        columns = {
+            'time': pa.array(points['time'], type=pa.timestamp('ns', tz='UTC')),
+            'lat': points['lat'],
+            'lon': points['lon'],
+            'ele': points['ele']}
+        table = pa.table(columns).replace_schema_metadata(
+            {'sources': json.dumps(sources)})
+
+        self.points_cache_path.parent.mkdir(exist_ok=True, parents=True)
+        pq.write_table(table, self.points_cache_path)
+
+
+# Dtypes of arrays of track points. Time is nanoseconds since the epoch in UTC.
+# Float32 keeps positions to within about a meter.
+POINT_DTYPES = {
+    'time': np.int64,
+    'lat': np.float32,
+    'lon': np.float32,
+    'ele': np.float32,
+}
+
+
+def read_track_points(paths, n_workers=None):
+    """Read track points from FIT or GPX files in parallel
+
+    Args:
+        - paths: paths to FIT or GPX files
+        - n_workers: number of processes; by default the number of CPUs
+
+    Returns:
+        dict of NumPy arrays with keys and dtypes of `POINT_DTYPES`, sorted by
+        time
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(_read_points, paths))
+
+    points = {
+        name: np.concatenate([r[name] for r in results] +
+                             [np.empty(0, dtype=dtype)])
+        for name, dtype in POINT_DTYPES.items()}
+
+    order = np.argsort(points['time'], kind='stable')
+    return {name: arr[order] for name, arr in points.items()}
+
+
+def _read_points(path):
+    if path.suffix.lower() == '.fit':
+        return read_fit_points(path)
+
+    return read_gpx_points(path)
+
+
+def read_gpx_points(path):
+    """Stream track points from GPX file into typed arrays
+
+    Track points are read one at a time with lxml's iterparse and cleared once
+    read, so memory use doesn't depend on the size of the file.
+
+    Args:
+        - path: path to GPX file
+
+    Returns:
+        dict of NumPy arrays with keys and dtypes of `POINT_DTYPES`. Elevation
+        is NaN where missing. Points without a timestamp are dropped.
+    """
+    lat = array('f')
+    lon = array('f')
+    ele = array('f')
+    times = []
+    for _, elem in etree.iterparse(str(path), tag='{*}trkpt'):
+        lat.append(float(elem.get('lat')))
+        lon.append(float(elem.get('lon')))
+        ele_text = time_text = None
+        for child in elem:
+            if child.tag.endswith('}ele'):
+                ele_text = child.text
+            elif child.tag.endswith('}time'):
+                time_text = child.text
+
+        ele.append(float(ele_text) if ele_text else np.nan)
+        times.append(time_text)
+
+        # Free memory of points already read
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    time = pd.to_datetime(times, utc=True, format='ISO8601')
+    has_time = ~time.isna()
+    points = {
+        'time': time.tz_convert(None).values.astype('datetime64[ns]').view(
+            np.int64),
+        'lat': np.frombuffer(lat, dtype=np.float32),
+        'lon': np.frombuffer(lon, dtype=np.float32),
+        'ele': np.frombuffer(ele, dtype=np.float32)}
+    return {name: arr[has_time] for name, arr in points.items()}
@@ -1,6 +1,7 @@
 from urllib.request import urlretrieve
 
 import geopandas as gpd
+import numpy as np
 from geopandas.tools import sjoin
 
 from .base import DataSource
@@ -18,6 +19,9 @@ class NIFC(DataSource):
         self.raw_dir = self.data_dir / 'raw' / 'nifc'
         self.raw_dir.mkdir(parents=True, exist_ok=True)
 
+        self.zip_path = self.raw_dir / 'ef25d7e8c9f3499ba9e3d8e09606e488_0.zip'
+        self.cache_path = self.raw_dir / 'perimeters.parquet'
+
     def download(self, overwrite=False):
         # This URL has all perimeters ported from GeoMAC for the years 2000-2018.
         # https://data-nifc.opendata.arcgis.com/datasets/historic-geomac-perimeters-combined-2000-2018
@@ -33,9 +37,8 @@ class NIFC(DataSource):
         Args:
             - geometry: geometry to intersect with fires. No buffer is taken
               within this command. If you want a buffer around the trail, take
-              the buffer before passing through here. Also, if you're merging
-              CalFire data, you'd want to restrict the geometry to just Oregon
-              and Washington before passing through here.
+              the buffer before passing through here. For fires merged with
+              CalFire data, use `FireHistory` instead.
             - start_year: first year (inclusive) to keep fire perimeters for
 
         Returns:
@@ -51,22 +54,19 @@ class NIFC(DataSource):
             - geometry: geometry of burn
             - section: Halfmile section, i.e. `ca_a`
         """
-        local_path = self.raw_dir / 'ef25d7e8c9f3499ba9e3d8e09606e488_0.zip'
-
-        perims = gpd.read_file(
-            f'zip://{str(local_path)}!Historic_GeoMAC_Perimeters_Combined_20002018.shp'
-        )
-
-        # Keep rows with non-null geometry
-        perims = perims[perims.geometry.notna()]
-
-        # Data covers 2000-2018
-        # Keep fires since start_year
-        perims = perims[perims['fireyear'] >= start_year]
-
-        # Reproject to epsg 4326
-        perims = perims.to_crs(epsg=4326)
         geometry = geometry.to_crs(epsg=4326)
+        minx, miny, maxx, maxy = geometry.total_bounds
+
+        # Only row groups, and then rows, whose year and bounding box could
+        # match are read from the cache
+        filters = [
+            ('fireyear', '>=', start_year),
+            ('maxx', '>=', minx),
+            ('minx', '<=', maxx),
+            ('maxy', '>=', miny),
+            ('miny', '<=', maxy),
+        ]
+        perims = gpd.read_parquet(self.perimeters_cache(), filters=filters)
 
         # Intersect with provided geometry
         # Note that when you intersect with this sjoin, if a geometry from
@@ -98,3 +98,51 @@ class NIFC(DataSource):
         perims_intersection['name'] = perims_intersection['name'].str.title()
 
         return perims_intersection
+
+    def perimeters_cache(self, overwrite=False):
+        """Convert perimeters shapefile to a GeoParquet cache
+
+        The shapefile is read and reprojected to EPSG 4326 once. Perimeters are
+        sorted along a Hilbert curve, so that each Parquet row group covers a
+        small area, and the bounds of each perimeter are stored as `minx`,
+        `miny`, `maxx` and `maxy` columns. Parquet statistics of these and
+        `fireyear` let reads skip row groups that can't match a filter.
+
+        The cache is rebuilt when the downloaded zip file is newer.
+
+        Args:
+            - overwrite: if True, rebuild cache even if up to date
+
+        Returns:
+            path to cache
+        """
+        if not overwrite and self.cache_path.exists() and \
+                self.cache_path.stat().st_mtime >= self.zip_path.stat().st_mtime:
+            return self.cache_path
+
+        perims = gpd.read_file(
+            f'zip://{str(self.zip_path)}!Historic_GeoMAC_Perimeters_Combined_20002018.shp'
+        )
+
+        # Keep rows with non-null geometry
+        perims = perims[perims.geometry.notna() & ~perims.geometry.is_empty]
+
+        # Reproject to epsg 4326
+        perims = perims.to_crs(epsg=4326)
+
+        cols = [
+            'fireyear', 'incidentna', 'gisacres', 'firecode', 'inciwebid',
+            'uniquefire', 'datecurren', 'geometry']
+        perims = perims[cols]
+
+        bounds = perims.bounds
+        for col in ['minx', 'miny', 'maxx', 'maxy']:
+            perims[col] = bounds[col].to_numpy(dtype=np.float64)
+
+        order = np.argsort(perims.geometry.hilbert_distance(), kind='stable')
+        perims = perims.iloc[order].reset_index(drop=True)
+
+        tmp_path = self.cache_path.with_suffix('.parquet.tmp')
+        perims.to_parquet(tmp_path, index=False, row_group_size=2000)
+        tmp_path.replace(self.cache_path)
+        return self.cache_path
@@ -12,12 +12,21 @@ from io import BytesIO
 from zipfile import ZipFile
 
 import geojson
+import numpy as np
 import pyproj
 import requests
 import shapefile
-from shapely.geometry import asShape, box, shape
+from shapely.geometry import box, shape
 from shapely.ops import transform
 
+try:
+    from geom.precision import round_geometries
+except ModuleNotFoundError:
+    # On AWS Lambda, geom/precision.py is copied next to this file
+    from precision import round_geometries
+
+URL = 'https://opendata.arcgis.com/datasets/5da472c6d27b4b67970acc7b5044c862_0.zip'
+
 # Bounding box used to filter wildfires
 BBOX = (-125.64, 31.35, -114.02, 49.33)
 
@@ -28,10 +37,30 @@ class NIFCCurrent:
 
     def geojson(self):
         """Retrieve NIFC Shapefile and convert into well-formatted GeoJSON"""
-        url = 'https://opendata.arcgis.com/datasets/5da472c6d27b4b67970acc7b5044c862_0.zip'
-        r = requests.get(url)
-        buf = BytesIO(r.content)
+        r = self.request()
+        return self.parse_response(r.content)
+
+    def request(self, headers=None):
+        """Request current wildfire perimeters Shapefile
+
+        Args:
+            - headers: extra HTTP headers, e.g. for a conditional request
+
+        Returns:
+            requests.Response
+        """
+        return requests.get(URL, headers=headers)
 
+    def parse_response(self, content):
+        """Convert zipped Shapefile into well-formatted GeoJSON
+
+        Args:
+            - content: bytes of Zip archive of Shapefile
+
+        Returns:
+            geojson.FeatureCollection
+        """
+        buf = BytesIO(content)
         geometries, properties, prj = self.load_shapefile(buf)
         gj = self.parse_features(geometries, properties, prj)
         return gj
@@ -120,6 +149,13 @@ class NIFCCurrent:
         Returns:
             (geojson.FeatureCollection)
         """
+        # Keep latest geometry for each fire id first, which only needs
+        # properties, so that geometries of stale duplicates are never
+        # reprojected, filtered, or simplified
+        indices = latest_indices(properties)
+        geometries = [geometries[ind] for ind in indices]
+        properties = [properties[ind] for ind in indices]
+
         # Reproject to WGS84 if necessary
         if prj != pyproj.Proj(init='epsg:4326'):
             project = pyproj.Transformer.from_proj(
@@ -127,62 +163,14 @@ class NIFCCurrent:
             geometries = [transform(project.transform, g) for g in geometries]
 
         # Keep features in BBOX
-        # First find indices of geometries that are in bounding box, then keep
-        # the geometries and properties with those indices
-        bbox = box(*BBOX)
-        indices = [
-            ind for ind, g in enumerate(geometries) if g.intersects(bbox)
-        ]
-        geometries = [g for ind, g in enumerate(geometries) if ind in indices]
-        properties = [p for ind, p in enumerate(properties) if ind in indices]
-
-        # Simplify geometries
-        geometries = [g.simplify(0.001) for g in geometries]
+        indices = bbox_indices(geometries, BBOX)
+        geometries = [geometries[ind] for ind in indices]
+        properties = [properties[ind] for ind in indices]
 
-        # Reduce coordinate precision
+        # Simplify geometries and reduce coordinate precision
         # 5 digits is still around 1m precision
         # https://en.wikipedia.org/wiki/Decimal_degrees
-        geometries = [round_geometry(geom=g, digits=5) for g in geometries]
-
-        # Keep latest geometry for each fire id
-        # Some fires have more than one geometry in the current database. Only
-        # keep the most recent date
-        # latest has form {IRWINID: {'DateCurren', ind}}
-        latest = {}
-        for ind, p in enumerate(properties):
-            date = p.get('DateCurren')
-
-            # If date doesn't exist, leave this out of the dataset
-            if date is None:
-                continue
-
-            # Replace Zulu time zone if it exists with +0
-            date = date.replace("Z", "+00:00")
-
-            # Parse with datetime.fromisoformat
-            # Note this is Python 3.7+
-            date = datetime.fromisoformat(date)
-
-            irwinid = p.get('IRWINID')
-            if irwinid is None:
-                continue
-
-            existing_item = latest.get(irwinid)
-            if existing_item is None:
-                latest[irwinid] = {'DateCurren': date, 'index': ind}
-                continue
-
-            # Fire irwinid already exists in `latest` dict
-            # If current date is later, replace
-            existing_date = existing_item['DateCurren']
-            if date > existing_date:
-                latest[irwinid] = {'DateCurren': date, 'index': ind}
-                continue
-
-        # Keep only the indices that correspond with the most recent rows
-        indices = [l['index'] for l in latest.values()]
-        geometries = [g for ind, g in enumerate(geometries) if ind in indices]
-        properties = [p for ind, p in enumerate(properties) if ind in indices]
+        geometries = round_geometries(geometries, digits=5, tolerance=0.001)
 
         # Keep only necessary keys from properties
         keys = ['IncidentNa', 'GISAcres', 'DateCurren']
@@ -201,90 +189,78 @@ class NIFCCurrent:
         return fc
 
 
-def round_geometry(geom, digits):
-    """Round coordinates of geometry to desired digits
+def latest_indices(properties):
+    """Find the latest record of each fire
+
+    Some fires have more than one geometry in the current database. Only the
+    record with the most recent `DateCurren` for each `IRWINID` is kept; of
+    records with the same date, the first. Records without either are left
+    out.
 
     Args:
-        - geom: geometry to round coordinates of
-        - digits: number of decimal places to round
+        - properties (List[dict]): records of features
 
     Returns:
-        geometry of same type as provided
+        (np.ndarray) sorted indices of records to keep
     """
-    gj = [geojson.Feature(geometry=geom)]
-    truncated = list(coord_precision(gj, precision=digits))
-    return shape(truncated[0].geometry)
+    ids = []
+    dates = []
+    indices = []
+    for ind, p in enumerate(properties):
+        irwinid = p.get('IRWINID')
+        date = p.get('DateCurren')
+        if irwinid is None or date is None:
+            continue
 
+        # Replace Zulu time zone if it exists with +0
+        date = datetime.fromisoformat(date.replace('Z', '+00:00'))
 
-def coord_precision(features, precision, validate=True):
-    """Truncate precision of GeoJSON features
+        ids.append(irwinid)
+        dates.append(date.timestamp())
+        indices.append(ind)
 
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
+    if not indices:
+        return np.array([], dtype=int)
 
-    The MIT License (MIT)
+    ids = np.array(ids, dtype=object)
+    dates = np.array(dates)
+    indices = np.array(indices)
 
-    Copyright (c) 2016 Matthew Perry
+    # Sort by id, then date, then reversed index, so that the last row of each
+    # id is the one to keep
+    order = np.lexsort((-indices, dates, ids))
+    ids = ids[order]
+    last = np.append(ids[1:] != ids[:-1], True)
+    return np.sort(indices[order][last])
 
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
 
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
+def bbox_indices(geometries, bbox):
+    """Find geometries that intersect bounding box
 
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
-    """
-    for feature in features:
-        coords = _set_precision(feature['geometry']['coordinates'], precision)
-        feature['geometry']['coordinates'] = coords
-        if validate:
-            geom = asShape(feature['geometry'])
-            geom.is_valid
-        yield feature
-
-
-def _set_precision(coords, precision):
-    """Truncate precision of coordinates
-
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
-
-    The MIT License (MIT)
-
-    Copyright (c) 2016 Matthew Perry
-
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
-
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
-
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
+    Geometries are compared by their bounds first, and only those that
+    straddle the edge of the box are tested exactly. Empty geometries never
+    intersect the box.
+
+    Args:
+        - geometries (List[shapely geometry]): geometries to filter
+        - bbox: (minx, miny, maxx, maxy)
+
+    Returns:
+        (np.ndarray) sorted indices of geometries that intersect bbox
     """
-    result = []
-    try:
-        return round(coords, int(precision))
-    except TypeError:
-        for coord in coords:
-            result.append(_set_precision(coord, precision))
-    return result
+    if not geometries:
+        return np.array([], dtype=int)
+
+    # Empty geometries have NaN bounds in Shapely 2 but () in Shapely 1. NaN
+    # bounds fail every comparison below.
+    bounds = [(np.nan, ) * 4 if g.is_empty else g.bounds for g in geometries]
+    minx, miny, maxx, maxy = np.array(bounds, dtype=float).T
+    overlaps = (maxx >= bbox[0]) & (minx <= bbox[2]) & \
+        (maxy >= bbox[1]) & (miny <= bbox[3])
+    within = (minx >= bbox[0]) & (maxx <= bbox[2]) & \
+        (miny >= bbox[1]) & (maxy <= bbox[3])
+
+    box_geom = box(*bbox)
+    return np.array([
+        ind for ind in np.flatnonzero(overlaps)
+        if within[ind] or geometries[ind].intersects(box_geom)], dtype=int)
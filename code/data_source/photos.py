@@ -1,15 +1,18 @@
 import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from subprocess import run
+from subprocess import DEVNULL, PIPE, Popen, run
 from typing import List, Union
 
 import geopandas as gpd
+import numpy as np
 import osxphotos
 import pandas as pd
 import pytz
 from dateutil.parser import parse
-from shapely.geometry import LineString
 
 
 class PhotosLibrary:
@@ -22,13 +25,22 @@ class PhotosLibrary:
     def __init__(self):
         super(PhotosLibrary, self).__init__()
         self.photos_dir = Path('~/Pictures').expanduser()
+        self.metadata_path = self.photos_dir / 'metadata.sqlite'
 
-    def geotag_photos(self, photos, points):
+    def geotag_photos(self, photos, points, max_gap='10min'):
         """Geotag photos
 
+        Photo locations are linearly interpolated between the GPS fixes just
+        before and just after each photo was taken. This is done for all photos
+        at once.
+
         Args:
             - photos: list of osxphotos.PhotoInfo instances
-            - points: DataFrame of points from watch
+            - points: DataFrame of points from watch, indexed by time, with
+              either `lat` and `lon` columns or Point geometries
+            - max_gap: photos taken between GPS fixes further apart than this
+              are flagged in the `gps_gap` column. Anything accepted by
+              pd.Timedelta.
 
         Returns:
             - GeoJSON FeatureCollection of points representing photo locations
@@ -41,23 +53,44 @@ class PhotosLibrary:
                 - date: corrected photo date in ISO8601 format
                 - path: path to edited photo if it exists, otherwise to original
                   photo
+                - ele: interpolated elevation from watch, if known
+                - gps_gap: True if photo was taken outside the GPS track or
+                  during a gap in the GPS track longer than `max_gap`
 
             - dict linking file paths to UUIDs from Photos.app
         """
         # Fix dates
-        photos['date'] = photos.apply(
-            lambda row: self._get_photo_date(row), axis=1)
+        photos['date'] = self._get_photo_dates(photos['date'])
+
+        if not points.index.is_monotonic_increasing:
+            points = points.sort_index()
+
+        if 'lon' in points.columns:
+            lon = points['lon'].values
+            lat = points['lat'].values
+        else:
+            lon = points.geometry.x.values
+            lat = points.geometry.y.values
+
+        lon, lat, ele, gap = interpolate_track(
+            times=_to_ns(photos['date'].values),
+            track_times=_to_ns(points.index.tz_convert(None).values),
+            lon=lon,
+            lat=lat,
+            ele=points['ele'].values,
+            max_gap=pd.Timedelta(max_gap).value)
 
         # Geotag points and convert to GeoDataFrame
-        photos = gpd.GeoDataFrame(
-            photos,
-            geometry=photos.apply(
-                lambda photo: self._geotag_photo(photo, points), axis=1))
+        photos['ele'] = ele
+        photos['gps_gap'] = gap
+        geometry = gpd.points_from_xy(lon, lat)
+        geometry[np.isnan(lon)] = None
+        photos = gpd.GeoDataFrame(photos, geometry=geometry, crs='EPSG:4326')
 
         return photos
 
-    def _get_photo_date(self, photo):
-        """Get Timestamp for photo
+    def _get_photo_dates(self, dates):
+        """Get Timestamps for photos
 
         It looks like I need to add one hour to most photos, unless they already
         come in as UTC-7. Most photos from my a6000 come in as UTC-6, which is
@@ -79,58 +112,30 @@ class PhotosLibrary:
         trail.
 
         Args:
-            - photo: pandas Series
+            - dates: pandas Series of ISO8601 dates with UTC offsets
 
         Returns:
-            pd.Timestamp in UTC (timezone naive)
+            pandas Series of Timestamps in UTC (timezone naive)
         """
-        # Convert photo's date to a pandas Timestamp object
-        dt = pd.to_datetime(photo.date)
+        dates = dates.astype(str)
+
+        # Offset from UTC is the local wall time minus the UTC time
+        utc = pd.to_datetime(dates, utc=True, format='ISO8601')
+        utc = utc.dt.tz_convert(None)
+        local = pd.to_datetime(
+            dates.str.replace(r'([+-]\d{2}:?\d{2}|Z)$', '', regex=True),
+            format='ISO8601')
+        offset_hours = (local - utc) / pd.Timedelta(hours=1)
 
         # If the time zone is UTC-6, I need to add an hour
-        if dt.utcoffset().total_seconds() / 60 / 60 == -6:
-            dt += pd.DateOffset(hours=1)
         # If the time zone is already UTC-7, it should be good
-        elif dt.utcoffset().total_seconds() / 60 / 60 == -7:
-            pass
-        else:
-            msg = f'tz not UTC-6 or UTC-7: {dt.tz}'
+        bad_offsets = ~offset_hours.isin([-6, -7])
+        if bad_offsets.any():
+            offsets = sorted(offset_hours[bad_offsets].unique())
+            msg = f'tz not UTC-6 or UTC-7: {offsets}'
             raise ValueError(msg)
 
-        # Convert to UTC
-        dt = dt.tz_convert(None)
-        return dt
-
-    def _geotag_photo(self, photo, points):
-        """Geotag single photo
-
-        Args:
-            - photo: pandas Series
-            - points: GeoDataFrame of watch GPS points with timestamps
-
-        Returns:
-            - shapely.geometry.Point
-        """
-        dt = photo.date
-
-        # Find closest point previous in time
-        idx = points.index.get_loc(dt, method='pad')
-        # Get the two nearest rows
-        rows = points.iloc[idx:idx + 2]
-
-        # Linearly interpolate between the two rows' timestamps and the
-        # photo's timestamp
-        # Difference in time b
-        a = rows.index[0].tz_convert(None)
-        b = rows.index[1].tz_convert(None)
-        # Percentage of the way from a to b
-        pct = (dt - a) / (b - a)
-        # Line between the two points
-        line = LineString([rows.iloc[0].geometry, rows.iloc[1].geometry])
-        # Find interpolated point
-        interp = line.interpolate(pct, normalized=True)
-
-        return interp
+        return utc.where(offset_hours != -6, utc + pd.Timedelta(hours=1))
 
     def find_photos(
             self, albums=None, start_date=None, end_date=None, exif=False, tz='America/Los_Angeles'):
@@ -205,26 +210,66 @@ class PhotosLibrary:
 
         return photos
 
-    def get_photos_metadata(self, overwrite=False):
+    def get_photos_metadata(self, overwrite=False, n_workers=4, batch_size=100):
         """Get EXIF data from photos library using Exiftool
-        """
-        metadata_path = self.photos_dir / 'metadata.json'
-        if overwrite or (not metadata_path.exists()):
-            self._run_exiftool_metadata()
 
-        # Load metadata
-        with open(metadata_path) as f:
-            metadata = json.load(f)
+        Metadata is kept in an SQLite index at `self.metadata_path`, keyed by
+        file path, size, and modification time. Only files that are new or have
+        changed since the last run are passed to exiftool, and the index is
+        committed after every batch.
 
-        return metadata
+        Args:
+            - overwrite: if True, re-extract metadata for all files
+            - n_workers: number of persistent exiftool processes
+            - batch_size: number of files per exiftool request
 
-    def _run_exiftool_metadata(self):
-        """
-        Deprecated: used with exiftool but osxphotos seems to be good enough for
-        my needs
+        Returns:
+            list of dicts of metadata, one per file
         """
-        cmd = 'exiftool -n -j -r Photos\ Library.photoslibrary/originals > metadata.json'
-        run(cmd, check=True, shell=True, cwd=self.photos_dir)
+        originals_dir = (
+            self.photos_dir / 'Photos Library.photoslibrary' / 'originals')
+        files = {}
+        for path in originals_dir.rglob('*'):
+            # Like `exiftool -r`, skip hidden files
+            if path.name.startswith('.') or not path.is_file():
+                continue
+            stat = path.stat()
+            files[str(path)] = (stat.st_size, stat.st_mtime_ns)
+
+        conn = sqlite3.connect(self.metadata_path)
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                'mtime_ns INTEGER NOT NULL, metadata TEXT NOT NULL)')
+            if overwrite:
+                conn.execute('DELETE FROM metadata')
+
+            indexed = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in conn.execute(
+                    'SELECT path, size, mtime_ns FROM metadata')}
+            removed = indexed.keys() - files.keys()
+            conn.executemany(
+                'DELETE FROM metadata WHERE path = ?', [(p, ) for p in removed])
+            conn.commit()
+
+            changed = [p for p, sig in files.items() if indexed.get(p) != sig]
+            batches = read_exif_metadata(
+                changed, n_workers=n_workers, batch_size=batch_size)
+            for batch in batches:
+                rows = [(
+                    m['SourceFile'], *files[m['SourceFile']], json.dumps(m))
+                        for m in batch if m.get('SourceFile') in files]
+                conn.executemany(
+                    'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)', rows)
+                conn.commit()
+
+            return [
+                json.loads(row[0]) for row in conn.execute(
+                    'SELECT metadata FROM metadata ORDER BY path')]
+        finally:
+            conn.close()
 
     def get_metadata_for_folder(folder: Union[str, Path], ext='.HEIC'):
         """Recursively get metadata for all images within folder
@@ -243,7 +288,163 @@ class PhotosLibrary:
         res = run(cmd, shell=True, capture_output=True)
         json.loads(res.stdout)
 
-    def get_metadata_for_files(paths: List[Union[str, Path]]):
-        cmd = ['exiftool', '-j', '-n', *[str(x) for x in paths]]
-        res = run(cmd, capture_output=True)
-        return json.loads(res.stdout)
+    def get_metadata_for_files(
+            self,
+            paths: List[Union[str, Path]],
+            n_workers=4,
+            batch_size=100) -> List[dict]:
+        """Get metadata for files using persistent exiftool processes
+
+        Files are passed to exiftool in batches rather than all on one command
+        line.
+        """
+        metadata = []
+        for batch in read_exif_metadata(paths, n_workers=n_workers,
+                                        batch_size=batch_size):
+            metadata.extend(batch)
+
+        return metadata
+
+
+class ExifTool:
+    """Persistent exiftool process
+
+    Starting exiftool starts a Perl interpreter, which takes far longer than
+    reading the metadata of a single photo. With `-stay_open`, one process
+    reads the arguments for each request from stdin, and marks the end of the
+    output of each request with `{ready}`.
+    """
+    def __init__(self, executable='exiftool', args=('-j', '-n')):
+        # -j json output
+        # -n Prevent pretty print formatting. Also gives lat/lon GPS coords
+        self.args = list(args)
+        self.process = Popen([executable, '-stay_open', 'True', '-@', '-'],
+                             stdin=PIPE,
+                             stdout=PIPE,
+                             stderr=DEVNULL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def execute_json(self, paths) -> List[dict]:
+        """Get metadata for files
+
+        Args:
+            - paths: paths to files
+
+        Returns:
+            list of dicts of metadata; `SourceFile` is the given path
+        """
+        lines = [*self.args, *[str(p) for p in paths], '-execute']
+        self.process.stdin.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+
+        output = bytearray()
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError('exiftool exited unexpectedly')
+            if line.rstrip() == b'{ready}':
+                break
+            output += line
+
+        if not output.strip():
+            return []
+
+        return json.loads(output)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.write(b'-stay_open\nFalse\n')
+            self.process.stdin.flush()
+            self.process.wait()
+
+
+def read_exif_metadata(paths, n_workers=4, batch_size=100):
+    """Get metadata for files in batches from a pool of exiftool processes
+
+    exiftool is single-threaded, so each worker thread keeps its own
+    persistent `ExifTool` process.
+
+    Args:
+        - paths: paths to files
+        - n_workers: number of exiftool processes
+        - batch_size: number of files per request
+
+    Yields:
+        list of dicts of metadata for each batch, in order
+    """
+    paths = list(paths)
+    batches = [
+        paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    if not batches:
+        return
+
+    local = threading.local()
+    tools = []
+
+    def execute(batch):
+        if not hasattr(local, 'exiftool'):
+            local.exiftool = ExifTool()
+            tools.append(local.exiftool)
+        return local.exiftool.execute_json(batch)
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            yield from executor.map(execute, batches)
+    finally:
+        for tool in tools:
+            tool.close()
+
+
+def _to_ns(values):
+    """Convert array of naive UTC datetimes to int64 nanoseconds"""
+    return values.astype('datetime64[ns]').astype(np.int64)
+
+
+def interpolate_track(times, track_times, lon, lat, ele, max_gap):
+    """Linearly interpolate positions along GPS track at given times
+
+    Args:
+        - times: int64 array of times to interpolate at
+        - track_times: sorted int64 array of times of GPS fixes, in the same
+          units as `times`
+        - lon: longitudes of GPS fixes
+        - lat: latitudes of GPS fixes
+        - ele: elevations of GPS fixes
+        - max_gap: maximum time between GPS fixes, in the same units as
+          `times`, before a time between them is flagged as a gap
+
+    Returns:
+        (lon, lat, ele, gap): float64 arrays of interpolated positions, which
+        are NaN for times outside the track, and a boolean array that is True
+        for times outside the track or between fixes more than `max_gap` apart
+    """
+    times = np.asarray(times, dtype=np.int64)
+    track_times = np.asarray(track_times, dtype=np.int64)
+    if len(track_times) < 2:
+        nan = np.full(len(times), np.nan)
+        return nan, nan.copy(), nan.copy(), np.ones(len(times), dtype=bool)
+
+    # Index of the last fix at or before each time, and the fix after it
+    i0 = np.searchsorted(track_times, times, side='right') - 1
+    i0 = np.clip(i0, 0, len(track_times) - 2)
+    i1 = i0 + 1
+
+    t0 = track_times[i0]
+    dt = track_times[i1] - t0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(dt > 0, (times - t0) / dt, 0)
+
+    outside = (times < track_times[0]) | (times > track_times[-1])
+    pct[outside] = np.nan
+
+    def interp(values):
+        values = np.asarray(values, dtype=np.float64)
+        return values[i0] + pct * (values[i1] - values[i0])
+
+    gap = outside | (dt > max_gap)
+    return interp(lon), interp(lat), interp(ele), gap
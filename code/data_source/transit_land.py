@@ -1,20 +1,81 @@
-from time import sleep
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import geojson
 import requests
+from requests.adapters import HTTPAdapter
 from shapely.geometry import shape
+from shapely.prepared import prep
 
 from .base import DataSource
 
+API_URL = 'https://transit.land/api/v1'
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Cached responses older than this many seconds are fetched again
+CACHE_MAX_AGE = 24 * 60 * 60
+
 
 class Transit(DataSource):
+    """Trail-relevant transit data from the transit.land API
+
+    Requests share one keep-alive session and a token bucket that keeps within
+    the API's rate limit, and independent requests are made concurrently. List
+    endpoints are paged through until the last page. Responses are cached on
+    disk by URL and params, and stops, routes, and each operator's stops are
+    kept in memory, so that calling `download` for many overlapping geometries,
+    e.g. every trail section and town, only fetches each of them once.
     """
-    TODO: update API calls to page if necessary. Currently the max results is
-    just set high.
-    """
-    def __init__(self):
+    def __init__(
+            self,
+            api_url=API_URL,
+            n_workers=4,
+            rate=1,
+            burst=60,
+            per_page=1000,
+            max_retries=5,
+            use_cache=True,
+            cache_max_age=CACHE_MAX_AGE):
+        """
+        Args:
+            - api_url: base URL of transit.land API
+            - n_workers: number of concurrent requests
+            - rate: requests per second allowed on average. transit.land allows
+              60 requests per minute.
+            - burst: number of requests that can be made at once before
+              `rate` applies
+            - per_page: number of results to request per page
+            - max_retries: number of times to retry a failed request
+            - use_cache: if True, cache responses on disk
+            - cache_max_age: seconds after which cached responses are fetched
+              again. Defaults to a day, so that changed schedules and stops
+              are picked up. None keeps responses forever.
+        """
         super(Transit, self).__init__()
 
+        self.api_url = api_url.rstrip('/')
+        self.n_workers = n_workers
+        self.per_page = per_page
+        self.max_retries = max_retries
+        self.use_cache = use_cache
+        self.cache_max_age = cache_max_age
+
+        self.cache_dir = self.data_dir / 'raw' / 'transit_land' / 'cache'
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=n_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+
+        # {onestop_id: object} of everything fetched so far
+        self.stops = {}
+        self.routes = {}
+        self.operator_stops = {}
+
     def download(self, geometry):
         """Create trail-relevant transit dataset from transit.land database
 
@@ -42,7 +103,11 @@ class Transit(DataSource):
         nearby_stops = self.update_stop_info(nearby_stops)
         all_stops = self.update_stop_info(all_stops)
 
-        return nearby_stops, all_stops, routes
+        # Return copies, so that callers can annotate them without changing
+        # the objects kept for later calls
+        return (
+            _copy_values(nearby_stops), _copy_values(all_stops),
+            _copy_values(routes))
 
     def get_stops_in_geometry(self, geometry):
         """Get all stops for all providers that intersect geometry provided
@@ -53,50 +118,37 @@ class Transit(DataSource):
 
         # For each operator, see if there are actually transit stops that
         # intersect the provided geometry
-        _intersecting_stops = []
-        for operator in operators_intersecting_geom:
-            stops = self._get_stops_intersecting_geometry(
-                geometry=geometry, operator_id=operator['onestop_id'])
-            if len(stops) > 0:
-                _intersecting_stops.extend(stops)
+        operator_ids = [o['onestop_id'] for o in operators_intersecting_geom]
+        self._get_operator_stops(operator_ids)
 
+        prepared = prep(geometry)
         nearby_stops = {}
-        for stop in _intersecting_stops:
-            nearby_stops[stop['onestop_id']] = stop
+        for operator_id in operator_ids:
+            for stop in self.operator_stops[operator_id]:
+                if prepared.intersects(shape(stop['geometry'])):
+                    nearby_stops[stop['onestop_id']] = stop
 
         return nearby_stops
 
     def get_routes_serving_stops(self, stops):
         """Get all routes that stop and given stops
         """
-        # For each stop that intersects the geometry, add it to the nearby_stops
-        # dict
-        # For each route that stops at each nearby stop, get information about
-        # the route and add it to the routes dict
-        routes = {}
-        for stop in stops.values():
-            # Get more info about each route that stops at stop
-            # Routes are added to self.routes
-            for route_dict in stop['routes_serving_stop']:
-                route_id = route_dict['route_onestop_id']
-                routes[route_id] = self.get_route_from_id(route_id=route_id)
-
-        return routes
+        route_ids = {
+            route_dict['route_onestop_id']
+            for stop in stops.values()
+            for route_dict in stop['routes_serving_stop']}
+        return self.get_routes(route_ids)
 
     def get_all_stops_for_routes(self, routes):
         """Get all stops served by the given routes
         """
         # For each stop along each route, get the id's of all stops.
         # {stop_onestop_id: stop}
-        all_stops = {}
-        for route in routes.values():
-            route_stops = route['stops_served_by_route']
-            for route_stop in route_stops:
-                route_stop_id = route_stop['stop_onestop_id']
-                all_stops[route_stop_id] = self.get_stop_from_id(
-                    stop_id=route_stop_id)
-
-        return all_stops
+        stop_ids = {
+            route_stop['stop_onestop_id']
+            for route in routes.values()
+            for route_stop in route['stops_served_by_route']}
+        return self.get_stops(stop_ids)
 
     def _get_operators_intersecting_geometry(self, geometry):
         """Find transit operators with service area crossing provided geometry
@@ -112,40 +164,69 @@ class Transit(DataSource):
         # Create stringified bbox
         bbox = ','.join(map(str, geometry.bounds))
 
-        url = 'https://transit.land/api/v1/operators'
-        params = {'bbox': bbox, 'per_page': 10000}
-        d = self.request_transit_land(url, params=params)
+        url = f'{self.api_url}/operators'
+        operators = self.request_paged(url, 'operators', params={'bbox': bbox})
 
-        operators_intersecting_geom = []
-        for operator in d['operators']:
+        prepared = prep(geometry)
+        return [
+            operator for operator in operators
             # Check if the service area of the operator intersects trail
-            operator_geom = shape(operator['geometry'])
-            intersects = geometry.intersects(operator_geom)
-            if intersects:
-                operators_intersecting_geom.append(operator)
+            if prepared.intersects(shape(operator['geometry']))]
 
-        return operators_intersecting_geom
+    def _get_operator_stops(self, operator_ids):
+        """Fetch all stops of operators that haven't been fetched yet
 
-    def _get_stops_intersecting_geometry(self, geometry, operator_id):
-        """Find all stops by operator that intersect geometry
+        Stops are also added to `self.stops`, so that they aren't fetched again
+        one by one.
 
         Args:
-            - geometry: shapely geometry object to take intersections with
-            - operator_id: onestop operator id
+            - operator_ids: onestop operator ids
+        """
+        missing = [i for i in set(operator_ids) if i not in self.operator_stops]
+
+        def fetch(operator_id):
+            url = f'{self.api_url}/stops'
+            return self.request_paged(
+                url, 'stops', params={'served_by': operator_id})
+
+        for operator_id, stops in zip(missing, self.map(fetch, missing)):
+            self.operator_stops[operator_id] = stops
+            for stop in stops:
+                self.stops.setdefault(stop['onestop_id'], stop)
+
+    def get_routes(self, route_ids):
+        """Get routes by id, fetching the ones not yet known concurrently
+
+        Args:
+            - route_ids: onestop ids of routes
+
+        Returns:
+            dict {route_onestop_id: route}
+        """
+        return self._get_by_ids(route_ids, self.routes)
+
+    def get_stops(self, stop_ids):
+        """Get stops by id, fetching the ones not yet known concurrently
+
+        Args:
+            - stop_ids: onestop ids of stops
+
+        Returns:
+            dict {stop_onestop_id: stop}
         """
-        url = 'https://transit.land/api/v1/stops'
-        params = {'served_by': operator_id, 'per_page': 10000}
-        d = self.request_transit_land(url, params=params)
+        return self._get_by_ids(stop_ids, self.stops)
 
-        intersecting_stops = []
-        for stop in d['stops']:
-            stop_geometry = shape(stop['geometry'])
-            intersects = geometry.intersects(stop_geometry)
+    def _get_by_ids(self, ids, known):
+        missing = [i for i in set(ids) if i not in known]
+        for onestop_id, obj in zip(missing,
+                                   self.map(self._get_by_id, missing)):
+            known[onestop_id] = obj
 
-            if intersects:
-                intersecting_stops.append(stop)
+        return {i: known[i] for i in ids}
 
-        return intersecting_stops
+    def _get_by_id(self, onestop_id):
+        url = f'{self.api_url}/onestop_id/{onestop_id}'
+        return self.request_transit_land(url)
 
     def get_route_from_id(self, route_id):
         """Find route info from route_id
@@ -153,8 +234,7 @@ class Transit(DataSource):
         Args:
             - route_id: onestop id for a route
         """
-        url = f'https://transit.land/api/v1/onestop_id/{route_id}'
-        return self.request_transit_land(url)
+        return self.get_routes([route_id])[route_id]
 
     def get_stop_from_id(self, stop_id):
         """Find stop info from stop_id
@@ -162,8 +242,7 @@ class Transit(DataSource):
         Args:
             - stop_id: onestop id for a stop
         """
-        url = f'https://transit.land/api/v1/onestop_id/{stop_id}'
-        return self.request_transit_land(url)
+        return self.get_stops([stop_id])[stop_id]
 
     def update_stop_info(self, stops):
         """Update stop information from Transit land
@@ -177,24 +256,25 @@ class Transit(DataSource):
         Returns:
             dict {stop_onestop_id: stop_info}
         """
-        for stop_id, value in stops.items():
-            if value is not None:
-                continue
-
-            url = f'https://transit.land/api/v1/onestop_id/{stop_id}'
-            stops[stop_id] = self.request_transit_land(url)
-
+        missing = [k for k, v in stops.items() if v is None]
+        stops.update(self.get_stops(missing))
         return stops
 
     def get_schedules(self, routes):
         """Get schedules to add to route and stop data
 
         TODO figure out the best way to collect and store this
+
+        Returns:
+            dict {route_onestop_id: list of schedule stop pairs}
         """
-        url = 'https://transit.land/api/v1/schedule_stop_pairs'
-        for route_id in routes.keys():
-            params = {'route_onestop_id': route_id, 'per_page': 10000}
-            d = self.request_transit_land(url, params=params)
+        url = f'{self.api_url}/schedule_stop_pairs'
+        route_ids = list(routes.keys())
+        schedules = self.map(
+            lambda route_id: self.request_paged(
+                url, 'schedule_stop_pairs',
+                params={'route_onestop_id': route_id}), route_ids)
+        return dict(zip(route_ids, schedules))
 
     def get_geojson_for_routes(self, routes):
         """Create FeatureCollection from routes for inspection
@@ -212,6 +292,42 @@ class Transit(DataSource):
             features.append(feature)
         return geojson.FeatureCollection(features)
 
+    def map(self, func, items):
+        """Call func on each item concurrently
+
+        Returns:
+            list of results, in the order of items
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            return list(executor.map(func, items))
+
+    def request_paged(self, url, key, params=None):
+        """Get all results of a list endpoint, following its pages
+
+        Args:
+            - url: url of list endpoint
+            - key: key of list of results in each page, e.g. `stops`
+            - params: None or dict of params for first request
+
+        Returns:
+            list of results from all pages
+        """
+        params = {'per_page': self.per_page, **(params or {})}
+        results = []
+        while url:
+            d = self.request_transit_land(url, params=params)
+            results.extend(d[key])
+
+            # The next page's URL already includes all params
+            url = d.get('meta', {}).get('next')
+            params = None
+
+        return results
+
     def request_transit_land(self, url, params=None):
         """Wrapper for requests to transit.land API to stay within rate limit
 
@@ -219,8 +335,9 @@ class Transit(DataSource):
         presumably resets after each 60-second period. (It's not per 1-second
         period, because I was able to make 60 requests in like 10 seconds).
 
-        Given this, when I hit r.status_code, I'll sleep for 2 seconds before
-        trying again.
+        Requests are spaced by a token bucket shared by all threads. When the
+        API still answers 429, the bucket waits for `Retry-After` and slows
+        down. Other failed requests are retried with exponential backoff.
 
         Args:
             - url: url to send requests to
@@ -229,9 +346,99 @@ class Transit(DataSource):
         Returns:
             dict of transit.land output
         """
-        r = requests.get(url, params=params)
-        if r.status_code == 429:
-            sleep(2)
-            return self.request_transit_land(url, params=params)
+        cache_path = self._cache_path(url, params)
+        if self.use_cache and cache_path.exists():
+            age = time.time() - cache_path.stat().st_mtime
+            if self.cache_max_age is None or age < self.cache_max_age:
+                with open(cache_path) as f:
+                    return json.load(f)
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            r = self.session.get(url, params=params)
+            if r.status_code not in RETRY_STATUSES or \
+                    attempt == self.max_retries:
+                break
+
+            retry_after = r.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 2**attempt
+            if r.status_code == 429:
+                self.bucket.throttle(delay)
+            else:
+                time.sleep(delay)
+
+        r.raise_for_status()
+        self.bucket.recover()
+        d = r.json()
+
+        if self.use_cache:
+            # Write to a temporary file first, so that concurrent readers never
+            # see a partial file
+            tmp_path = cache_path.with_name(
+                f'{cache_path.name}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(d, f)
+            tmp_path.replace(cache_path)
+
+        return d
+
+    def _cache_path(self, url, params=None):
+        key = json.dumps([url, params or {}], sort_keys=True)
+        return self.cache_dir / (
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def _copy_values(d):
+    return {k: dict(v) for k, v in d.items()}
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter that adapts to rate limiting
+
+    Each request takes a token; tokens are added at `rate` per second, up to
+    `capacity`. When the server still rate limits requests, `throttle` waits
+    out its delay and halves the rate; each successful request then increases
+    the rate again, up to its initial value.
+    """
+    def __init__(self, rate, capacity, min_rate=None):
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available"""
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            # A negative balance reserves a future token for this caller
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttle(self, delay):
+        """Slow down after being rate limited
 
-        return r.json()
+        Args:
+            - delay: seconds that no request should be made for
+        """
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, -delay * self.rate)
+
+    def recover(self):
+        """Speed back up after a successful request"""
+        with self.lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
@@ -0,0 +1,232 @@
+"""
+Decode GPS track points from Garmin FIT files
+
+The [FIT protocol][fit-sdk] is a compact binary format: a file header, followed
+by a stream of _definition_ messages, which describe the layout of fields for a
+local message type, and _data_ messages, which hold the field values for the
+most recent definition of their local message type.
+
+Only `record` messages (global message number 20), which hold the periodic GPS
+samples of an activity, are decoded. All other messages are skipped by size.
+
+[fit-sdk]: https://developer.garmin.com/fit/protocol/
+"""
+
+import struct
+from array import array
+
+import numpy as np
+
+# Seconds between the Unix epoch and the FIT epoch, 1989-12-31T00:00:00Z
+FIT_EPOCH_OFFSET = 631065600
+
+RECORD_MESSAGE = 20
+
+# Field definition numbers
+TIMESTAMP_FIELD = 253
+POSITION_LAT_FIELD = 0
+POSITION_LONG_FIELD = 1
+ALTITUDE_FIELD = 2
+ENHANCED_ALTITUDE_FIELD = 78
+
+# Positions are stored as semicircles: 2^31 semicircles = 180 degrees
+SEMICIRCLES_TO_DEGREES = 180 / 2**31
+
+# Base type number: (struct format character, invalid value)
+BASE_TYPES = {
+    0x84: ('H', 0xFFFF),
+    0x85: ('i', 0x7FFFFFFF),
+    0x86: ('I', 0xFFFFFFFF),
+}
+
+# Field definition number: base type, for fields that are decoded
+RECORD_FIELDS = {
+    TIMESTAMP_FIELD: 0x86,
+    POSITION_LAT_FIELD: 0x85,
+    POSITION_LONG_FIELD: 0x85,
+    ALTITUDE_FIELD: 0x84,
+    ENHANCED_ALTITUDE_FIELD: 0x86,
+}
+ALTITUDE_SCALE = 5
+ALTITUDE_OFFSET = 500
+
+
+class FitDecodeError(ValueError):
+    pass
+
+
+def read_fit_points(path):
+    """Read GPS track points from FIT file into typed arrays
+
+    Args:
+        - path: path to FIT file
+
+    Returns:
+        dict of NumPy arrays:
+        - time: int64 nanoseconds since the Unix epoch in UTC
+        - lat: float32 latitude
+        - lon: float32 longitude
+        - ele: float32 elevation in meters; NaN where missing
+
+        Records without a position or timestamp are dropped.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    time = array('q')
+    lat = array('f')
+    lon = array('f')
+    ele = array('f')
+
+    # A FIT file may consist of several FIT files chained together
+    offset = 0
+    while offset < len(data):
+        offset = _read_fit_file(data, offset, time, lat, lon, ele)
+
+    return {
+        'time': np.frombuffer(time, dtype=np.int64) * 10**9,
+        'lat': np.frombuffer(lat, dtype=np.float32),
+        'lon': np.frombuffer(lon, dtype=np.float32),
+        'ele': np.frombuffer(ele, dtype=np.float32)}
+
+
+def _read_fit_file(data, offset, time, lat, lon, ele):
+    """Decode one FIT file starting at offset, appending to point arrays
+
+    Returns:
+        offset of the end of this FIT file
+    """
+    header_size = data[offset]
+    if header_size < 12 or data[offset + 8:offset + 12] != b'.FIT':
+        raise FitDecodeError('Not a FIT file')
+
+    data_size = struct.unpack_from('<I', data, offset + 4)[0]
+    pos = offset + header_size
+    end = pos + data_size
+    if end > len(data):
+        raise FitDecodeError('FIT file is truncated')
+
+    # Local message type: (struct.Struct, global message number, names of
+    # unpacked fields)
+    definitions = {}
+    last_timestamp = None
+    while pos < end:
+        header = data[pos]
+        pos += 1
+
+        if header & 0x80:
+            # Compressed timestamp header: data message with a 5-bit offset from
+            # the last timestamp
+            local_type = (header >> 5) & 0x03
+            if last_timestamp is not None:
+                time_offset = header & 0x1F
+                timestamp = (last_timestamp & ~0x1F) + time_offset
+                if time_offset < (last_timestamp & 0x1F):
+                    timestamp += 0x20
+                last_timestamp = timestamp
+        elif header & 0x40:
+            local_type = header & 0x0F
+            pos = _read_definition(
+                data, pos, definitions, local_type, has_developer_data=bool(
+                    header & 0x20))
+            continue
+        else:
+            local_type = header & 0x0F
+
+        try:
+            unpacker, global_number, fields = definitions[local_type]
+        except KeyError:
+            raise FitDecodeError(
+                f'Data message for undefined local type {local_type}')
+
+        values = dict(zip(fields, unpacker.unpack_from(data, pos)))
+        pos += unpacker.size
+
+        if values.get(TIMESTAMP_FIELD) is not None:
+            last_timestamp = values[TIMESTAMP_FIELD]
+
+        if global_number != RECORD_MESSAGE:
+            continue
+
+        position_lat = values.get(POSITION_LAT_FIELD)
+        position_long = values.get(POSITION_LONG_FIELD)
+        if position_lat is None or position_long is None:
+            continue
+        if last_timestamp is None:
+            continue
+
+        altitude = values.get(ENHANCED_ALTITUDE_FIELD)
+        if altitude is None:
+            altitude = values.get(ALTITUDE_FIELD)
+
+        time.append(last_timestamp + FIT_EPOCH_OFFSET)
+        lat.append(position_lat * SEMICIRCLES_TO_DEGREES)
+        lon.append(position_long * SEMICIRCLES_TO_DEGREES)
+        if altitude is None:
+            ele.append(np.nan)
+        else:
+            ele.append(altitude / ALTITUDE_SCALE - ALTITUDE_OFFSET)
+
+    # Skip 2-byte file CRC
+    return end + 2
+
+
+def _read_definition(data, pos, definitions, local_type, has_developer_data):
+    """Read definition message and register its layout
+
+    Fields that are decoded become struct format characters; all other fields,
+    including developer fields, become pad bytes. Invalid values are mapped to
+    None by the wrapper returned in `definitions`.
+
+    Returns:
+        position after the definition message
+    """
+    architecture = data[pos + 1]
+    endian = '>' if architecture == 1 else '<'
+    global_number = struct.unpack_from(endian + 'H', data, pos + 2)[0]
+    n_fields = data[pos + 4]
+    pos += 5
+
+    fmt = []
+    fields = []
+    invalid = []
+    for _ in range(n_fields):
+        number, size, base_type = data[pos:pos + 3]
+        pos += 3
+
+        wanted = (
+            number == TIMESTAMP_FIELD or (
+                global_number == RECORD_MESSAGE and number in RECORD_FIELDS))
+        char, invalid_value = BASE_TYPES.get(base_type, (None, None))
+        if wanted and char is not None and \
+                struct.calcsize(char) == size and \
+                RECORD_FIELDS[number] == base_type:
+            fmt.append(char)
+            fields.append(number)
+            invalid.append(invalid_value)
+        else:
+            fmt.append(f'{size}x')
+
+    if has_developer_data:
+        n_developer_fields = data[pos]
+        pos += 1
+        for _ in range(n_developer_fields):
+            fmt.append(f'{data[pos + 1]}x')
+            pos += 3
+
+    unpacker = _Unpacker(endian + ''.join(fmt), invalid)
+    definitions[local_type] = (unpacker, global_number, fields)
+    return pos
+
+
+class _Unpacker(struct.Struct):
+    """Struct that maps invalid field values to None"""
+    def __init__(self, fmt, invalid):
+        super(_Unpacker, self).__init__(fmt)
+        self.invalid = invalid
+
+    def unpack_from(self, buffer, offset=0):
+        values = super(_Unpacker, self).unpack_from(buffer, offset)
+        return [
+            None if value == invalid else value
+            for value, invalid in zip(values, self.invalid)]
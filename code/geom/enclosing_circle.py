@@ -0,0 +1,149 @@
+"""
+Smallest enclosing circle, vectorized with NumPy
+
+This follows the same randomized incremental algorithm as Project Nayuki's
+smallest enclosing circle library [0], but each scan for the next point that
+lies outside the current circle, and the search for the best circumcircle
+through two boundary points, are done on whole coordinate arrays.
+
+[0]: https://www.nayuki.io/page/smallest-enclosing-circle
+"""
+
+import numpy as np
+
+_MULTIPLICATIVE_EPSILON = 1 + 1e-14
+
+
+def minimum_enclosing_circle(points):
+    """Find smallest circle that encloses all points
+
+    Args:
+        - points: array-like of (x, y) or (x, y, z) coordinates, e.g. the
+          exterior coordinates of a polygon. Z coordinates are ignored.
+
+    Returns:
+        (center x, center y, radius), or None if no points are given
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return None
+
+    # Duplicate points (e.g. closed rings) don't change the circle. Randomize
+    # order for expected linear time, using a fixed seed so that results are
+    # reproducible.
+    points = np.unique(points[:, :2], axis=0)
+    points = points[np.random.default_rng(0).permutation(len(points))]
+
+    c = (points[0, 0], points[0, 1], 0.0)
+    i = _first_outside(points, c, 1)
+    while i is not None:
+        c = _circle_one_point(points[:i], points[i])
+        i = _first_outside(points, c, i + 1)
+
+    return c
+
+
+def _circle_one_point(points, p):
+    """Smallest circle enclosing points with p on its boundary"""
+    c = (p[0], p[1], 0.0)
+    i = _first_outside(points, c, 0)
+    while i is not None:
+        q = points[i]
+        if c[2] == 0.0:
+            c = _diameter(p, q)
+        else:
+            c = _circle_two_points(points[:i + 1], p, q)
+        i = _first_outside(points, c, i + 1)
+
+    return c
+
+
+def _circle_two_points(points, p, q):
+    """Smallest circle enclosing points with p and q on its boundary"""
+    circ = _diameter(p, q)
+    r = points[~_in_circle(points, circ)]
+    if len(r) == 0:
+        return circ
+
+    # Form a circumcircle with each point not in the two-point circle, and
+    # classify it on the left or right side of pq
+    cross = _cross_product(p, q, r)
+    centers, radii = _circumcircles(p, q, r)
+    valid = ~np.isnan(radii)
+    center_cross = _cross_product(p, q, centers)
+
+    left = None
+    is_left = valid & (cross > 0)
+    if is_left.any():
+        idx = np.flatnonzero(is_left)[np.argmax(center_cross[is_left])]
+        left = (centers[idx, 0], centers[idx, 1], radii[idx])
+
+    right = None
+    is_right = valid & (cross < 0)
+    if is_right.any():
+        idx = np.flatnonzero(is_right)[np.argmin(center_cross[is_right])]
+        right = (centers[idx, 0], centers[idx, 1], radii[idx])
+
+    if left is None and right is None:
+        return circ
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left if left[2] <= right[2] else right
+
+
+def _first_outside(points, c, start):
+    """Index of first point at or after start that is outside circle c"""
+    outside = ~_in_circle(points[start:], c)
+    if not outside.any():
+        return None
+
+    return start + int(np.argmax(outside))
+
+
+def _in_circle(points, c):
+    dist = np.hypot(points[:, 0] - c[0], points[:, 1] - c[1])
+    return dist <= c[2] * _MULTIPLICATIVE_EPSILON
+
+
+def _diameter(a, b):
+    cx = (a[0] + b[0]) / 2
+    cy = (a[1] + b[1]) / 2
+    r = max(np.hypot(cx - a[0], cy - a[1]), np.hypot(cx - b[0], cy - b[1]))
+    return (cx, cy, r)
+
+
+def _circumcircles(a, b, c):
+    """Circumcircles of triangles formed by points a, b and each row of c
+
+    Returns:
+        (centers, radii), where radius is NaN for collinear points
+    """
+    # Mathematical algorithm from Wikipedia: Circumscribed circle
+    ox = (np.minimum(np.minimum(a[0], b[0]), c[:, 0]) +
+          np.maximum(np.maximum(a[0], b[0]), c[:, 0])) / 2
+    oy = (np.minimum(np.minimum(a[1], b[1]), c[:, 1]) +
+          np.maximum(np.maximum(a[1], b[1]), c[:, 1])) / 2
+    ax, ay = a[0] - ox, a[1] - oy
+    bx, by = b[0] - ox, b[1] - oy
+    cx, cy = c[:, 0] - ox, c[:, 1] - oy
+
+    d = (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by)) * 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = ox + ((ax * ax + ay * ay) * (by - cy) + (bx * bx + by * by) *
+                  (cy - ay) + (cx * cx + cy * cy) * (ay - by)) / d
+        y = oy + ((ax * ax + ay * ay) * (cx - bx) + (bx * bx + by * by) *
+                  (ax - cx) + (cx * cx + cy * cy) * (bx - ax)) / d
+
+    radii = np.maximum.reduce([
+        np.hypot(x - a[0], y - a[1]),
+        np.hypot(x - b[0], y - b[1]),
+        np.hypot(x - c[:, 0], y - c[:, 1])])
+    radii[d == 0] = np.nan
+    return np.column_stack([x, y]), radii
+
+
+def _cross_product(a, b, c):
+    """Twice the signed area of triangles a, b, and each row of c"""
+    return (b[0] - a[0]) * (c[:, 1] - a[1]) - (b[1] - a[1]) * (c[:, 0] - a[0])
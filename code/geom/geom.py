@@ -1,19 +1,28 @@
+import json
 from functools import partial
-from math import sqrt
+from math import cos, pi, sqrt
 from typing import List, Tuple
 
 import geojson
 import geopandas as gpd
+import numpy as np
 import pyproj
-from geojson import Feature
 from shapely.geometry import (
-    GeometryCollection, MultiPolygon, Point, Polygon, asShape, box, mapping,
-    shape)
+    GeometryCollection, MultiPolygon, Point, Polygon, box, mapping, shape)
 from shapely.ops import transform
+from shapely.prepared import prep
+from shapely.validation import explain_validity, make_valid
 
 import pint
 
-from .smallest_enclosing_circle import make_circle
+from .enclosing_circle import minimum_enclosing_circle
+from .precision import round_geometries, round_geometry, transform_coords
+
+try:
+    # Shapely 2.0+ can operate on whole arrays of geometries at once
+    from shapely import force_2d as _force_2d_array
+except ImportError:
+    _force_2d_array = None
 
 ureg = pint.UnitRegistry()
 
@@ -48,6 +57,22 @@ def buffer(
     geometry = reproject(geometry, to_epsg=crs, from_epsg=4326)
 
     # Find buffer distance in meters
+    distance_m = distance_in_meters(distance, unit)
+    buffer = geometry.buffer(distance_m)
+
+    # Reproject back to EPSG 4326 for saving
+    buffer = reproject(buffer, to_epsg=4326, from_epsg=crs)
+    return buffer
+
+
+def distance_in_meters(distance: float, unit: str) -> float:
+    """Convert distance to meters
+
+    Args:
+        distance: distance magnitude
+        unit: units for distance, one of:
+            ['mile', 'mi', 'meter', 'm', 'kilometer', 'km']
+    """
     unit_dict = {
         'mile': ureg.mile,
         'mi': ureg.mile,
@@ -60,155 +85,162 @@ def buffer(
     if pint_unit is None:
         raise ValueError(f'unit must be one of {list(unit_dict.keys())}')
 
-    distance_m = (distance * pint_unit).to(ureg.meters).magnitude
-    buffer = geometry.buffer(distance_m)
+    return (distance * pint_unit).to(ureg.meters).magnitude
 
-    # Reproject back to EPSG 4326 for saving
-    buffer = reproject(buffer, to_epsg=4326, from_epsg=crs)
-    return buffer
 
+def validate_geom_gdf(gdf, report_path=None):
+    """Make sure all geometries in GeoDataFrame are valid
 
-def round_geometry(geom, digits):
-    """Round coordinates of geometry to desired digits
+    Validity is checked for the whole geometry column at once, and only the
+    invalid subset is repaired.
 
     Args:
-        - geom: geometry to round coordinates of
-        - digits: number of decimal places to round
+        - gdf: GeoDataFrame
+        - report_path: if provided, write JSON report of repaired features to
+          this path
 
     Returns:
-        geometry of same type as provided
+        GeoDataFrame with valid geometries
     """
-    gj = [Feature(geometry=geom)]
-    truncated = list(coord_precision(gj, precision=digits))
-    return shape(truncated[0].geometry)
+    geometry = gdf.geometry
+    invalid = ~(geometry.is_valid | geometry.isna())
+    if not invalid.any():
+        if report_path is not None:
+            _write_validity_report([], report_path)
+        return gdf
+
+    invalid_geoms = geometry[invalid]
+    report = [{
+        'index': index,
+        'reason': explain_validity(g),
+    } for index, g in zip(invalid_geoms.index.tolist(), invalid_geoms)]
+
+    gdf.loc[invalid, geometry.name] = gpd.GeoSeries(
+        [validate_geom(g) for g in invalid_geoms],
+        index=invalid_geoms.index,
+        crs=geometry.crs)
+
+    if report_path is not None:
+        _write_validity_report(report, report_path)
 
+    return gdf
 
-def coord_precision(features, precision, validate=True):
-    """Truncate precision of GeoJSON features
 
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
+def validate_geom(geom):
+    """Repair geometry if invalid
 
-    The MIT License (MIT)
+    Polygonal geometries stay polygonal: any points or lines created as a
+    byproduct of the repair are dropped.
+    """
+    if geom.is_valid:
+        return geom
 
-    Copyright (c) 2016 Matthew Perry
+    valid = make_valid(geom)
+    if isinstance(geom, (Polygon, MultiPolygon)) and \
+            isinstance(valid, GeometryCollection):
+        polygons = []
+        for g in valid.geoms:
+            if isinstance(g, Polygon):
+                polygons.append(g)
+            elif isinstance(g, MultiPolygon):
+                polygons.extend(g.geoms)
+        valid = MultiPolygon(polygons)
 
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
+    return valid
 
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
 
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
-    """
-    for feature in features:
-        coords = _set_precision(feature['geometry']['coordinates'], precision)
-        feature['geometry']['coordinates'] = coords
-        if validate:
-            geom = asShape(feature['geometry'])
-            geom.is_valid
-        yield feature
-
-
-def _set_precision(coords, precision):
-    """Truncate precision of coordinates
-
-    Taken from geojson-precision:
-    https://github.com/perrygeo/geojson-precision
-
-    The MIT License (MIT)
-
-    Copyright (c) 2016 Matthew Perry
-
-    Permission is hereby granted, free of charge, to any person obtaining a copy
-    of this software and associated documentation files (the "Software"), to
-    deal in the Software without restriction, including without limitation the
-    rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
-    sell copies of the Software, and to permit persons to whom the Software is
-    furnished to do so, subject to the following conditions:
-
-    The above copyright notice and this permission notice shall be included in
-    all copies or substantial portions of the Software.
-
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
-    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
-    IN THE SOFTWARE.
-    """
-    result = []
-    try:
-        return round(coords, int(precision))
-    except TypeError:
-        for coord in coords:
-            result.append(_set_precision(coord, precision))
-    return result
+def validate_geojson(gj, report_path=None):
+    """Make sure all geometries in GeoJSON are valid
 
+    Only geometries that are invalid are serialized back to GeoJSON; valid
+    geometries are returned as is.
 
-def validate_geom_gdf(gdf):
-    geom_col = gdf.geometry.name
-    gdf[geom_col] = gdf.apply(lambda row: validate_geom(row.geometry), axis=1)
-    return gdf
+    Args:
+        - gj: must be geojson object!
+        - report_path: if provided, write JSON report of repaired features to
+          this path
+    """
+    if gj['type'] == 'FeatureCollection':
+        features = list(gj['features'])
+    elif gj['type'] == 'Feature':
+        features = [gj]
+    else:
+        features = [{'geometry': gj}]
 
+    geometries = gpd.GeoSeries([
+        shape(f['geometry']) if f['geometry'] is not None else None
+        for f in features])
+    invalid = ~(geometries.is_valid | geometries.isna())
+    if not invalid.any():
+        if report_path is not None:
+            _write_validity_report([], report_path)
+        return gj
 
-def validate_geom(geom):
-    if geom.is_valid:
-        return geom
+    report = []
+    for i in invalid[invalid].index:
+        geometry = geometries[i]
+        report.append({'index': int(i), 'reason': explain_validity(geometry)})
+        features[i] = {
+            **features[i], 'geometry': mapping(validate_geom(geometry))}
 
-    return geom.buffer(0)
+    if report_path is not None:
+        _write_validity_report(report, report_path)
 
+    if gj['type'] == 'FeatureCollection':
+        return {**gj, 'features': features}
+    if gj['type'] == 'Feature':
+        return features[0]
+    return features[0]['geometry']
 
-def validate_geojson(gj):
-    """Make sure all geometries in GeoJSON are valid
 
-    Args:
-        - gj: must be geojson object!
-    """
-    return geojson.utils.map_geometries(
-        lambda g: mapping(validate_geom(shape(g))), gj)
+def _write_validity_report(report, path):
+    """Write report of repaired features to JSON file"""
+    with open(path, 'w') as f:
+        json.dump({'n_repaired': len(report), 'features': report}, f, indent=2)
 
 
 def to_2d(obj):
-    """Convert geometric object from 3D to 2D"""
+    """Convert geometric object from 3D to 2D
+
+    Args:
+        - obj: GeoDataFrame, GeoSeries, or shapely geometry
+    """
     if isinstance(obj, gpd.GeoDataFrame):
-        return _to_2d_gdf(obj)
+        obj[obj.geometry.name] = _to_2d_series(obj.geometry)
+        return obj
 
     if isinstance(obj, gpd.GeoSeries):
-        return _to_2d_gdf(obj)
+        return _to_2d_series(obj)
+
+    if obj is None or not obj.has_z:
+        return obj
 
-    return transform(_to_2d_transform, obj)
+    return transform_coords(obj, _drop_z)
 
 
-def _to_2d_gdf(obj):
-    # Get geometry column
-    geometry = obj.geometry
+def _to_2d_series(geometry):
+    """Convert GeoSeries from 3D to 2D
 
-    # Replace geometry column with 2D coords
-    geometry_name = obj.geometry.name
-    try:
-        obj[geometry_name] = geometry.apply(
-            lambda g: transform(_to_2d_transform, g))
-    except TypeError:
-        # Means geometry is already 2D
-        pass
+    Only geometries that have Z coordinates are rebuilt. With Shapely 2.0+,
+    they are all converted in a single call; otherwise each geometry is rebuilt
+    from slices of its coordinate arrays.
+    """
+    has_z = geometry.has_z
+    if not has_z.any():
+        return geometry
 
-    return obj
+    geometry = geometry.copy()
+    if _force_2d_array is not None:
+        geometry[has_z] = _force_2d_array(np.asarray(geometry[has_z]))
+    else:
+        geometry[has_z] = [
+            transform_coords(g, _drop_z) for g in geometry[has_z]]
 
+    return geometry
 
-def _to_2d_transform(x, y, z=None):
-    return tuple(filter(None, [x, y]))
+
+def _drop_z(coords):
+    return coords[:, :2]
 
 
 def reproject(geometry, to_epsg: int, from_epsg: int = None):
@@ -236,11 +268,20 @@ def reproject(geometry, to_epsg: int, from_epsg: int = None):
     return transform(project, geometry)
 
 
-def find_circles_that_tile_polygon(polygon, radius,
-                                   crs=3488) -> List[Tuple[Polygon, float]]:
-    """
-    Following this article [0], I'll split into smaller and smaller rectangles
-    until each rectangle is small enough to be circumscribed within `radius`.
+def find_circles_that_tile_polygon(
+        polygon, radius, crs=3488,
+        method='hex') -> Tuple[List[Point], List[float]]:
+    """Find circles that together cover polygon
+
+    With the default `hex` method, circles of fixed `radius` are placed on a
+    hexagonal lattice in projected space, which covers the plane with the
+    fewest circles of a given radius. `square` uses a square lattice instead.
+    Only circles that intersect the polygon are kept.
+
+    With the `katana` method, following this article [0], I'll split into
+    smaller and smaller rectangles until each rectangle is small enough to be
+    circumscribed within `radius`, and then find the minimum bounding circle of
+    each piece.
 
     [0]: https://snorfalorpagus.net/blog/2016/03/13/splitting-large-polygons-for-faster-intersections/
 
@@ -248,17 +289,86 @@ def find_circles_that_tile_polygon(polygon, radius,
         - polygon: polygon in WGS84
         - radius: max radius of circle in meters
         - crs: epsg code of projected coordinate system using meters
+        - method: one of 'hex', 'square', 'katana'
 
     Returns:
-        - list of (circle Polygons, circle radius)
+        - (list of circle center Points in WGS84, list of circle radii)
+    """
+    # First, reproject polygon so that I can work in meters
+    polygon = reproject(polygon, to_epsg=crs, from_epsg=WGS84)
+
+    if method in ['hex', 'square']:
+        x, y = _circles_on_lattice(polygon, radius, lattice=method)
+        radii = [radius] * len(x)
+    elif method == 'katana':
+        x, y, radii = _circles_from_katana(polygon, radius)
+    else:
+        raise ValueError("method must be one of 'hex', 'square', 'katana'")
+
+    # Reproject centers back to WGS84 all at once
+    transformer = pyproj.Transformer.from_crs(crs, WGS84, always_xy=True)
+    lon, lat = transformer.transform(x, y)
+    points = [Point(xy) for xy in zip(lon, lat)]
+    return points, radii
+
+
+def _circles_on_lattice(polygon, radius, lattice='hex'):
+    """Find centers of lattice circles that intersect projected polygon
+
+    Args:
+        - polygon: _projected_ polygon
+        - radius: radius of each circle
+        - lattice: either 'hex' or 'square'
+
+    Returns:
+        (array of x, array of y)
+    """
+    if lattice == 'hex':
+        # Rows of circles 1.5 radii apart, every other row offset by half the
+        # horizontal spacing
+        dx = sqrt(3) * radius
+        dy = 1.5 * radius
+    else:
+        # Each circle circumscribes a square of side sqrt(2) * radius
+        dx = dy = sqrt(2) * radius
+
+    # Extend the lattice one cell past the bounds so that edges are covered
+    minx, miny, maxx, maxy = polygon.bounds
+    xs = np.arange(minx - dx, maxx + 2 * dx, dx)
+    ys = np.arange(miny - dy, maxy + 2 * dy, dy)
+    x, y = np.meshgrid(xs, ys)
+    if lattice == 'hex':
+        x[1::2] += dx / 2
+    x, y = x.ravel(), y.ravel()
+
+    # A circle intersects the polygon iff its center is within `radius` of the
+    # polygon. The buffer approximates each arc with segments that lie inside
+    # the true arc, so increase its distance by the maximum gap between segment
+    # and arc to make sure no circles that touch the polygon are dropped. The
+    # number of segments per quarter circle is passed positionally, since
+    # Shapely 2 renamed the `resolution` argument to `quad_segs`.
+    quad_segs = 16
+    distance = radius / cos(pi / (4 * quad_segs))
+    prepared = prep(polygon.buffer(distance, quad_segs))
+    keep = np.array(
+        [prepared.intersects(Point(xy)) for xy in zip(x, y)], dtype=bool)
+    return x[keep], y[keep]
+
+
+def _circles_from_katana(polygon, radius):
+    """Find minimum bounding circles of pieces of projected polygon
+
+    Args:
+        - polygon: _projected_ polygon
+        - radius: max radius of each circle
+
+    Returns:
+        (list of x, list of y, list of radii)
     """
     # Find box diameter for a square box circumscribed within a circle of given
     # radius
     box_diameter = (radius / sqrt(2)) * 2
 
-    # First, reproject polygon so that I can work in meters
-    polygon = reproject(polygon, WGS84, crs)
-
     # Split polygon into distinct pieces with max height or width `box_diameter`
     # These pieces tile the original geometry
     res = katana(polygon, threshold=box_diameter)
@@ -277,13 +387,9 @@ def find_circles_that_tile_polygon(polygon, radius,
     # circle that fully encloses your polygon.
     # Ref:
     # https://stackoverflow.com/a/41776277
-    circles = [make_circle(g.exterior.coords) for g in res]
-    points = [Point(x, y) for x, y, r in circles]
-    radii = [x[2] for x in circles]
-
-    # Reproject back to WGS84
-    reprojected_points = [reproject(point, crs, WGS84) for point in points]
-    return reprojected_points, radii
+    circles = [minimum_enclosing_circle(g.exterior.coords) for g in res]
+    x, y, radii = zip(*circles) if circles else ([], [], [])
+    return list(x), list(y), list(radii)
 
 
 def katana(geometry, threshold, count=0):
@@ -0,0 +1,109 @@
+"""
+Reduce coordinate precision of geometries
+
+This file depends only on NumPy and Shapely, which are both provided by the
+`geolambda-python` layer, so that it can be copied next to the AWS Lambda
+handlers and imported from `data_source/epa.py` and
+`data_source/nifc_current.py`.
+"""
+
+import numpy as np
+from shapely.geometry import (
+    GeometryCollection, LinearRing, LineString, MultiLineString, MultiPoint,
+    MultiPolygon, Point, Polygon)
+
+try:
+    # Shapely 2.0+ can operate on whole arrays of geometries at once
+    from shapely import simplify as _simplify_array
+    from shapely import transform as _transform_array
+except ImportError:
+    _simplify_array = None
+    _transform_array = None
+
+
+def round_geometry(geom, digits, tolerance=None):
+    """Round coordinates of geometry to desired digits
+
+    Coordinates of each point sequence are rounded as a single NumPy array.
+
+    Args:
+        - geom: geometry to round coordinates of
+        - digits: number of decimal places to round
+        - tolerance: if provided, simplify geometry with this tolerance before
+          rounding
+
+    Returns:
+        geometry of same type as provided
+    """
+    if geom is None or geom.is_empty:
+        return geom
+
+    if tolerance is not None:
+        geom = geom.simplify(tolerance)
+
+    return transform_coords(geom, lambda c: np.round(c, digits))
+
+
+def round_geometries(geometries, digits, tolerance=None):
+    """Round coordinates of many geometries to desired digits
+
+    With Shapely 2.0+, the coordinates of all geometries are simplified and
+    rounded as a single array. Otherwise each geometry is handled with
+    `round_geometry`.
+
+    Args:
+        - geometries: list or GeoSeries of geometries
+        - digits: number of decimal places to round
+        - tolerance: if provided, simplify geometries with this tolerance before
+          rounding
+
+    Returns:
+        GeoSeries if given a GeoSeries, otherwise list of geometries
+    """
+    is_series = hasattr(geometries, 'crs') and hasattr(geometries, 'index')
+    values = np.empty(len(geometries), dtype=object)
+    for i, geom in enumerate(geometries):
+        values[i] = geom
+
+    if _transform_array is not None:
+        if tolerance is not None:
+            values = _simplify_array(values, tolerance)
+        values = _transform_array(values, lambda c: np.round(c, digits))
+    else:
+        values = [round_geometry(g, digits, tolerance) for g in values]
+
+    if is_series:
+        return type(geometries)(
+            list(values), index=geometries.index, crs=geometries.crs)
+
+    return list(values)
+
+
+def transform_coords(geom, func):
+    """Rebuild geometry from its parts with transformed coordinates
+
+    Args:
+        - geom: geometry to transform coordinates of
+        - func: function that takes an (N, 2) or (N, 3) array of the
+          coordinates of each point sequence and returns an array of new
+          coordinates
+
+    Returns:
+        geometry of same type as provided
+    """
+    if isinstance(geom, Point):
+        return Point(func(np.asarray(geom.coords))[0])
+
+    if isinstance(geom, (LineString, LinearRing)):
+        return type(geom)(func(np.asarray(geom.coords)))
+
+    if isinstance(geom, Polygon):
+        return Polygon(
+            func(np.asarray(geom.exterior.coords)),
+            [func(np.asarray(i.coords)) for i in geom.interiors])
+
+    if isinstance(geom, (MultiPoint, MultiLineString, MultiPolygon,
+                         GeometryCollection)):
+        return type(geom)([transform_coords(g, func) for g in geom.geoms])
+
+    raise TypeError(f'Unsupported geometry type: {geom.geom_type}')
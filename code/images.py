@@ -0,0 +1,218 @@
+"""
+Convert photos to web-ready JPEGs
+
+Each photo is decoded once and saved as a full-size JPEG along with resized
+variants. HEIC photos are read through the `pillow-heif` plugin, and camera raw
+files, like the Sony a6000's `.ARW`, through `rawpy`.
+"""
+
+import hashlib
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from shutil import copyfile
+
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Resized variants: name: maximum width or height in pixels
+DEFAULT_SIZES = {'thumb': 300, 'medium': 1200}
+
+RAW_EXTENSIONS = ['.arw', '.cr2', '.dng', '.nef']
+
+JPEG_EXTENSIONS = ['.jpeg', '.jpg']
+
+MANIFEST_NAME = '.manifest.json'
+
+# EXIF tag for image orientation
+_ORIENTATION = 0x0112
+
+# Number of converted photos between saves of the manifest
+_MANIFEST_SAVE_EVERY = 20
+
+Log = logging.getLogger()
+
+
+def convert_photos(
+        xw,
+        out_dir,
+        sizes=None,
+        strip_exif=False,
+        quality=90,
+        overwrite=False,
+        n_workers=None):
+    """Convert photos to JPEG, with resized variants, in parallel
+
+    For each photo, writes `{stub}.jpeg` at full size and `{stub}_{name}.jpeg`
+    for each of `sizes`. A manifest of source file hashes is kept in
+    `out_dir`, so that photos whose source and options haven't changed since
+    the last run are skipped. The manifest is saved as photos are converted,
+    so that an interrupted run doesn't lose the photos already converted.
+    Photos that fail to convert are logged and retried on the next run.
+
+    Args:
+        - xw: dict of existing photo path: output file stub
+        - out_dir: output directory
+        - sizes: dict of variant name: maximum width or height in pixels. By
+          default `DEFAULT_SIZES`.
+        - strip_exif: if True, remove EXIF metadata, including GPS position,
+          from outputs
+        - quality: JPEG quality of converted images
+        - overwrite: if True, convert all photos even if unchanged
+        - n_workers: number of processes; by default the number of CPUs
+
+    Returns:
+        dict with number of photos `converted`, `skipped` and `failed`
+    """
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    out_dir = Path(out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+
+    manifest_path = out_dir / MANIFEST_NAME
+    manifest = {}
+    if manifest_path.exists() and not overwrite:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # Changing any option means every output needs to be regenerated
+    options = {'sizes': sizes, 'strip_exif': strip_exif, 'quality': quality}
+    options_key = hashlib.md5(
+        json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+    jobs = [(
+        str(path), str(out_dir), stub, sizes, strip_exif, quality,
+        options_key, manifest.get(stub)) for path, stub in xw.items()]
+
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(_convert_photo, jobs, chunksize=4)
+            for stub, entry, status, error in results:
+                counts[status] += 1
+                if status == 'failed':
+                    Log.warning(f'Failed to convert {stub}: {error}')
+                    manifest.pop(stub, None)
+                    continue
+
+                manifest[stub] = entry
+                if status == 'converted' and \
+                        counts['converted'] % _MANIFEST_SAVE_EVERY == 0:
+                    _save_manifest(manifest, manifest_path)
+    finally:
+        _save_manifest(manifest, manifest_path)
+
+    return counts
+
+
+def _save_manifest(manifest, path):
+    """Write manifest atomically, so that an interrupted write can't corrupt
+    it
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_path.replace(path)
+
+
+def _convert_photo(job):
+    """Convert one photo, catching any error so that one bad photo doesn't
+    stop the others
+
+    Returns:
+        (stub, manifest entry, status, error message), where status is one of
+        `converted`, `skipped` or `failed`
+    """
+    stub = job[2]
+    try:
+        entry, converted = _convert(*job)
+    except Exception as e:
+        return stub, None, 'failed', f'{type(e).__name__}: {e}'
+
+    return stub, entry, 'converted' if converted else 'skipped', None
+
+
+def _convert(
+        path, out_dir, stub, sizes, strip_exif, quality, options_key,
+        previous):
+    """Convert one photo
+
+    Returns:
+        (manifest entry, whether photo was converted)
+    """
+    path = Path(path)
+    out_dir = Path(out_dir)
+
+    outputs = [out_dir / f'{stub}.jpeg']
+    outputs.extend(out_dir / f'{stub}_{name}.jpeg' for name in sizes)
+
+    entry = {'source_md5': _file_md5(path), 'options': options_key}
+    if entry == previous and all(p.exists() for p in outputs):
+        return entry, False
+
+    img, exif = _open_image(path)
+
+    # Bake orientation into the pixels, so that outputs display correctly
+    # whether or not EXIF is kept
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ['RGB', 'L']:
+        img = img.convert('RGB')
+
+    save_kwargs = {'quality': quality}
+    if exif and not strip_exif:
+        exif[_ORIENTATION] = 1
+        save_kwargs['exif'] = exif.tobytes()
+
+    # JPEGs that keep their metadata are copied as is, without recompressing
+    if path.suffix.lower() in JPEG_EXTENSIONS and not strip_exif:
+        copyfile(path, outputs[0])
+    else:
+        img.save(outputs[0], 'JPEG', **save_kwargs)
+
+    for name, max_size in sizes.items():
+        resized = img.copy()
+        resized.thumbnail((max_size, max_size), Image.LANCZOS)
+        resized.save(out_dir / f'{stub}_{name}.jpeg', 'JPEG', **save_kwargs)
+
+    return entry, True
+
+
+def _open_image(path):
+    """Decode image
+
+    Returns:
+        (PIL.Image, PIL.Image.Exif or None)
+    """
+    if path.suffix.lower() in RAW_EXTENSIONS:
+        import rawpy
+
+        with rawpy.imread(str(path)) as raw:
+            rgb = raw.postprocess(use_camera_wb=True)
+
+        # Camera raw files are mostly TIFF-based, so Pillow can often still
+        # read their EXIF
+        try:
+            with Image.open(path) as f:
+                exif = f.getexif()
+        except OSError:
+            exif = None
+
+        return Image.fromarray(rgb), exif
+
+    img = Image.open(path)
+    img.load()
+    return img, img.getexif()
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
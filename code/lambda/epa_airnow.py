@@ -6,43 +6,100 @@ Layers used:
 - geolambda: arn:aws:lambda:us-east-1:552188055668:layer:geolambda:4
 - geolambda-python: arn:aws:lambda:us-east-1:552188055668:layer:geolambda-python:3
 - Klayers-python37-requests: arn:aws:lambda:us-east-1:113088814899:layer:Klayers-python37-requests:9
-- nst-guide-fastkml-python37: arn:aws:lambda:us-east-1:961053664803:layer:nst-guide-fastkml-python37:2
 - nst-guide-geojson-python37: arn:aws:lambda:us-east-1:961053664803:layer:nst-guide-geojson-python37:1
+
+`data_source/epa.py`, `geom/precision.py` and `aqi_series.py` are copied next
+to this file. The output is only uploaded when it changed; see `publish.py`.
+
+PM2.5, Ozone and Combined are fetched in parallel, for the same hour. When the
+trail grid exists at `airnow/series/grid.json`, each new snapshot is also
+rasterized onto it and appended to `airnow/series/{air_measure}/`; see
+`aqi_series.py`.
 """
 
-import gzip
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from shapely.geometry import shape
+
+from aqi_series import append_snapshot, cell_centers, rasterize, to_hour
+from epa import AIR_MEASURES, AQI_LEVELS, EPAAirNow, snapshot_time
+from publish import publish_geojson
 
-from epa import EPAAirNow
+BUCKET = 'tiles.nst.guide'
+GRID_KEY = 'airnow/series/grid.json'
 
-s3 = boto3.resource('s3')
+s3 = boto3.client('s3')
 
 
 def lambda_handler(event, context):
     """AWS Lambda entry point"""
     airnow = EPAAirNow()
-    # Eventually also set to Ozone, Combined
-    air_measure = 'PM25'
-    gj = airnow.current_air_quality(air_measure=air_measure)
-
-    # If HTTP response is not 200, None is returned
-    if gj is None:
-        return
-
-    # Set separators so that there are no useless spaces in the GeoJSON file
-    minified = json.dumps(json.loads(str(gj)), separators=(',', ':'))
-
-    # Compress using gzip
-    compressed = gzip.compress(minified.encode('utf-8'))
-
-    # Write individual GeoJSON file to S3
-    # 2-hour cache plus 24-hour stale-while-revalidate
-    obj = s3.Object('tiles.nst.guide', f'airnow/{air_measure}.geojson')
-    obj.put(
-        Body=compressed,
-        ContentType='application/geo+json',
-        ACL='public-read',
-        ContentEncoding='gzip',
-        CacheControl='public, max-age=7200, stale-while-revalidate=86400')
+    time = snapshot_time()
+    grid = load_grid(s3, BUCKET, GRID_KEY)
+
+    def update(air_measure):
+        return update_air_measure(s3, BUCKET, airnow, air_measure, time, grid)
+
+    with ThreadPoolExecutor(max_workers=len(AIR_MEASURES)) as executor:
+        statuses = executor.map(update, AIR_MEASURES)
+        return {'status': dict(zip(AIR_MEASURES, statuses))}
+
+
+def update_air_measure(client, bucket, airnow, air_measure, time, grid=None):
+    """Publish GeoJSON of one air measure and append it to its time series
+
+    Args:
+        - client: boto3 S3 client
+        - bucket: S3 bucket name
+        - airnow: EPAAirNow instance
+        - air_measure: either 'PM25', 'Combined', or 'Ozone'
+        - time: UTC datetime of snapshot
+        - grid: (lon, lat) arrays of cell centers, or None to skip the time
+          series
+
+    Returns:
+        status from `publish_geojson`
+    """
+    parsed = []
+
+    def parse(content):
+        gj = airnow.parse_response(content)
+        parsed.append(gj)
+        return gj
+
+    status = publish_geojson(
+        client,
+        bucket,
+        f'airnow/{air_measure}.geojson',
+        fetch=lambda headers: airnow.request(
+            air_measure=air_measure, headers=headers, time=time),
+        parse=parse)
+
+    if grid is not None and parsed:
+        features = parsed[0]['features']
+        geometries = [shape(f['geometry']) for f in features]
+        classes = [
+            AQI_LEVELS.index(f['properties']['aqi']) + 1 for f in features]
+        values = rasterize(geometries, classes, *grid)
+        append_snapshot(
+            client, bucket, f'airnow/series/{air_measure}', to_hour(time),
+            values)
+
+    return status
+
+
+def load_grid(client, bucket, key):
+    """Load cell centers of trail grid from S3
+
+    Returns:
+        (lon, lat) arrays of cell centers, or None if the grid doesn't exist
+    """
+    try:
+        r = client.get_object(Bucket=bucket, Key=key)
+    except client.exceptions.NoSuchKey:
+        return None
+
+    grid = json.loads(r['Body'].read())
+    return cell_centers(grid['cells'], grid['cell_size'])
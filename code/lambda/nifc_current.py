@@ -8,35 +8,26 @@ Layers used:
 - nst-guide-geojson-python37: arn:aws:lambda:us-east-1:961053664803:layer:nst-guide-geojson-python37:1
 - nst-guide-pyshp-python37: arn:aws:lambda:us-east-1:961053664803:layer:nst-guide-pyshp-python37:1
 - Klayers-python37-requests: arn:aws:lambda:us-east-1:113088814899:layer:Klayers-python37-requests:9
-"""
 
-import gzip
-import json
+`data_source/nifc_current.py` and `geom/precision.py` are copied next to this
+file. The output is only uploaded when it changed; see `publish.py`.
+"""
 
 import boto3
 
 from nifc_current import NIFCCurrent
+from publish import publish_geojson
 
-s3 = boto3.resource('s3')
+s3 = boto3.client('s3')
 
 
 def lambda_handler(event, context):
     """AWS Lambda entry point"""
     nifc = NIFCCurrent()
-    gj = nifc.geojson()
-
-    # Set separators so that there are no useless spaces in the GeoJSON file
-    minified = json.dumps(json.loads(str(gj)), separators=(',', ':'))
-
-    # Compress using gzip
-    compressed = gzip.compress(minified.encode('utf-8'))
-
-    # Write individual GeoJSON file to S3
-    obj = s3.Object('tiles.nst.guide', f'nifc/current.geojson')
-    # 2-hour cache plus 24-hour stale-while-revalidate
-    obj.put(
-        Body=compressed,
-        ContentType='application/geo+json',
-        ACL='public-read',
-        ContentEncoding='gzip',
-        CacheControl='public, max-age=7200, stale-while-revalidate=86400')
+    status = publish_geojson(
+        s3,
+        'tiles.nst.guide',
+        'nifc/current.geojson',
+        fetch=lambda headers: nifc.request(headers=headers),
+        parse=nifc.parse_response)
+    return {'status': status}
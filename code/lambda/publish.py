@@ -0,0 +1,121 @@
+"""
+Publish GeoJSON to S3 only when it changed
+
+Shared by the AWS Lambda handlers. The S3 object's metadata records the upstream
+`ETag` and `Last-Modified` headers, and a hash of the gzipped output:
+
+- The upstream request is made conditional on those headers, so when the
+  upstream data hasn't changed, the server answers `304 Not Modified` and
+  nothing is downloaded or parsed.
+- Otherwise, the output is only uploaded if its hash differs. If it doesn't,
+  only the object's metadata is updated, with a server-side copy.
+"""
+
+import gzip
+import hashlib
+import json
+from io import BytesIO
+
+# Names of S3 object metadata keys
+SOURCE_ETAG = 'source-etag'
+SOURCE_LAST_MODIFIED = 'source-last-modified'
+CONTENT_HASH = 'content-sha256'
+
+# 2-hour cache plus 24-hour stale-while-revalidate
+CACHE_CONTROL = 'public, max-age=7200, stale-while-revalidate=86400'
+
+
+def publish_geojson(client, bucket, key, fetch, parse):
+    """Fetch, parse, and upload GeoJSON to S3 if upstream data changed
+
+    Args:
+        - client: boto3 S3 client
+        - bucket: S3 bucket name
+        - key: S3 key of GeoJSON file
+        - fetch: function that takes a dict of HTTP headers to add to the
+          upstream request, and returns a `requests.Response`
+        - parse: function that takes the content of the upstream response and
+          returns GeoJSON
+
+    Returns:
+        one of:
+        - 'not_modified': upstream data hasn't changed since the last run
+        - 'unchanged': upstream data changed, but the output is the same
+        - 'updated': new output was uploaded
+        - 'failed': upstream request failed
+    """
+    metadata = head_metadata(client, bucket, key)
+
+    headers = {}
+    if metadata.get(SOURCE_ETAG):
+        headers['If-None-Match'] = metadata[SOURCE_ETAG]
+    if metadata.get(SOURCE_LAST_MODIFIED):
+        headers['If-Modified-Since'] = metadata[SOURCE_LAST_MODIFIED]
+
+    r = fetch(headers)
+    if r.status_code == 304:
+        return 'not_modified'
+    if r.status_code != 200:
+        return 'failed'
+
+    gj = parse(r.content)
+    compressed = gzip_geojson(gj)
+
+    new_metadata = {CONTENT_HASH: hashlib.sha256(compressed).hexdigest()}
+    if r.headers.get('ETag'):
+        new_metadata[SOURCE_ETAG] = r.headers['ETag']
+    if r.headers.get('Last-Modified'):
+        new_metadata[SOURCE_LAST_MODIFIED] = r.headers['Last-Modified']
+
+    put_kwargs = {
+        'Bucket': bucket,
+        'Key': key,
+        'Metadata': new_metadata,
+        'ContentType': 'application/geo+json',
+        'ACL': 'public-read',
+        'ContentEncoding': 'gzip',
+        'CacheControl': CACHE_CONTROL,
+    }
+
+    if metadata.get(CONTENT_HASH) == new_metadata[CONTENT_HASH]:
+        # Keep the new upstream headers, so that the next request can be
+        # answered with 304
+        if metadata != new_metadata:
+            client.copy_object(
+                CopySource={'Bucket': bucket, 'Key': key},
+                MetadataDirective='REPLACE',
+                **put_kwargs)
+        return 'unchanged'
+
+    client.put_object(Body=compressed, **put_kwargs)
+    return 'updated'
+
+
+def head_metadata(client, bucket, key):
+    """Get user metadata of S3 object
+
+    Returns:
+        dict of metadata; empty if the object doesn't exist
+    """
+    try:
+        return client.head_object(Bucket=bucket, Key=key)['Metadata']
+    except client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            return {}
+        raise
+
+
+def gzip_geojson(gj):
+    """Minify and gzip GeoJSON reproducibly
+
+    The gzip header's modification time is fixed, so that the same GeoJSON
+    always gives the same bytes and hash.
+    """
+    # Set separators so that there are no useless spaces in the GeoJSON file
+    minified = json.dumps(json.loads(str(gj)), separators=(',', ':'))
+
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(minified.encode('utf-8'))
+
+    return buf.getvalue()
@@ -11,8 +11,8 @@ for how to separate a click CLI into subfiles
 import click
 
 from cli.data_export import (
-    national_forests, national_parks, town_boundaries, transit, wikipedia,
-    wilderness, wildfire_historical)
+    air_quality_grid, national_forests, national_parks, town_boundaries,
+    transit, wikipedia, wilderness, wildfire_historical)
 from cli.geom import polylabel
 from cli.photos import copy_using_xw, geotag_photos
 from cli.tiles import package_tiles, tiles_for_trail
@@ -38,6 +38,7 @@ def export():
     pass
 
 
+export.add_command(air_quality_grid)
 export.add_command(national_forests)
 export.add_command(national_parks)
 export.add_command(town_boundaries)
@@ -4,19 +4,39 @@
 Package tiles into Zip file
 """
 
+import fcntl
+import hashlib
+import json
 import logging
+import os
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, islice
 from pathlib import Path
+from time import perf_counter
 
 import geopandas as gpd
+import numpy as np
 
-from geom import buffer
-from tiles import tiles_for_polygon
+from geom import CA_ALBERS, WGS84, distance_in_meters, reproject
+from tile_archive import ARCHIVE_FORMATS, open_archive
+from tiles import (
+    tile_json_for_keys, tile_json_from_tippecanoe, tile_keys_for_polygon,
+    unpack_tiles)
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 Log = logging.getLogger()
 
+COPY_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+OUTPUT_FORMATS = ('dir', ) + ARCHIVE_FORMATS
+
+# ioctl request number for a copy-on-write clone on Linux (btrfs, xfs)
+_FICLONE = 0x40049409
+
+# Number of tiles handed to each worker at a time
+_COPY_BATCH_SIZE = 1000
+
 
 def temp():
     geometry_path = '/Users/kyle/github/mapping/nst-guide/create-database/data/pct/line/halfmile/CA_Sec_A_tracks.geojson'
@@ -39,6 +59,11 @@ def package_tiles(
         max_zooms,
         out_dir,
         raise_errors,
+        output_format='dir',
+        copy_mode='copy',
+        n_workers=None,
+        previous_manifest=None,
+        write_manifest=False,
         verbose=False):
     """Package tiles into directory
 
@@ -59,7 +84,41 @@ def package_tiles(
         - raise_errors: whether to raise errors if a requested tile doesn't
           exist. I.e. might not have some tiles for the few miles in
           Canada or buffer in Mexico
+        - output_format: one of `OUTPUT_FORMATS`. If `dir`, tiles are placed
+          in {buffer}/{tileset}/{z}/{x}/{y} directories; otherwise each tile
+          source for each buffer is written to a single
+          {buffer}/{tileset}.{output_format} archive.
+        - copy_mode: how to place each tile in out_dir, one of `COPY_MODES`.
+          hardlink, reflink and symlink require src_dirs and out_dir to be on
+          the same filesystem; reflink falls back to a copy when the
+          filesystem doesn't support it.
+        - n_workers: number of threads to use for copying. Defaults to the
+          ThreadPoolExecutor default.
+        - previous_manifest: path to manifest.json of a previous package. If
+          provided, only tiles that were added or changed since that package
+          are written, and the added, changed and deleted tiles are listed in
+          out_dir/manifest_diff.json.
+        - write_manifest: if True, write a manifest of the content hash of
+          every packaged tile to out_dir/manifest.json, to be used as the
+          previous manifest of the next package. Always written when
+          previous_manifest is provided.
+
+    Tiles are only hashed when a manifest is written. A tile whose size and
+    modification time are the same as in the previous manifest keeps its
+    previous hash without being read.
     """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}')
+    if copy_mode not in COPY_MODES:
+        raise ValueError(f'copy_mode must be one of {COPY_MODES}')
+
+    previous = None
+    previous_stats = None
+    if previous_manifest is not None:
+        previous = load_manifest(previous_manifest)
+        previous_stats = load_manifest_stats(previous_manifest)
+        write_manifest = True
+
     # Make sure output dir doesn't exist yet
     out_dir = Path(out_dir).resolve()
     out_dir.mkdir(exist_ok=False, parents=True)
@@ -71,6 +130,8 @@ def package_tiles(
     tile_indices_dict = get_tile_indices(gdf, buffer_dists, max_zooms)
 
     # For each buffer distance, package all files into directory
+    manifest = {} if write_manifest else None
+    manifest_stats = {}
     for buffer_dist, tile_indices in tile_indices_dict.items():
         if verbose:
             Log.info(f'Running for buffer_dist={buffer_dist}')
@@ -85,48 +146,124 @@ def package_tiles(
             min_zooms=min_zooms,
             max_zooms=max_zooms,
             raise_errors=raise_errors,
+            output_format=output_format,
+            copy_mode=copy_mode,
+            n_workers=n_workers,
+            manifest=manifest,
+            manifest_stats=manifest_stats,
+            previous_manifest=previous,
+            previous_stats=previous_stats,
+            manifest_prefix=out_dir_this.name,
             verbose=verbose)
 
+    if manifest is not None:
+        with open(out_dir / 'manifest.json', 'w') as f:
+            json.dump({
+                'tiles': manifest,
+                'stats': manifest_stats}, f, separators=(',', ':'))
+
+    if previous is not None:
+        diff = diff_manifests(previous, manifest)
+        with open(out_dir / 'manifest_diff.json', 'w') as f:
+            json.dump(diff, f, separators=(',', ':'))
+
+        if verbose:
+            counts = {k: len(v) for k, v in diff.items()}
+            Log.info(f'Tiles changed since previous manifest: {counts}')
+
+
+def load_manifest(path):
+    """Load tile manifest written by `package_tiles`
+
+    Returns:
+        dict from `{buffer}/{tileset}/{z}/{x}/{y}` to MD5 hex digest of tile
+    """
+    with open(path) as f:
+        return json.load(f)['tiles']
+
 
-def get_tile_indices(gdf, buffer_dists, max_zoom):
+def load_manifest_stats(path):
+    """Load source file stats of tiles in manifest written by `package_tiles`
+
+    Returns:
+        dict from `{buffer}/{tileset}/{z}/{x}/{y}` to [size, mtime in ns] of the
+        source tile. Empty for manifests written without stats.
+    """
+    with open(path) as f:
+        return json.load(f).get('stats', {})
+
+
+def diff_manifests(old, new):
+    """Compare two tile manifests
+
+    Args:
+        - old: manifest dict of previous package
+        - new: manifest dict of current package
+
+    Returns:
+        dict with sorted lists of `added`, `changed` and `deleted` tile keys
+    """
+    added = [k for k in new if k not in old]
+    changed = [k for k, v in new.items() if k in old and old[k] != v]
+    deleted = [k for k in old if k not in new]
+    return {
+        'added': sorted(added),
+        'changed': sorted(changed),
+        'deleted': sorted(deleted)}
+
+
+def get_tile_indices(gdf, buffer_dists, max_zoom, crs=CA_ALBERS):
     """Generate nested tile indices
 
     For a given GeoDataFrame, generate tile coordinates for each buffer
     distance. These tile coordinates should include include the difference
     between the current buffer distance and the smaller buffer distance, so that
     the tile coordinates can nest.
+
+    Tile coordinates are kept as sorted arrays of packed uint64 keys; see
+    `tiles.pack_tiles`.
+
+    Args:
+        - gdf: GeoDataFrame in EPSG 4326
+        - buffer_dists: iterable of distances in miles around geometry
+        - max_zoom: iterable of max zooms; tiles are generated from zoom 0 to
+          the largest of these
+        - crs: local projected coordinate system to use for buffers
+
+    Returns:
+        dict from buffer distance to sorted uint64 array of tile keys
     """
-    # Generate buffers around geometry and generate tile indices for that
-    # geometry
+    zoom_levels = range(0, max(max_zoom) + 1)
+
+    # Since a larger buffer contains the smaller one, each buffer is grown from
+    # the previous one in projected space, and only the ring between the two is
+    # burned into tiles. The tiles of the larger buffer that aren't in the
+    # smaller buffer are then exactly the ring's tiles minus every tile seen so
+    # far.
+    geometry = reproject(gdf, to_epsg=crs).unary_union
+
     tile_indices = {}
-    for buffer_dist in buffer_dists:
-        if buffer_dist > 0:
-            buf = buffer(gdf, distance=buffer_dist, unit='mile').unary_union
+    seen = np.array([], dtype=np.uint64)
+    prev_buf = None
+    prev_dist = 0
+    for buffer_dist in sorted(buffer_dists):
+        if prev_buf is None:
+            buf = geometry
+            if buffer_dist > 0:
+                buf = geometry.buffer(distance_in_meters(buffer_dist, 'mile'))
+            ring = buf
         else:
-            buf = gdf.unary_union
-
-        tiles = tiles_for_polygon(buf, zoom_levels=range(0, max(max_zoom) + 1))
-        tile_indices[buffer_dist] = tiles
-
-    # When multiple buffer distances are provided, change the higher values to
-    # be the difference in tiles between it and the next lowest buffer. So if
-    # the buffer distances provided are [2, 5, 10], then change tile_indices[5]
-    # to contain only the tile coordinates not in tile_indices[2]
-    #
-    # NOTE: make sure you create a new dict, otherwise, if you start at the
-    # bottom, when you're comparing buffer 5 and buffer 10, you might
-    # unintentionally take the set difference of 10 and (5 diff 2), which would
-    # include the original 2-buffer tiles. Either start at the largest dist, or
-    # you have to diff every lower value, or create a new dict...
-    buffer_dists = sorted(buffer_dists)
-    if len(buffer_dists) > 1:
-        tile_indices_new = {}
-        tile_indices_new[min(buffer_dists)] = tile_indices[min(buffer_dists)]
-        for prev_dist, dist in zip(buffer_dists, buffer_dists[1:]):
-            tile_indices_new[dist] = set(tile_indices[dist]).difference(
-                tile_indices[prev_dist])
-
-        tile_indices = tile_indices_new
+            distance_m = distance_in_meters(buffer_dist - prev_dist, 'mile')
+            buf = prev_buf.buffer(distance_m)
+            ring = buf.difference(prev_buf)
+
+        ring = reproject(ring, to_epsg=WGS84, from_epsg=crs)
+        keys = tile_keys_for_polygon(ring, zoom_levels=zoom_levels)
+        tile_indices[buffer_dist] = np.setdiff1d(keys, seen, assume_unique=True)
+        seen = np.union1d(seen, keys)
+
+        prev_buf = buf
+        prev_dist = buffer_dist
 
     # tile_indices now has the minimum tile coordinates for each zoom level
     return tile_indices
@@ -140,18 +277,43 @@ def _copy_tiles(
         min_zooms,
         max_zooms,
         raise_errors,
+        output_format='dir',
+        copy_mode='copy',
+        n_workers=None,
+        manifest=None,
+        manifest_stats=None,
+        previous_manifest=None,
+        previous_stats=None,
+        manifest_prefix='',
         verbose=False,
         ext=None):
     """Copy tiles to output directory
 
+    Each source z/x directory is listed once, and the copies are then spread
+    over a thread pool.
+
     Args:
         - dest_dir: directory to move files to
-        - tile_indices: list of tuples for files to move
+        - tile_indices: sorted uint64 array of packed tile keys to move
         - src_dirs: source directories
-        - tile_jsons: source tile JSON specs
+        - tile_jsons: source tile JSON specs. Zooms, bounds and center are
+          replaced with values computed from tile_indices.
         - min_zooms: min zoom for each source dir
         - max_zooms: max zoom for each source dir
         - raise_errors: if True, raises an error if the source file doesn't exist
+        - output_format: one of `OUTPUT_FORMATS`
+        - copy_mode: one of `COPY_MODES`. Only used when output_format is dir.
+        - n_workers: number of threads to use for copying
+        - manifest: dict to fill with the content hash of each tile, keyed by
+          `{manifest_prefix}/{tileset}/{z}/{x}/{y}`. If None, tiles aren't
+          hashed.
+        - manifest_stats: dict to fill with [size, mtime in ns] of each source
+          tile, with the same keys as manifest
+        - previous_manifest: if not None, tiles whose hash matches this
+          manifest are not copied
+        - previous_stats: source tile stats of previous manifest. Tiles with
+          the same stats keep their previous hash without being read.
+        - manifest_prefix: prefix of manifest keys, i.e. the buffer directory
         - ext: extensions to copy. If None, copies all files with x/y/z order. Should be a string.
     """
     if ext is not None:
@@ -166,55 +328,365 @@ def _copy_tiles(
         # I.e. you want 2/openmaptiles/{z}/{x}/{y}.ext
         # For now I'll get the name from the source dir
         tiledir_name = Path(src_dir).name
+        if output_format == 'dir':
+            dest = dest_dir / tiledir_name
+        else:
+            dest = dest_dir / f'{tiledir_name}.{output_format}'
+
         if verbose:
             Log.info(f'copying from src_dir={src_dir}')
-            Log.info(f'to dest_dir={dest_dir / tiledir_name}')
+            Log.info(f'to dest={dest}')
 
         # Get indices within min zoom and max zoom
-        filtered_indices = [
-            x for x in tile_indices if (x[2] >= min_zoom) & (x[2] <= max_zoom)
-        ]
-        for x, y, z in filtered_indices:
-            _copy_tile(
-                src_dir=src_dir,
-                dest_dir=dest_dir / tiledir_name,
-                x=x,
-                y=y,
-                z=z,
-                raise_errors=raise_errors,
-                ext=ext)
-
-        # Also copy the tile.json
-        # If tile_json is None, it's assumed to be
-        if tile_json is None:
-            tile_json = Path(src_dir) / 'tile.json'
-
-        try:
-            shutil.copy(tile_json, dest_dir / tiledir_name / 'tile.json')
-        except FileNotFoundError:
-            print('Warning: could not find tile_json file')
-
-
-def _copy_tile(src_dir, dest_dir, x, y, z, raise_errors, ext=None):
-    """Copy individual tile from src_dir to dest_dir
+        xs, ys, zs = unpack_tiles(tile_indices)
+        mask = (zs >= min_zoom) & (zs <= max_zoom)
+
+        # Tile JSON for this tile source and buffer, with zooms, bounds and
+        # center computed from the tile indices
+        metadata = tile_json_for_keys(
+            tile_indices[mask],
+            tile_json=_load_source_tile_json(src_dir, tile_json))
+        metadata.setdefault('name', tiledir_name)
+
+        start = perf_counter()
+        tiles = _find_tiles(
+            src_dir=Path(src_dir).resolve(),
+            xs=xs[mask].tolist(),
+            ys=ys[mask].tolist(),
+            zs=zs[mask].tolist(),
+            raise_errors=raise_errors,
+            ext=ext)
+
+        hashes = None
+        if manifest is not None:
+            hashes = _TileHashes(
+                manifest=manifest,
+                stats=manifest_stats if manifest_stats is not None else {},
+                previous=previous_manifest,
+                previous_stats=previous_stats,
+                prefix=f'{manifest_prefix}/{tiledir_name}'.lstrip('/'))
+
+        if output_format == 'dir':
+            n_bytes = _place_tiles(
+                tiles,
+                dest,
+                copy_mode=copy_mode,
+                hashes=hashes,
+                n_workers=n_workers)
+
+            with open(dest / 'tile.json', 'w', encoding='utf8') as f:
+                json.dump(metadata, f, ensure_ascii=False)
+        else:
+            n_bytes = _write_archive(
+                tiles,
+                dest,
+                output_format=output_format,
+                metadata=metadata,
+                hashes=hashes,
+                n_workers=n_workers)
+
+        if verbose:
+            elapsed = max(perf_counter() - start, 1e-9)
+            mode = copy_mode if output_format == 'dir' else output_format
+            Log.info(
+                f'{mode}: {len(tiles)} tiles, {n_bytes / 1e6:.1f} MB in '
+                f'{elapsed:.1f}s ({len(tiles) / elapsed:.0f} tiles/s, '
+                f'{n_bytes / 1e6 / elapsed:.1f} MB/s)')
+
+
+def _load_source_tile_json(src_dir, tile_json=None):
+    """Load tile JSON of source tile directory
 
     Args:
+        - src_dir: source tile directory
+        - tile_json: path to tile JSON. If None, looks for tile.json, then for
+          Tippecanoe's metadata.json, in src_dir.
+
+    Returns:
+        dict of tile JSON; empty if no file was found
+    """
+    if tile_json is not None:
+        with open(tile_json) as f:
+            return json.load(f)
+
+    if (Path(src_dir) / 'tile.json').exists():
+        with open(Path(src_dir) / 'tile.json') as f:
+            return json.load(f)
+
+    if (Path(src_dir) / 'metadata.json').exists():
+        with open(Path(src_dir) / 'metadata.json') as f:
+            return tile_json_from_tippecanoe(json.load(f))
+
+    print('Warning: could not find tile_json file')
+    return {}
+
+
+def _find_tiles(src_dir, xs, ys, zs, raise_errors, ext=None):
+    """Find source paths for tiles
+
+    Rather than globbing for every tile, each source z/x directory is listed
+    once.
+
+    Args:
+        - src_dir: source tile directory
+        - xs, ys, zs: lists of tile coordinates, sorted by z, then x
         - raise_errors: if True, raises an error when a file is not found
+        - ext: extension of tiles to copy, with leading dot. If None, matches
+          any file named `{y}` or `{y}.*`
+
+    Returns:
+        list of (z, x, y, src path string)
     """
-    src = Path(src_dir) / str(z) / str(x)
-    if ext is not None:
-        src = src / f'{y}{ext}'
-    else:
-        try:
-            src = list(src.glob(f'{y}*'))[0]
-        except IndexError:
-            if raise_errors:
-                raise FileNotFoundError(src / f'{z}*')
-            else:
-                return
-
-    # Use src.name instead of z to keep the correct file extension
-    dest = Path(dest_dir) / str(z) / str(x) / src.name
-    dest.parents[0].mkdir(exist_ok=True, parents=True)
-
-    shutil.copy(src, dest)
+    tiles = []
+    for (z, x), group in groupby(zip(zs, xs, ys), key=lambda t: (t[0], t[1])):
+        src = os.path.join(src_dir, str(z), str(x))
+        names = _scan_tile_dir(src, ext=ext)
+
+        for _, _, y in group:
+            name = names.get(str(y))
+            if name is None:
+                if raise_errors:
+                    raise FileNotFoundError(
+                        os.path.join(src, f'{y}{ext or "*"}'))
+                continue
+
+            tiles.append((z, x, y, os.path.join(src, name)))
+
+    return tiles
+
+
+class _TileHashes:
+    """Record tile content hashes in a manifest, and compare them with a
+    previous manifest
+    """
+    def __init__(
+            self, manifest, stats, previous=None, previous_stats=None,
+            prefix=''):
+        self.manifest = manifest
+        self.stats = stats
+        self.previous = previous
+        self.previous_stats = previous_stats or {}
+        self.prefix = prefix
+
+    def key(self, z, x, y):
+        return f'{self.prefix}/{z}/{x}/{y}'
+
+    def digest(self, key, path):
+        """MD5 hex digest and [size, mtime in ns] of source tile
+
+        The file is only read if its size or mtime differ from the previous
+        manifest.
+        """
+        stat = _file_stat(path)
+        digest = self.previous_digest(key, stat)
+        if digest is None:
+            digest = _file_md5(path)
+        return digest, stat
+
+    def previous_digest(self, key, stat):
+        """Digest in the previous manifest, if the source tile's size and
+        mtime are the same as then
+        """
+        if self.previous is None or self.previous_stats.get(key) != stat:
+            return None
+        return self.previous.get(key)
+
+    def add(self, key, digest, stat):
+        self.manifest[key] = digest
+        self.stats[key] = stat
+
+    def is_unchanged(self, key, digest):
+        """Whether tile is the same as in the previous manifest"""
+        return self.previous is not None and self.previous.get(key) == digest
+
+
+def _place_tiles(tiles, dest_dir, copy_mode, hashes, n_workers=None):
+    """Place tiles into {z}/{x}/ directories under dest_dir
+
+    Args:
+        - tiles: list of (z, x, y, src path) from `_find_tiles`
+        - dest_dir: destination tile directory
+        - copy_mode: one of `COPY_MODES`
+        - hashes: `_TileHashes` to record tile hashes in, or None to not hash
+          tiles. Tiles unchanged since the previous manifest are skipped.
+        - n_workers: number of threads to use
+
+    Returns:
+        number of bytes placed
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    copy_file = _COPY_FUNCTIONS[copy_mode]
+
+    def copy_batch(batch):
+        digests = []
+        n_bytes = 0
+        made_dirs = set()
+        for z, x, y, src in batch:
+            if hashes is not None:
+                key = hashes.key(z, x, y)
+                digest, stat = hashes.digest(key, src)
+                digests.append((key, digest, stat))
+                if hashes.is_unchanged(key, digest):
+                    continue
+
+            dest = os.path.join(dest_dir, str(z), str(x))
+            if dest not in made_dirs:
+                os.makedirs(dest, exist_ok=True)
+                made_dirs.add(dest)
+
+            # Use the source file name instead of y to keep the extension
+            n_bytes += copy_file(src, os.path.join(dest, os.path.basename(src)))
+
+        return digests, n_bytes
+
+    n_bytes = 0
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for digests, n in executor.map(copy_batch, _batched(tiles)):
+            for key, digest, stat in digests:
+                hashes.add(key, digest, stat)
+            n_bytes += n
+
+    return n_bytes
+
+
+def _write_archive(
+        tiles, path, output_format, metadata, hashes, n_workers=None):
+    """Write tiles into a single archive
+
+    Tiles are read over a thread pool and written to the archive from this
+    thread, a bounded number of batches at a time.
+
+    Args:
+        - tiles: list of (z, x, y, src path) from `_find_tiles`
+        - path: path of archive to create
+        - output_format: one of `tile_archive.ARCHIVE_FORMATS`
+        - metadata: tile JSON dict to store in the archive
+        - hashes: `_TileHashes` to record tile hashes in, or None to not hash
+          tiles. Tiles unchanged since the previous manifest are skipped.
+        - n_workers: number of threads to use for reading
+
+    Returns:
+        number of bytes written
+    """
+    tile_format = 'pbf'
+    if tiles:
+        tile_format = Path(tiles[0][3]).suffix.lstrip('.') or tile_format
+
+    def read_batch(batch):
+        result = []
+        for z, x, y, src in batch:
+            if hashes is None:
+                result.append((z, x, y, Path(src).read_bytes(), None, None))
+                continue
+
+            # Tiles with the same size and mtime as in the previous manifest
+            # are unchanged, and aren't read
+            key = hashes.key(z, x, y)
+            stat = _file_stat(src)
+            digest = hashes.previous_digest(key, stat)
+            data = None
+            if digest is None:
+                data = Path(src).read_bytes()
+                digest = hashlib.md5(data).hexdigest()
+            result.append((z, x, y, data, digest, stat))
+        return result
+
+    n_bytes = 0
+    with ThreadPoolExecutor(max_workers=n_workers) as executor, \
+            open_archive(path, output_format, tile_format=tile_format,
+                         metadata=metadata) as archive:
+        for window in _batched(_batched(tiles), 16):
+            for batch in executor.map(read_batch, window):
+                for z, x, y, data, digest, stat in batch:
+                    if hashes is not None:
+                        key = hashes.key(z, x, y)
+                        hashes.add(key, digest, stat)
+                        if hashes.is_unchanged(key, digest):
+                            continue
+
+                    archive.add_tile(z, x, y, data)
+                    n_bytes += len(data)
+
+    return n_bytes
+
+
+def _scan_tile_dir(path, ext=None):
+    """Map each tile's y coordinate to its file name in a z/x directory
+
+    Args:
+        - path: path to z/x directory
+        - ext: if not None, only include files with this extension
+
+    Returns:
+        dict from y string to file name. Empty if the directory doesn't exist.
+    """
+    names = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                stem, dot, suffix = entry.name.partition('.')
+                if ext is not None and dot + suffix != ext:
+                    continue
+                names.setdefault(stem, entry.name)
+    except FileNotFoundError:
+        pass
+
+    return names
+
+
+def _batched(iterable, n=_COPY_BATCH_SIZE):
+    """Split iterable into lists of length n, so that a pool isn't handed one
+    task per tile
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _file_md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _copy_file(src, dest):
+    shutil.copyfile(src, dest)
+    return os.path.getsize(dest)
+
+
+def _hardlink_file(src, dest):
+    os.link(src, dest)
+    return os.path.getsize(dest)
+
+
+def _symlink_file(src, dest):
+    os.symlink(src, dest)
+    return os.path.getsize(src)
+
+
+def _reflink_file(src, dest):
+    """Copy-on-write clone of src, falling back to a regular copy"""
+    try:
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+            fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+    except OSError:
+        return _copy_file(src, dest)
+
+    return os.path.getsize(dest)
+
+
+# Functions to place a single tile, keyed by copy mode. Each takes (src, dest)
+# paths and returns the number of bytes placed.
+_COPY_FUNCTIONS = {
+    'copy': _copy_file,
+    'hardlink': _hardlink_file,
+    'reflink': _reflink_file,
+    'symlink': _symlink_file,
+}
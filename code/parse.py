@@ -1,14 +1,24 @@
 # Upload waypoints to Parse Server
 
+import hashlib
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Optional, Union
+from urllib.parse import urlparse
 
 import geopandas as gpd
 import requests
 from dotenv import load_dotenv
-from shapely.geometry import Point
+from requests.adapters import HTTPAdapter
+
+# Maximum number of requests in a single Parse batch request
+BATCH_SIZE = 50
+
+# Responses that are retried: rate limited, or a transient server error
+RETRY_STATUSES = [429, 500, 502, 503, 504]
 
 
 def main():
@@ -26,6 +36,12 @@ def chunker(seq, size):
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
 
+def content_hash(obj: dict) -> str:
+    """Hash of JSON representation of object, independent of key order"""
+    s = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.md5(s.encode('utf-8')).hexdigest()
+
+
 class Parse(object):
     """Wrapper for Parse HTTP API"""
     def __init__(
@@ -33,14 +49,25 @@ class Parse(object):
             app_id: str,
             server_url: str,
             master_key: str = None,
-            rest_key: str = None):
+            rest_key: str = None,
+            max_connections: int = 8,
+            max_retries: int = 5,
+            backoff_factor: float = 0.5):
         """Wrapper for Parse HTTP API
 
+        All requests share one keep-alive session. Requests that are rate
+        limited or fail with a server error are retried with exponential
+        backoff.
+
         Args:
             app_id: Parse server Application Id
             server_url: Parse server URL
             master_key: Parse server master key
             rest_key: Parse server REST key
+            max_connections: number of connections to keep open to the server
+            max_retries: number of times to retry a failed request
+            backoff_factor: seconds to wait before the first retry; doubled for
+                each following retry
         """
         super(Parse, self).__init__()
 
@@ -55,23 +82,111 @@ class Parse(object):
         if self.master_key is not None:
             self.headers['X-Parse-Master-Key'] = self.master_key
 
-    def query(self, class_name: str, query: Optional[dict] = None) -> dict:
+        # Paths in batch requests include the mount path, e.g. /parse
+        self.mount_path = urlparse(self.server_url).path.rstrip('/')
+
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Make request, retrying on connection errors and retryable statuses
+
+        Waits `backoff_factor * 2**attempt` seconds between attempts, or as
+        long as the server asks in a `Retry-After` header.
+
+        Returns:
+            last response, whatever its status
+        """
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff_factor * 2**attempt
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if r.status_code not in RETRY_STATUSES or \
+                        attempt == self.max_retries:
+                    return r
+
+                retry_after = r.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+
+            time.sleep(delay)
+
+    def query(
+            self,
+            class_name: str,
+            query: Optional[dict] = None,
+            keys: Optional[List[str]] = None,
+            order: Optional[str] = None,
+            limit: Optional[int] = None) -> dict:
         """
         Right now this only supports basic queries
         https://docs.parseplatform.org/rest/guide/#queries
 
         Args:
             class_name: name of class to put in URL
-            query: dictionary of query. Not sure if this actually works
+            query: dictionary of query constraints, sent as `where`
+            keys: attributes to return; by default all
+            order: attribute to sort by; prefix with - for descending
+            limit: maximum number of objects to return. Parse returns 100 by
+                default.
         """
         url = f'{self.server_url}/classes/{class_name}'
-        data = None
+        params = {}
         if query is not None:
-            s = json.dumps(query, separators=(',', ':'))
-            data = f'where={s}'
-        r = requests.get(url, headers=self.headers, data=data)
+            params['where'] = json.dumps(query, separators=(',', ':'))
+        if keys is not None:
+            params['keys'] = ','.join(keys)
+        if order is not None:
+            params['order'] = order
+        if limit is not None:
+            params['limit'] = limit
+        r = self._request('GET', url, params=params)
         return r.json()
 
+    def query_all(
+            self,
+            class_name: str,
+            query: Optional[dict] = None,
+            keys: Optional[List[str]] = None,
+            page_size: int = 1000) -> List[dict]:
+        """Get all objects matching query, one page at a time
+
+        Pages by objectId rather than with `skip`, which Parse limits and which
+        gets slower the further into the class it goes.
+
+        Args:
+            class_name: name of class to query
+            query: dictionary of query constraints
+            keys: attributes to return in addition to objectId; by default all
+            page_size: number of objects to request at a time
+
+        Returns:
+            list of objects, sorted by objectId
+        """
+        query = dict(query or {})
+        if keys is not None:
+            keys = ['objectId', *keys]
+
+        results = []
+        while True:
+            if results:
+                query['objectId'] = {'$gt': results[-1]['objectId']}
+            page = self.query(
+                class_name, query, keys=keys, order='objectId',
+                limit=page_size)['results']
+            results.extend(page)
+            if len(page) < page_size:
+                return results
+
     def encode_geopoint(self, lon: float, lat: float) -> dict:
         return {'__type': 'GeoPoint', 'latitude': lat, 'longitude': lon}
 
@@ -98,72 +213,193 @@ class Parse(object):
             self,
             gdf: gpd.GeoDataFrame,
             class_name: str,
-            upload_altitude: bool = True):
+            upload_altitude: bool = True,
+            id_column: Optional[str] = None,
+            n_workers: int = 4) -> dict:
         """Upload GeoDataFrame to Parse
 
+        Objects are sent in batch requests of 50, with up to `n_workers`
+        batches in flight at once.
+
         Args:
             gdf: GeoDataFrame with data to upload
             class_name: name of class to upload data to in Parse
             upload_altitude: whether to upload altitude as an attribute for Point Z geometries. Uploaded as "alt".
+            id_column: column with a stable, unique id for each feature. If
+                provided, objects in Parse with the same value of this
+                attribute are updated instead of creating duplicates, so that
+                uploading the same data twice is harmless.
+            n_workers: number of batch requests to make concurrently
+
+        Returns:
+            dict with number of objects `created` and `updated`, and list of
+            `failed` objects, each a dict of the uploaded `object` and the
+            Parse `error`
         """
-        headers = self.headers.copy()
-        headers['Content-Type'] = 'application/json'
+        objects = self._gdf_to_objects(gdf, upload_altitude=upload_altitude)
+
+        existing = {}
+        if id_column is not None:
+            if not gdf[id_column].is_unique:
+                raise ValueError(f'Values of {id_column} are not unique')
+
+            existing = self._find_object_ids(
+                class_name, id_column, [x[id_column] for x in objects])
 
-        json_data = []
+        requests_ = []
+        for obj in objects:
+            object_id = None
+            if id_column is not None:
+                object_id = existing.get(obj[id_column])
+
+            if object_id is None:
+                requests_.append(
+                    self._batch_request('POST', class_name, body=obj))
+            else:
+                requests_.append(
+                    self._batch_request(
+                        'PUT', class_name, object_id=object_id, body=obj))
+
+        return self.batch(requests_, n_workers=n_workers)
+
+    def sync_gdf(
+            self,
+            gdf: gpd.GeoDataFrame,
+            class_name: str,
+            id_column: str,
+            upload_altitude: bool = True,
+            delete: bool = True,
+            hash_key: str = 'contentHash',
+            n_workers: int = 4) -> dict:
+        """Make Parse class match GeoDataFrame, sending only what changed
+
+        Each object is stored with a hash of its content in `hash_key`. The
+        ids and hashes of existing objects are fetched, and compared with the
+        GeoDataFrame to find the objects to create, update and delete. Objects
+        whose hash hasn't changed aren't sent at all.
+
+        Args:
+            gdf: GeoDataFrame with data to upload
+            class_name: name of class to sync in Parse
+            id_column: column with a stable, unique id for each feature
+            upload_altitude: whether to upload altitude as "alt" for Point Z
+                geometries
+            delete: whether to delete objects in Parse whose id is not in the
+                GeoDataFrame, as well as duplicates of the same id
+            hash_key: name of attribute to store content hash in
+            n_workers: number of batch requests to make concurrently
+
+        Returns:
+            dict with number of objects `created`, `updated`, `deleted` and
+            `unchanged`, and list of `failed` requests, as in `batch`
+        """
+        if not gdf[id_column].is_unique:
+            raise ValueError(f'Values of {id_column} are not unique')
+
+        objects = self._gdf_to_objects(gdf, upload_altitude=upload_altitude)
+        for obj in objects:
+            obj[hash_key] = content_hash(obj)
+
+        existing = {}
+        requests_ = []
+        for remote in self.query_all(class_name, keys=[id_column, hash_key]):
+            key = remote.get(id_column)
+            if key in existing:
+                # Duplicates of an id, e.g. from earlier plain uploads
+                if delete:
+                    requests_.append(
+                        self._batch_request(
+                            'DELETE', class_name,
+                            object_id=remote['objectId']))
+                continue
+            existing[key] = remote
+
+        unchanged = 0
+        for obj in objects:
+            remote = existing.pop(obj[id_column], None)
+            if remote is None:
+                requests_.append(
+                    self._batch_request('POST', class_name, body=obj))
+            elif remote.get(hash_key) != obj[hash_key]:
+                requests_.append(
+                    self._batch_request(
+                        'PUT', class_name, object_id=remote['objectId'],
+                        body=obj))
+            else:
+                unchanged += 1
+
+        if delete:
+            for remote in existing.values():
+                requests_.append(
+                    self._batch_request(
+                        'DELETE', class_name, object_id=remote['objectId']))
+
+        result = self.batch(requests_, n_workers=n_workers)
+        result['unchanged'] = unchanged
+        return result
+
+    def _gdf_to_objects(
+            self, gdf: gpd.GeoDataFrame, upload_altitude: bool) -> List[dict]:
+        """Convert rows of GeoDataFrame of points to Parse objects"""
         geom_name = gdf.geometry.name
-        columns = [x for x in gdf.columns if x != geom_name]
-        for row in gdf.itertuples():
-            d = {}
 
-            # Make sure that type of geometry is point
-            geom = getattr(row, geom_name)
-            assert isinstance(geom, Point), 'Geometry not of type Point'
+        # Make sure that type of geometry is point
+        assert (gdf.geom_type == 'Point').all(), 'Geometry not of type Point'
 
+        objects = gdf.drop(columns=geom_name).to_dict('records')
+        for obj, geom in zip(objects, gdf.geometry):
             # is it a 2D or 3D point?
-            coords = list(geom.coords)[0]
-            lon = coords[0]
-            lat = coords[1]
-            alt = coords[2] if len(coords) == 3 else None
+            coords = geom.coords[0]
+            obj[geom_name] = self.encode_geopoint(
+                lon=coords[0], lat=coords[1])
+            if len(coords) == 3 and upload_altitude:
+                obj['alt'] = coords[2]
 
-            d[geom_name] = self.encode_geopoint(lon=lon, lat=lat)
-            if (alt is not None) and upload_altitude:
-                d['alt'] = alt
+        return objects
 
-            for column in columns:
-                d[column] = getattr(row, column)
+    def _find_object_ids(self, class_name: str, key: str,
+                         values: list) -> dict:
+        """Find objectIds of existing objects by the value of an attribute
 
-            json_data.append(d)
+        Returns:
+            dict of attribute value: objectId
+        """
+        url = f'{self.server_url}/classes/{class_name}'
+        object_ids = {}
+        for group in chunker(values, 500):
+            where = json.dumps({key: {'$in': group}}, separators=(',', ':'))
+            params = {'where': where, 'keys': key, 'limit': 1000}
+            r = self._request('GET', url, params=params)
+            r.raise_for_status()
+            for result in r.json()['results']:
+                object_ids[result[key]] = result['objectId']
+
+        return object_ids
+
+    def _batch_request(
+            self,
+            method: str,
+            class_name: str,
+            object_id: Optional[str] = None,
+            body: Optional[dict] = None) -> dict:
+        """Create one request for a Parse batch request"""
+        path = f'{self.mount_path}/classes/{class_name}'
+        if object_id is not None:
+            path += f'/{object_id}'
+
+        request = {'method': method, 'path': path}
+        if body is not None:
+            request['body'] = body
 
-        for group in chunker(json_data, 50):
-            self.upload_batch(data=group, class_name=class_name)
+        return request
 
     def upload_batch(self, data: List[dict], class_name: str) -> List[dict]:
         """Upload batch of objects to Parse
 
-        Can upload up to 50 items at a time.
+        Objects are sent in batch requests of up to 50 objects each.
 
         Args:
-            data: list of individual requests to make, i.e.:
-                ```json
-                "requests": [
-                  {
-                    "method": "POST",
-                    "path": "/parse/classes/GameScore",
-                    "body": {
-                      "score": 1337,
-                      "playerName": "Sean Plott"
-                    }
-                  },
-                  {
-                    "method": "POST",
-                    "path": "/parse/classes/GameScore",
-                    "body": {
-                      "score": 1338,
-                      "playerName": "ZeroCool"
-                    }
-                  }
-                ]
-                ```
+            data: list of objects to create
             class_name: name of Parse class to upload to
 
         Returns:
@@ -172,20 +408,64 @@ class Parse(object):
                 "createdAt": "2012-06-15T16:59:11.276Z",
                 "objectId": "YAfSAWwXbL"
               }
-            ]]
+            ]], or a dict with an `error` key for each object that failed
         """
-        headers = self.headers.copy()
-        headers['Content-Type'] = 'application/json'
-
-        body = [{
-            'method': 'POST',
-            'path': f'/parse/classes/{class_name}',
-            'body': x
-        } for x in data]
-        body = {'requests': body}
-
-        url = f'{self.server_url}/batch'
-        r = requests.post(url, data=json.dumps(body), headers=headers)
+        requests_ = [
+            self._batch_request('POST', class_name, body=x) for x in data]
+        responses = []
+        for group in chunker(requests_, BATCH_SIZE):
+            responses.extend(self._try_batch(group))
+
+        return responses
+
+    def batch(self, requests_: List[dict], n_workers: int = 4) -> dict:
+        """Make any number of batch requests concurrently
+
+        Args:
+            requests_: individual requests, split into Parse batch requests of
+                up to 50 requests each. Each is a dict with `method` (POST,
+                PUT or DELETE), `path` including the mount path, e.g.
+                `/parse/classes/GameScore/Ed1nuqPvcm`, and for POST and PUT,
+                the object `body`; see `_batch_request`.
+            n_workers: number of batch requests to make concurrently
+
+        Returns:
+            dict with number of objects `created`, `updated` and `deleted`,
+            and list of `failed` requests, each a dict of the uploaded `object`
+            (None for deletes), and the Parse `error`
+        """
+        groups = list(chunker(requests_, BATCH_SIZE))
+        result = {'created': 0, 'updated': 0, 'deleted': 0, 'failed': []}
+        counts = {'POST': 'created', 'PUT': 'updated', 'DELETE': 'deleted'}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for group, responses in zip(groups,
+                                        executor.map(self._try_batch, groups)):
+                for request, response in zip(group, responses):
+                    if 'success' in response:
+                        result[counts[request['method']]] += 1
+                    else:
+                        result['failed'].append({
+                            'object': request.get('body'),
+                            'error': response.get('error')})
+
+        return result
+
+    def _try_batch(self, requests_: List[dict]) -> List[dict]:
+        """Make batch request, turning a failed request into per-object errors
+        """
+        try:
+            r = self._request(
+                'POST',
+                f'{self.server_url}/batch',
+                data=json.dumps({'requests': requests_}),
+                headers={'Content-Type': 'application/json'})
+        except requests.RequestException as e:
+            return [{'error': {'error': str(e)}}] * len(requests_)
+
+        if not r.ok:
+            error = {'code': r.status_code, 'error': r.text}
+            return [{'error': error}] * len(requests_)
+
         return r.json()
 
     def upload_object(self, data: dict, class_name: str) -> dict:
@@ -201,10 +481,12 @@ class Parse(object):
                 "objectId": "Ed1nuqPvcm"
             ]
         """
-        headers = self.headers.copy()
-        headers['Content-Type'] = 'application/json'
         url = f'{self.server_url}/classes/{class_name}'
-        r = requests.post(url, data=json.dumps(data), headers=headers)
+        r = self._request(
+            'POST',
+            url,
+            data=json.dumps(data),
+            headers={'Content-Type': 'application/json'})
         return r.json()
 
     def upload_file(
@@ -224,10 +506,9 @@ class Parse(object):
                 'name': name of uploaded file on Parse
             ]
         """
-        headers = self.headers.copy()
-        headers['Content-Type'] = content_type
         url = f'{self.server_url}/files/{fname}'
-        r = requests.post(url, data=data, headers=headers)
+        r = self._request(
+            'POST', url, data=data, headers={'Content-Type': content_type})
         return r.json()
 
 
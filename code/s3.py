@@ -1,65 +1,326 @@
+import hashlib
 import json
+import logging
+import mimetypes
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from subprocess import run
 from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from vector_tiles import geojson_to_vector_tiles
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+Log = logging.getLogger()
+
+# Files at least this large are uploaded in parts
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE)
+
+# Content types by file extension, for types that mimetypes doesn't know
+CONTENT_TYPES = {
+    '.pbf': 'application/x-protobuf',
+    '.mvt': 'application/vnd.mapbox-vector-tile',
+    '.geojson': 'application/geo+json',
+    '.json': 'application/json',
+    '.mbtiles': 'application/vnd.sqlite3',
+    '.pmtiles': 'application/octet-stream',
+}
 
 
 def upload_geojson_to_s3(
-        geojson_data: str, bucket_path: str,
-        bucket_name: str = 'tiles.nst.guide'):
+        geojson_data: str,
+        bucket_path: str,
+        bucket_name: str = 'tiles.nst.guide',
+        engine: str = 'tippecanoe',
+        layer_name: str = None,
+        min_zoom: int = 0,
+        max_zoom: int = 10,
+        client=None):
     """
     This takes a geojson, cuts it into tiles, then uploads to s3
 
-    TODO: check when to upload with content-encoding: gzip
-
     Args:
         - geojson_data: geojson as string
         - bucket_path: folder structure after bucket_name
         - bucket_name: name of s3 bucket
+        - engine: either "tippecanoe", which writes the GeoJSON to a temporary
+          directory and runs Tippecanoe, or "python", which generates tiles in
+          memory with `vector_tiles.geojson_to_vector_tiles` and streams them
+          to S3. The latter is faster for small to medium layers.
+        - layer_name: name of vector tile layer for the python engine. Defaults
+          to the last part of bucket_path.
+        - min_zoom: min zoom for the python engine
+        - max_zoom: max zoom for the python engine
+        - client: boto3 S3 client
     """
+    if engine == 'python':
+        if layer_name is None:
+            layer_name = bucket_path.strip('/').split('/')[-1]
+
+        tiles = geojson_to_vector_tiles(
+            geojson_data,
+            layer_name=layer_name,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom)
+        upload_tiles_to_s3(
+            tiles,
+            bucket_name=bucket_name,
+            bucket_path=bucket_path,
+            client=client)
+        return
+
+    if engine != 'tippecanoe':
+        raise ValueError('engine must be "tippecanoe" or "python"')
+
     with TemporaryDirectory() as tmp:
         tiles_path = geojson_to_tiles(geojson_data, tmp)
         upload_directory_to_s3(
             local_path=tiles_path,
             bucket_name=bucket_name,
             bucket_path=bucket_path,
-            content_type='x-protobuf',
-            content_encoding='gzip')
+            client=client)
+
+
+def upload_tiles_to_s3(
+        tiles,
+        bucket_path,
+        bucket_name='tiles.nst.guide',
+        content_type='application/x-protobuf',
+        content_encoding='gzip',
+        ext='pbf',
+        skip_unchanged=True,
+        n_workers=16,
+        client=None):
+    """Upload tiles from memory to {bucket_path}/{z}/{x}/{y}.{ext}
+
+    Args:
+        - tiles: iterable of (z, x, y, bytes)
+        - bucket_path: folder structure after bucket_name
+        - bucket_name: name of s3 bucket
+        - content_type: content type of tiles
+        - content_encoding: content encoding of tiles
+        - ext: extension of tile keys
+        - skip_unchanged: if True, skip tiles that already exist with the same
+          content
+        - n_workers: number of upload threads
+        - client: boto3 S3 client
+
+    Returns:
+        list of uploaded keys
+    """
+    if client is None:
+        client = s3_client(n_workers=n_workers)
+
+    bucket_path = bucket_path.strip('/')
+    bucket_name = bucket_name.strip('/')
+
+    existing = {}
+    if skip_unchanged:
+        existing = _list_etags(client, bucket_name, prefix=bucket_path)
+
+    def upload(tile):
+        z, x, y, data = tile
+        key = f'{bucket_path}/{z}/{x}/{y}.{ext}'.lstrip('/')
+        if existing.get(key) == hashlib.md5(data).hexdigest():
+            return None
+
+        client.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            ContentEncoding=content_encoding)
+        return key
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        uploaded = list(executor.map(upload, tiles))
+
+    return [key for key in uploaded if key is not None]
 
 
 def upload_directory_to_s3(
         local_path,
         bucket_path,
-        content_type,
+        content_type=None,
         bucket_name='tiles.nst.guide',
-        content_encoding=None):
-    """This uses AWS CLI and must be preconfigured
+        content_encoding=None,
+        acl=None,
+        cache_control=None,
+        skip_unchanged=True,
+        n_workers=16,
+        client=None,
+        verbose=False):
+    """Upload directory to S3
+
+    Files are uploaded over a thread pool that shares a single client.
+    Existing objects whose ETag matches the local file's MD5 are skipped, so
+    re-publishing a directory only uploads the files that changed. Files
+    larger than `MULTIPART_THRESHOLD` are uploaded in parts.
 
     Args:
         - local_path: path to directory on local computer
         - bucket_path: folder structure after bucket_name
+        - content_type: content type for all uploaded data. If None, set per
+          file from its extension.
         - bucket_name: name of s3 bucket
-        - content_type: content type for uploaded data
-        - content_encoding: content encoding for uploaded data
+        - content_encoding: content encoding for all uploaded data. If None,
+          gzip is set for gzipped files.
+        - acl: canned ACL for uploaded objects
+        - cache_control: Cache-Control header for uploaded objects
+        - skip_unchanged: if True, skip files that already exist with the same
+          content
+        - n_workers: number of upload threads
+        - client: boto3 S3 client. If None, one is created using the default
+          AWS credentials.
+
+    Returns:
+        list of uploaded keys
     """
+    if client is None:
+        client = s3_client(n_workers=n_workers)
+
+    local_path = Path(local_path)
     bucket_path = bucket_path.strip('/')
     bucket_name = bucket_name.strip('/')
-    s3_url = f's3://{bucket_name}/{bucket_path}/'
 
-    cmd = [
-        'aws',
-        's3',
-        'cp',
-        str(local_path),
-        s3_url,
-        '--recursive',
-        '--content-type',
-        content_type,
+    paths = sorted(p for p in local_path.rglob('*') if p.is_file())
+    keys = [
+        f'{bucket_path}/{p.relative_to(local_path).as_posix()}'.lstrip('/')
+        for p in paths
     ]
+
+    existing = {}
+    if skip_unchanged:
+        existing = _list_etags(client, bucket_name, prefix=bucket_path)
+
+    def upload(path, key):
+        # Don't need the file contents if the object doesn't exist
+        if key in existing and existing[key] == s3_etag(path):
+            return None
+
+        extra_args = _extra_args(
+            path,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            acl=acl,
+            cache_control=cache_control)
+        client.upload_file(
+            str(path),
+            bucket_name,
+            key,
+            ExtraArgs=extra_args,
+            Config=_TRANSFER_CONFIG)
+        return key
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        uploaded = list(executor.map(upload, paths, keys))
+
+    uploaded_keys = [key for key in uploaded if key is not None]
+    if verbose:
+        elapsed = max(perf_counter() - start, 1e-9)
+        n_bytes = sum(
+            p.stat().st_size
+            for p, key in zip(paths, uploaded)
+            if key is not None)
+        Log.info(
+            f'Uploaded {len(uploaded_keys)} of {len(paths)} files '
+            f'({len(paths) - len(uploaded_keys)} unchanged skipped), '
+            f'{n_bytes / 1e6:.1f} MB in {elapsed:.1f}s '
+            f'({n_bytes / 1e6 / elapsed:.1f} MB/s)')
+
+    return uploaded_keys
+
+
+def s3_client(n_workers=16, endpoint_url=None):
+    """Create S3 client with a connection pool large enough for n_workers
+
+    Args:
+        - n_workers: number of threads that will share the client
+        - endpoint_url: URL of an S3-compatible service. If None, uses AWS.
+    """
+    config = Config(max_pool_connections=max(n_workers, 10))
+    return boto3.client('s3', endpoint_url=endpoint_url, config=config)
+
+
+def s3_etag(path, chunk_size=None):
+    """Compute the ETag S3 assigns to a file uploaded with `_TRANSFER_CONFIG`
+
+    Single-part uploads have the file's MD5 as ETag. Multipart uploads have
+    the MD5 of the concatenated MD5s of each part, followed by the number of
+    parts.
+
+    Args:
+        - path: path to local file
+        - chunk_size: multipart chunk size. Defaults to `MULTIPART_CHUNKSIZE`.
+    """
+    chunk_size = chunk_size or MULTIPART_CHUNKSIZE
+    size = Path(path).stat().st_size
+
+    with open(path, 'rb') as f:
+        if size < MULTIPART_THRESHOLD:
+            return hashlib.md5(f.read()).hexdigest()
+
+        digests = []
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digests.append(hashlib.md5(chunk).digest())
+
+    return hashlib.md5(b''.join(digests)).hexdigest() + f'-{len(digests)}'
+
+
+def _list_etags(client, bucket_name, prefix):
+    """Get ETags of existing objects
+
+    Returns:
+        dict from key to ETag, without surrounding quotes
+    """
+    etags = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            etags[obj['Key']] = obj['ETag'].strip('"')
+
+    return etags
+
+
+def _extra_args(
+        path, content_type=None, content_encoding=None, acl=None,
+        cache_control=None):
+    """Get upload arguments for a single file
+
+    Content type is taken from the file extension, and content encoding is set
+    to gzip when the file is gzipped, unless either is provided.
+    """
+    if content_type is None:
+        content_type = CONTENT_TYPES.get(path.suffix)
+    if content_type is None:
+        content_type = mimetypes.guess_type(path.name)[0]
+
+    if content_encoding is None:
+        with open(path, 'rb') as f:
+            if f.read(2) == b'\x1f\x8b':
+                content_encoding = 'gzip'
+
+    extra_args = {}
+    if content_type is not None:
+        extra_args['ContentType'] = content_type
     if content_encoding is not None:
-        cmd.extend(['--content-encoding', content_encoding])
+        extra_args['ContentEncoding'] = content_encoding
+    if acl is not None:
+        extra_args['ACL'] = acl
+    if cache_control is not None:
+        extra_args['CacheControl'] = cache_control
 
-    run(cmd, capture_output=True, check=True, encoding='utf-8')
+    return extra_args
 
 
 def geojson_to_tiles(geojson_data: str, folder: str):
@@ -0,0 +1,434 @@
+"""
+## tile_archive.py
+
+Write map tiles into single-file MBTiles or PMTiles archives
+"""
+
+import gzip
+import hashlib
+import json
+import shutil
+import sqlite3
+import struct
+from pathlib import Path
+from tempfile import TemporaryFile
+
+from tiles import tile_bounds, xyz_to_tms
+
+ARCHIVE_FORMATS = ('mbtiles', 'pmtiles')
+
+# PMTiles v3 header field values
+# https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+_PMTILES_HEADER_LENGTH = 127
+_PMTILES_ROOT_MAX_LENGTH = 16384 - _PMTILES_HEADER_LENGTH
+_PMTILES_COMPRESSION = {'none': 1, 'gzip': 2}
+_PMTILES_TILE_TYPE = {
+    'pbf': 1,
+    'mvt': 1,
+    'png': 2,
+    'jpg': 3,
+    'jpeg': 3,
+    'webp': 4,
+}
+
+
+def open_archive(path, archive_format, tile_format, metadata=None):
+    """Open tile archive writer
+
+    Args:
+        - path: path of archive to create
+        - archive_format: one of `ARCHIVE_FORMATS`
+        - tile_format: extension of tiles, i.e. `pbf` or `png`
+        - metadata: dict of tile JSON to store in the archive
+    """
+    if archive_format == 'mbtiles':
+        return MBTilesWriter(path, tile_format=tile_format, metadata=metadata)
+    if archive_format == 'pmtiles':
+        return PMTilesWriter(path, tile_format=tile_format, metadata=metadata)
+
+    raise ValueError(f'archive_format must be one of {ARCHIVE_FORMATS}')
+
+
+def write_tiles_to_archive(
+        tiles, path, archive_format, tile_format='pbf', metadata=None):
+    """Write tiles from memory into a single archive
+
+    Args:
+        - tiles: iterable of (z, x, y, bytes), i.e. from
+          `vector_tiles.geojson_to_vector_tiles`
+        - path: path of archive to create
+        - archive_format: one of `ARCHIVE_FORMATS`
+        - tile_format: extension of tiles
+        - metadata: dict of tile JSON to store in the archive
+    """
+    with open_archive(path, archive_format, tile_format=tile_format,
+                      metadata=metadata) as archive:
+        for z, x, y, data in tiles:
+            archive.add_tile(z, x, y, data)
+
+
+class TileArchiveWriter:
+    """Base class for single-file tile archive writers
+
+    Tiles are added one at a time in XYZ coordinates with `add_tile`. Identical
+    tile blobs are only stored once. The archive is complete once `close` has
+    been called; writers can also be used as context managers.
+    """
+    def __init__(self, path, tile_format, metadata=None):
+        self.path = Path(path)
+        self.tile_format = tile_format.lstrip('.')
+        self.metadata = dict(metadata or {})
+
+        self.minzoom = None
+        self.maxzoom = None
+        self.bounds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_tile(self, z, x, y, data):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def _update_extent(self, z, x, y):
+        """Keep track of zoom range and bounds of added tiles"""
+        self.minzoom = z if self.minzoom is None else min(self.minzoom, z)
+        self.maxzoom = z if self.maxzoom is None else max(self.maxzoom, z)
+
+        bounds = tile_bounds(x, y, z)
+        if self.bounds is None:
+            self.bounds = bounds
+        else:
+            self.bounds = [
+                min(self.bounds[0], bounds[0]),
+                min(self.bounds[1], bounds[1]),
+                max(self.bounds[2], bounds[2]),
+                max(self.bounds[3], bounds[3])]
+
+    def _tile_json(self):
+        """Tile JSON metadata, filling in fields missing from self.metadata
+        from the added tiles
+        """
+        tj = dict(self.metadata)
+        if self.minzoom is None:
+            return tj
+
+        tj.setdefault('minzoom', self.minzoom)
+        tj.setdefault('maxzoom', self.maxzoom)
+        tj.setdefault('bounds', self.bounds)
+        if 'center' not in tj:
+            minx, miny, maxx, maxy = tj['bounds']
+            tj['center'] = [(minx + maxx) / 2, (miny + maxy) / 2, tj['maxzoom']]
+
+        return tj
+
+
+class MBTilesWriter(TileArchiveWriter):
+    """Write tiles to an MBTiles SQLite database
+
+    Uses the deduplicated `map`/`images` layout with a `tiles` view, as in
+    https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md. Inserts are
+    batched into transactions of `batch_size` tiles.
+    """
+    def __init__(self, path, tile_format, metadata=None, batch_size=1000):
+        super(MBTilesWriter, self).__init__(
+            path, tile_format=tile_format, metadata=metadata)
+        self.batch_size = batch_size
+
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute('PRAGMA journal_mode = MEMORY')
+        self._conn.executescript(
+            """
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE UNIQUE INDEX metadata_name ON metadata (name);
+            CREATE TABLE map (
+                zoom_level INTEGER,
+                tile_column INTEGER,
+                tile_row INTEGER,
+                tile_id TEXT);
+            CREATE UNIQUE INDEX map_index
+                ON map (zoom_level, tile_column, tile_row);
+            CREATE TABLE images (tile_data BLOB, tile_id TEXT);
+            CREATE UNIQUE INDEX images_id ON images (tile_id);
+            CREATE VIEW tiles AS
+                SELECT
+                    map.zoom_level AS zoom_level,
+                    map.tile_column AS tile_column,
+                    map.tile_row AS tile_row,
+                    images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+            """)
+
+        self._seen_hashes = set()
+        self._map_rows = []
+        self._image_rows = []
+
+    def add_tile(self, z, x, y, data):
+        self._update_extent(z, x, y)
+
+        tile_id = hashlib.md5(data).hexdigest()
+        if tile_id not in self._seen_hashes:
+            self._seen_hashes.add(tile_id)
+            self._image_rows.append((sqlite3.Binary(data), tile_id))
+
+        # MBTiles uses TMS coordinates
+        x, y, z = xyz_to_tms(x, y, z)
+        self._map_rows.append((z, x, y, tile_id))
+
+        if len(self._map_rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO images (tile_data, tile_id) VALUES (?, ?)',
+                self._image_rows)
+            self._conn.executemany(
+                'INSERT INTO map (zoom_level, tile_column, tile_row, tile_id) '
+                'VALUES (?, ?, ?, ?)', self._map_rows)
+
+        self._image_rows = []
+        self._map_rows = []
+
+    def close(self):
+        self._flush()
+
+        tj = self._tile_json()
+        metadata = {'format': self.tile_format}
+        for key in ['name', 'description', 'attribution', 'version']:
+            if tj.get(key) is not None:
+                metadata[key] = tj[key]
+        for key in ['minzoom', 'maxzoom']:
+            if tj.get(key) is not None:
+                metadata[key] = str(int(tj[key]))
+        for key in ['bounds', 'center']:
+            if tj.get(key) is not None:
+                metadata[key] = ','.join(map(str, tj[key]))
+
+        # Vector tilesets describe their layers in a `json` row
+        if tj.get('vector_layers') is not None:
+            metadata['json'] = json.dumps(
+                {'vector_layers': tj['vector_layers']})
+
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO metadata (name, value) VALUES (?, ?)',
+                metadata.items())
+
+        self._conn.close()
+
+
+class PMTilesWriter(TileArchiveWriter):
+    """Write tiles to a PMTiles v3 archive
+
+    Spec: https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+
+    Tile data is streamed into a temporary file as tiles are added; the header
+    and directories are written on `close`, once all tile IDs are known. Runs of
+    consecutive tile IDs with identical content share a single directory entry.
+    """
+    def __init__(self, path, tile_format, metadata=None):
+        super(PMTilesWriter, self).__init__(
+            path, tile_format=tile_format, metadata=metadata)
+
+        self._data = TemporaryFile()
+        self._data_length = 0
+        self._tile_compression = None
+
+        # Map from content hash to (offset, length) in self._data
+        self._offsets = {}
+
+        # List of (tile_id, offset, length)
+        self._entries = []
+
+    def add_tile(self, z, x, y, data):
+        self._update_extent(z, x, y)
+
+        if self._tile_compression is None:
+            is_gzip = data[:2] == b'\x1f\x8b'
+            self._tile_compression = 'gzip' if is_gzip else 'none'
+
+        digest = hashlib.md5(data).digest()
+        location = self._offsets.get(digest)
+        if location is None:
+            location = (self._data_length, len(data))
+            self._data.write(data)
+            self._data_length += len(data)
+            self._offsets[digest] = location
+
+        self._entries.append((zxy_to_tileid(z, x, y), *location))
+
+    def close(self):
+        entries = _run_length_entries(sorted(self._entries))
+        root, leaves = _build_directories(entries)
+
+        tj = self._tile_json()
+        metadata = gzip.compress(json.dumps(tj).encode('utf-8'), mtime=0)
+
+        root_offset = _PMTILES_HEADER_LENGTH
+        metadata_offset = root_offset + len(root)
+        leaves_offset = metadata_offset + len(metadata)
+        data_offset = leaves_offset + len(leaves)
+
+        bounds = tj.get('bounds') or [0, 0, 0, 0]
+        center = tj.get('center') or [0, 0, 0]
+        header = struct.pack(
+            '<7sBQQQQQQQQQQQBBBBBBiiiiBii',
+            b'PMTiles',
+            3,
+            root_offset,
+            len(root),
+            metadata_offset,
+            len(metadata),
+            leaves_offset,
+            len(leaves),
+            data_offset,
+            self._data_length,
+            len(self._entries),
+            len(entries),
+            len(self._offsets),
+            0,
+            _PMTILES_COMPRESSION['gzip'],
+            _PMTILES_COMPRESSION[self._tile_compression or 'none'],
+            _PMTILES_TILE_TYPE.get(self.tile_format, 0),
+            int(tj.get('minzoom', 0)),
+            int(tj.get('maxzoom', 0)),
+            _e7(bounds[0]),
+            _e7(bounds[1]),
+            _e7(bounds[2]),
+            _e7(bounds[3]),
+            int(center[2]),
+            _e7(center[0]),
+            _e7(center[1]),
+        )
+
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            f.write(root)
+            f.write(metadata)
+            f.write(leaves)
+            self._data.seek(0)
+            shutil.copyfileobj(self._data, f)
+
+        self._data.close()
+
+
+def zxy_to_tileid(z, x, y):
+    """Convert XYZ tile coordinate to PMTiles tile ID
+
+    Tile IDs are ordered by zoom, then by position on a Hilbert curve within
+    each zoom.
+    """
+    # Number of tiles in all lower zooms
+    acc = ((1 << (z * 2)) - 1) // 3
+
+    n = 1 << z
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if (x & s) > 0 else 0
+        ry = 1 if (y & s) > 0 else 0
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotate quadrant
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+
+        s //= 2
+
+    return acc + d
+
+
+def _run_length_entries(entries):
+    """Merge sorted (tile_id, offset, length) entries into
+    (tile_id, offset, length, run_length) entries
+    """
+    merged = []
+    for tile_id, offset, length in entries:
+        if merged:
+            last = merged[-1]
+            if last[1] == offset and last[0] + last[3] == tile_id:
+                last[3] += 1
+                continue
+
+        merged.append([tile_id, offset, length, 1])
+
+    return merged
+
+
+def _build_directories(entries, leaf_size=4096):
+    """Build root and leaf directories
+
+    The header and root directory must fit within the first 16 KiB of the
+    archive, so larger tilesets are split into leaf directories.
+
+    Returns:
+        (root directory bytes, leaf directories bytes)
+    """
+    root = _serialize_directory(entries)
+    if len(root) <= _PMTILES_ROOT_MAX_LENGTH:
+        return root, b''
+
+    while True:
+        root_entries = []
+        leaves = bytearray()
+        for i in range(0, len(entries), leaf_size):
+            chunk = entries[i:i + leaf_size]
+            leaf = _serialize_directory(chunk)
+            root_entries.append([chunk[0][0], len(leaves), len(leaf), 0])
+            leaves += leaf
+
+        root = _serialize_directory(root_entries)
+        if len(root) <= _PMTILES_ROOT_MAX_LENGTH:
+            return root, bytes(leaves)
+
+        leaf_size = int(leaf_size * 1.2)
+
+
+def _serialize_directory(entries):
+    """Serialize (tile_id, offset, length, run_length) entries to a gzipped
+    PMTiles directory
+    """
+    buf = bytearray()
+    _write_varint(buf, len(entries))
+
+    last_id = 0
+    for entry in entries:
+        _write_varint(buf, entry[0] - last_id)
+        last_id = entry[0]
+
+    for entry in entries:
+        _write_varint(buf, entry[3])
+
+    for entry in entries:
+        _write_varint(buf, entry[2])
+
+    for i, entry in enumerate(entries):
+        # An offset of 0 means the data directly follows the previous entry's
+        if i > 0 and entry[1] == entries[i - 1][1] + entries[i - 1][2]:
+            _write_varint(buf, 0)
+        else:
+            _write_varint(buf, entry[1] + 1)
+
+    return gzip.compress(bytes(buf), mtime=0)
+
+
+def _write_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _e7(value):
+    return int(round(value * 1e7))
+
@@ -1,8 +1,10 @@
 import json
+import math
 import re
 from subprocess import run
 from typing import List, Tuple
 
+import numpy as np
 from shapely.geometry import Polygon, mapping
 
 from geom import to_2d
@@ -42,6 +44,143 @@ def tiles_for_polygon(polygon: Polygon, zoom_levels,
     return tile_tuples
 
 
+def tile_keys_for_polygon(polygon: Polygon, zoom_levels) -> np.ndarray:
+    """Generate sorted, packed tile keys for polygon
+
+    Args:
+        - polygon: polygon to generate tiles for
+        - zoom_levels: iterable with integers for zoom levels
+
+    Returns:
+        sorted array of unique uint64 keys. See `pack_tiles`.
+    """
+    if polygon.is_empty:
+        return np.array([], dtype=np.uint64)
+
+    tile_tuples = tiles_for_polygon(polygon, zoom_levels=zoom_levels)
+    x, y, z = np.array(tile_tuples, dtype=np.uint64).T
+    return np.unique(pack_tiles(x, y, z))
+
+
+# Bits used for each of x and y in a packed tile key. This supports zoom levels
+# up to 29, with the zoom in the top bits, so that sorting keys sorts tiles by
+# z, then x, then y.
+_XY_BITS = np.uint64(29)
+_XY_MASK = np.uint64((1 << 29) - 1)
+
+
+def pack_tiles(x, y, z) -> np.ndarray:
+    """Pack arrays of x, y, z tile coordinates into uint64 keys
+
+    Args:
+        - x, y, z: array-likes of tile coordinates of the same length
+
+    Returns:
+        array of uint64 keys. Sorted keys are ordered by z, then x, then y.
+    """
+    x = np.asarray(x, dtype=np.uint64)
+    y = np.asarray(y, dtype=np.uint64)
+    z = np.asarray(z, dtype=np.uint64)
+    return (z << (_XY_BITS * np.uint64(2))) | (x << _XY_BITS) | y
+
+
+def unpack_tiles(keys) -> Tuple[np.ndarray]:
+    """Unpack uint64 tile keys into arrays of x, y, z tile coordinates
+
+    Args:
+        - keys: array-like of keys created with `pack_tiles`
+
+    Returns:
+        tuple of (x, y, z) uint64 arrays
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    z = keys >> (_XY_BITS * np.uint64(2))
+    x = (keys >> _XY_BITS) & _XY_MASK
+    y = keys & _XY_MASK
+    return x, y, z
+
+
+def tile_bounds(x, y, z) -> List[float]:
+    """Get WGS84 bounds of XYZ tile
+
+    Returns:
+        [minx, miny, maxx, maxy]
+    """
+    n = 2 ** z
+    minx = x / n * 360 - 180
+    maxx = (x + 1) / n * 360 - 180
+    maxy = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    miny = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return [minx, miny, maxx, maxy]
+
+
+def tile_json_for_keys(keys, tile_json=None) -> dict:
+    """Generate tile JSON for a set of packed tile keys
+
+    The zoom range, bounds, and center are computed from the tile keys. Bounds
+    are taken from the tiles at the highest zoom, which are the most precise.
+    Other fields, like name or vector_layers, are kept from `tile_json`.
+
+    Args:
+        - keys: array of uint64 keys created with `pack_tiles`
+        - tile_json: dict of existing tile JSON to update
+
+    Returns:
+        dict of tile JSON
+    """
+    tj = {'tilejson': '2.2.0', 'scheme': 'xyz'}
+    tj.update(tile_json or {})
+
+    x, y, z = unpack_tiles(keys)
+    if len(z) == 0:
+        return tj
+
+    minzoom = int(z.min())
+    maxzoom = int(z.max())
+    mask = z == maxzoom
+    minx, _, _, maxy = tile_bounds(
+        int(x[mask].min()), int(y[mask].min()), maxzoom)
+    _, miny, maxx, _ = tile_bounds(
+        int(x[mask].max()), int(y[mask].max()), maxzoom)
+
+    tj['minzoom'] = minzoom
+    tj['maxzoom'] = maxzoom
+    tj['bounds'] = [minx, miny, maxx, maxy]
+    tj['center'] = [(minx + maxx) / 2, (miny + maxy) / 2, maxzoom]
+    return tj
+
+
+def tile_json_from_tippecanoe(meta: dict) -> dict:
+    """Convert metadata.json from Tippecanoe to tile JSON
+
+    Args:
+        - meta: dict of Tippecanoe metadata.json
+
+    Returns:
+        dict of tile JSON
+    """
+    tj = {
+        'tilejson': '2.2.0',
+        'scheme': 'xyz',
+        'minzoom': int(meta['minzoom']),
+        'maxzoom': int(meta['maxzoom']),
+        'bounds': list(map(float, meta['bounds'].split(','))),
+        'center': list(map(float, meta['center'].split(','))),
+    }
+
+    for key in ['name', 'description', 'attribution', 'version']:
+        if meta.get(key) is not None:
+            tj[key] = meta[key]
+
+    # Tippecanoe stores vector layers as a JSON string
+    if meta.get('json') is not None:
+        vector_layers = json.loads(meta['json']).get('vector_layers')
+        if vector_layers is not None:
+            tj['vector_layers'] = vector_layers
+
+    return tj
+
+
 def geojson_from_tiles(tile_tuples: List[Tuple[int]], scheme='xyz') -> str:
     """Generate GeoJSON for list of map tile tuples
 
@@ -15,6 +15,7 @@ import constants
 import data_source
 import geom
 import osmnx as ox
+from aqi_series import trail_grid
 from constants import VALID_TRAIL_CODES, VALID_TRAIL_SECTIONS
 from constants.pct import TRAIL_HM_XW
 from data_source import (
@@ -401,42 +402,48 @@ class Trail:
         gdf = gpd.GeoDataFrame(data, crs={'init': 'epsg:4326'})
         return gdf
 
-    def wildfire_historical(self, start_year):
+    def air_quality_grid(self, cell_size=0.05, buffer_cells=1):
+        """Grid of cells along trail for air quality time series
+
+        Args:
+            - cell_size: size of cells in degrees
+            - buffer_cells: number of cells to include on each side of the trail
+
+        Returns:
+            dict with `cell_size` and `cells`, a list of [column, row] of cells
+            in order along the trail; see `aqi_series.py`
+        """
+        trail_no_alt = self.hm.trail_full(alternates=False)
+        merged = to_2d(linemerge([*trail_no_alt.geometry]))
+        cells = trail_grid(
+            merged, cell_size=cell_size, buffer_cells=buffer_cells)
+        return {'cell_size': cell_size, 'cells': cells.tolist()}
+
+    def wildfire_historical(self, start_year=2010):
         # Get trail track as a single geometric line
         trail_alt = self.hm.trail_full(alternates=True)
         trail_no_alt = self.hm.trail_full(alternates=False)
         merged = linemerge([*trail_no_alt.geometry])
-        projected = reproject(merged, geom.WGS84, self.crs)
 
-        # Get historical wildfire boundaries
+        # Get historical wildfire boundaries from NIFC and CalFire
         # I use trail_alt for the geometry to keep wildfires that intersect
         # alternates
-        bounds = data_source.NIFC().perimeters(
+        fire_history = data_source.FireHistory()
+        bounds = fire_history.perimeters(
             geometry=trail_alt, start_year=start_year)
-        # Reproject to projected coordinate system
-        bounds = bounds.to_crs(epsg=self.crs)
 
-        # Find portions of the trail that intersect with these boundaries
-        intersection_dict = intersect_trail_with_polygons(
-            projected, bounds, 'firecode')
-
-        # Merge this back onto bounds
-        # Here I discard the linestring intersection of where the trail is
-        # inside the polygons
-        intersection_df = pd.DataFrame(
-            gpd.GeoDataFrame.from_dict(intersection_dict,
-                                       orient='index')['length'])
+        # Length and mile range of the trail inside each fire. These are cached
+        # in the fire history store, so they're only computed once.
+        intersections = fire_history.trail_intersections(
+            to_2d(merged), crs=self.crs)
         bounds = pd.merge(
             bounds,
-            intersection_df,
+            intersections,
             how='left',
-            left_on='firecode',
+            left_on='fire_id',
             right_index=True,
         )
 
-        # Reproject back to epsg 4326
-        bounds = bounds.to_crs(epsg=4326)
-
         # Get titles from predefined crosswalk
         wiki = data_source.Wikipedia()
         wiki_titles = bounds['name'].apply(
@@ -497,6 +504,8 @@ class Trail:
         """Get transit information for trail
         """
 
+        # One client for all sections and towns, so that stops and routes
+        # shared between them are only fetched once
         transit = data_source.Transit()
 
         # Get all stops that intersect trail and town geometries
@@ -0,0 +1,374 @@
+"""
+## vector_tiles.py
+
+Generate Mapbox Vector Tiles in process, without writing GeoJSON to disk and
+running Tippecanoe. Meant for small to medium layers that are refreshed often,
+like current wildfires or air quality.
+
+Spec: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+
+import gzip
+import json
+import struct
+from typing import Iterator, Tuple
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import (
+    GeometryCollection, LineString, MultiLineString, MultiPoint, MultiPolygon,
+    Point, Polygon)
+from shapely.ops import clip_by_rect
+
+from geom import WEB_MERCATOR, WGS84
+
+# Half the width of the Web Mercator world in meters
+_MERCATOR_HALF = 20037508.342789244
+
+# Geometry types and commands
+_POINT = 1
+_LINESTRING = 2
+_POLYGON = 3
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+def geojson_to_vector_tiles(
+        geojson_data,
+        layer_name: str,
+        min_zoom: int = 0,
+        max_zoom: int = 10,
+        extent: int = 4096,
+        buffer: int = 64) -> Iterator[Tuple[int, int, int, bytes]]:
+    """Generate gzipped vector tiles from GeoJSON
+
+    Features are reprojected once, simplified once per zoom to a tolerance of
+    one tile pixel, and then clipped to each tile they overlap. Candidate tiles
+    for each feature are found from the feature bounds arrays.
+
+    Args:
+        - geojson_data: GeoJSON FeatureCollection, as dict or str
+        - layer_name: name of the vector tile layer
+        - min_zoom: min zoom to generate tiles for
+        - max_zoom: max zoom to generate tiles for
+        - extent: number of integer coordinates across each tile
+        - buffer: number of pixels around each tile to include
+
+    Yields:
+        (z, x, y, gzipped tile bytes), in XYZ coordinates
+    """
+    if isinstance(geojson_data, str):
+        geojson_data = json.loads(geojson_data)
+
+    gdf = gpd.GeoDataFrame.from_features(geojson_data['features'], crs=WGS84)
+    gdf = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+    if gdf.empty:
+        return
+
+    gdf = gdf.to_crs(epsg=WEB_MERCATOR)
+    bounds = gdf.geometry.bounds.values
+    properties = gdf.drop(columns=gdf.geometry.name).to_dict('records')
+
+    for z in range(min_zoom, max_zoom + 1):
+        tile_size = 2 * _MERCATOR_HALF / 2 ** z
+        pixel = tile_size / extent
+        geometries = gdf.geometry.simplify(pixel).values
+
+        feature_idx, xs, ys = _tile_candidates(bounds, z, pad=buffer * pixel)
+        order = np.lexsort((feature_idx, ys, xs))
+        feature_idx, xs, ys = feature_idx[order], xs[order], ys[order]
+
+        # Split into groups of candidate features for each tile
+        starts = np.flatnonzero(
+            np.r_[True, (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])])
+        ends = np.r_[starts[1:], len(xs)]
+        for start, end in zip(starts, ends):
+            x, y = int(xs[start]), int(ys[start])
+            tile = encode_tile(
+                layer_name=layer_name,
+                geometries=[geometries[i] for i in feature_idx[start:end]],
+                properties=[properties[i] for i in feature_idx[start:end]],
+                bounds=_tile_mercator_bounds(x, y, z),
+                extent=extent,
+                buffer=buffer)
+
+            if tile is not None:
+                yield z, x, y, gzip.compress(tile, mtime=0)
+
+
+def encode_tile(
+        layer_name, geometries, properties, bounds, extent=4096, buffer=64):
+    """Encode single-layer vector tile
+
+    Args:
+        - layer_name: name of layer
+        - geometries: shapely geometries in the same CRS as bounds
+        - properties: list of dicts of properties for each geometry
+        - bounds: (minx, miny, maxx, maxy) of tile
+        - extent: number of integer coordinates across the tile
+        - buffer: number of pixels around tile to keep when clipping
+
+    Returns:
+        protobuf-encoded tile, or None if no features intersect the tile
+    """
+    minx, miny, maxx, maxy = bounds
+    pad = (maxx - minx) * buffer / extent
+    scale = extent / (maxx - minx)
+
+    keys = {}
+    values = {}
+    features = []
+    for geometry, props in zip(geometries, properties):
+        geometry = clip_by_rect(
+            geometry, minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+        tags = None
+        for part in _split_geometry(geometry):
+            geom_type, commands = _encode_geometry(
+                part, origin=(minx, maxy), scale=scale)
+            if not commands:
+                continue
+
+            if tags is None:
+                tags = _encode_tags(props, keys, values)
+
+            feature = bytearray()
+            _write_packed(feature, 2, tags)
+            _write_varint_field(feature, 3, geom_type)
+            _write_packed(feature, 4, commands)
+            features.append(feature)
+
+    if not features:
+        return None
+
+    layer = bytearray()
+    _write_varint_field(layer, 15, 2)
+    _write_bytes_field(layer, 1, layer_name.encode('utf-8'))
+    for feature in features:
+        _write_bytes_field(layer, 2, feature)
+    for key in keys:
+        _write_bytes_field(layer, 3, key.encode('utf-8'))
+    for value in values:
+        _write_bytes_field(layer, 4, _encode_value(value))
+    _write_varint_field(layer, 5, extent)
+
+    tile = bytearray()
+    _write_bytes_field(tile, 3, layer)
+    return bytes(tile)
+
+
+def _tile_candidates(bounds, z, pad=0):
+    """Find tiles whose (padded) extent overlaps each feature's bounds
+
+    Args:
+        - bounds: (n, 4) array of Web Mercator feature bounds
+        - z: zoom level
+        - pad: distance in meters to expand each tile by
+
+    Returns:
+        (feature index, x, y) arrays with one row per feature-tile pair
+    """
+    n = 2 ** z
+    tile_size = 2 * _MERCATOR_HALF / n
+
+    x0 = np.floor((bounds[:, 0] - pad + _MERCATOR_HALF) / tile_size)
+    x1 = np.floor((bounds[:, 2] + pad + _MERCATOR_HALF) / tile_size)
+    y0 = np.floor((_MERCATOR_HALF - bounds[:, 3] - pad) / tile_size)
+    y1 = np.floor((_MERCATOR_HALF - bounds[:, 1] + pad) / tile_size)
+    x0, x1, y0, y1 = [np.clip(a, 0, n - 1).astype(np.int64)
+                      for a in (x0, x1, y0, y1)]
+
+    # Expand each feature's rectangle of tiles into one row per tile
+    widths = x1 - x0 + 1
+    heights = y1 - y0 + 1
+    counts = widths * heights
+    feature_idx = np.repeat(np.arange(len(bounds)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    xs = x0[feature_idx] + offsets % widths[feature_idx]
+    ys = y0[feature_idx] + offsets // widths[feature_idx]
+    return feature_idx, xs, ys
+
+
+def _tile_mercator_bounds(x, y, z):
+    tile_size = 2 * _MERCATOR_HALF / 2 ** z
+    minx = x * tile_size - _MERCATOR_HALF
+    maxy = _MERCATOR_HALF - y * tile_size
+    return minx, maxy - tile_size, minx + tile_size, maxy
+
+
+def _split_geometry(geometry):
+    """Split GeometryCollections into parts that can each be one feature"""
+    if geometry is None or geometry.is_empty:
+        return []
+    if isinstance(geometry, GeometryCollection) and not isinstance(
+            geometry, (MultiPoint, MultiLineString, MultiPolygon)):
+        return [g for part in geometry.geoms for g in _split_geometry(part)]
+    return [geometry]
+
+
+def _encode_geometry(geometry, origin, scale):
+    """Encode geometry into vector tile commands
+
+    Args:
+        - geometry: shapely geometry
+        - origin: (minx, maxy) of tile
+        - scale: tile coordinates per unit of geometry coordinates
+
+    Returns:
+        (geometry type, list of command integers)
+    """
+    cursor = np.zeros(2, dtype=np.int64)
+
+    def to_tile(coords):
+        coords = np.asarray(coords)[:, :2]
+        px = np.round((coords[:, 0] - origin[0]) * scale)
+        py = np.round((origin[1] - coords[:, 1]) * scale)
+        tile_coords = np.stack([px, py], axis=1).astype(np.int64)
+
+        # Drop repeated points created by rounding
+        keep = np.r_[True, np.any(np.diff(tile_coords, axis=0) != 0, axis=1)]
+        return tile_coords[keep]
+
+    def path(coords, close=False):
+        nonlocal cursor
+        if close and len(coords) > 1 and (coords[0] == coords[-1]).all():
+            coords = coords[:-1]
+
+        deltas = np.diff(coords, axis=0, prepend=cursor[np.newaxis, :])
+        cursor = coords[-1]
+        params = _zigzag(deltas).ravel().tolist()
+
+        commands = [_command(_MOVE_TO, 1)] + params[:2]
+        if len(coords) > 1:
+            commands += [_command(_LINE_TO, len(coords) - 1)] + params[2:]
+        if close:
+            commands.append(_command(_CLOSE_PATH, 1))
+        return commands
+
+    if isinstance(geometry, (Point, MultiPoint)):
+        points = [geometry] if isinstance(geometry, Point) else geometry.geoms
+        coords = to_tile([p.coords[0] for p in points])
+        deltas = np.diff(coords, axis=0, prepend=cursor[np.newaxis, :])
+        commands = [_command(_MOVE_TO, len(coords))]
+        return _POINT, commands + _zigzag(deltas).ravel().tolist()
+
+    if isinstance(geometry, (LineString, MultiLineString)):
+        lines = [geometry] if isinstance(geometry, LineString) else geometry.geoms
+        commands = []
+        for line in lines:
+            coords = to_tile(line.coords)
+            if len(coords) >= 2:
+                commands += path(coords)
+        return _LINESTRING, commands
+
+    if isinstance(geometry, (Polygon, MultiPolygon)):
+        polygons = [geometry] if isinstance(geometry, Polygon) else geometry.geoms
+        commands = []
+        for polygon in polygons:
+            exterior = to_tile(polygon.exterior.coords)
+            if len(exterior) < 4:
+                continue
+
+            # Exterior rings must have positive area in tile coordinates,
+            # interior rings negative
+            if _signed_area(exterior) < 0:
+                exterior = exterior[::-1]
+            commands += path(exterior, close=True)
+
+            for interior in polygon.interiors:
+                interior = to_tile(interior.coords)
+                if len(interior) < 4:
+                    continue
+                if _signed_area(interior) > 0:
+                    interior = interior[::-1]
+                commands += path(interior, close=True)
+
+        return _POLYGON, commands
+
+    return None, []
+
+
+def _signed_area(coords):
+    x = coords[:, 0]
+    y = coords[:, 1]
+    return (np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def _encode_tags(props, keys, values):
+    """Encode feature properties as indices into the layer's keys and values
+
+    Args:
+        - props: dict of feature properties
+        - keys: dict from key to index, updated in place
+        - values: dict from value to index, updated in place
+    """
+    tags = []
+    for key, value in props.items():
+        if hasattr(value, 'item'):
+            # numpy scalar
+            value = value.item()
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        if not isinstance(value, (str, bool, int, float)):
+            value = json.dumps(value)
+
+        # Keep bool values distinct from ints that compare equal
+        value_key = (type(value), value)
+        tags.append(keys.setdefault(key, len(keys)))
+        tags.append(values.setdefault(value_key, len(values)))
+
+    return tags
+
+
+def _encode_value(value_key):
+    value_type, value = value_key
+    buf = bytearray()
+    if value_type is str:
+        _write_bytes_field(buf, 1, value.encode('utf-8'))
+    elif value_type is bool:
+        _write_varint_field(buf, 7, int(value))
+    elif value_type is int and value >= 0:
+        _write_varint_field(buf, 5, value)
+    elif value_type is int:
+        _write_varint_field(buf, 6, (value << 1) ^ (value >> 63))
+    else:
+        buf += _varint((3 << 3) | 1) + struct.pack('<d', value)
+    return buf
+
+
+def _varint(value):
+    buf = bytearray()
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+    return buf
+
+
+def _write_varint_field(buf, field, value):
+    buf += _varint(field << 3)
+    buf += _varint(value)
+
+
+def _write_bytes_field(buf, field, data):
+    buf += _varint((field << 3) | 2)
+    buf += _varint(len(data))
+    buf += data
+
+
+def _write_packed(buf, field, values):
+    packed = bytearray()
+    for value in values:
+        packed += _varint(value)
+    _write_bytes_field(buf, field, packed)
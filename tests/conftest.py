@@ -0,0 +1,16 @@
+import sys
+import types
+from pathlib import Path
+
+DATA_SOURCE_DIR = Path(__file__).resolve().parents[1] / 'code' / 'data_source'
+
+try:
+    import data_source  # noqa: F401
+except ImportError:
+    # data_source/__init__.py imports every data source, and with them
+    # dependencies that only some sources need, like demquery or wikipedia.
+    # Register the package without running __init__.py, so that tests can
+    # still import the single modules they test, e.g. data_source.photos.
+    package = types.ModuleType('data_source')
+    package.__path__ = [str(DATA_SOURCE_DIR)]
+    sys.modules['data_source'] = package
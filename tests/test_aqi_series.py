@@ -0,0 +1,91 @@
+import gzip
+
+import numpy as np
+import pytest
+from shapely.geometry import LineString, box
+
+from aqi_series import (
+    MISSING, append_snapshot, cell_centers, decode_series, encode_series,
+    rasterize, trail_grid)
+
+
+def test_trail_grid():
+    line = LineString([(-120.0, 35.0), (-120.0, 35.5), (-119.5, 35.5)])
+    cells = trail_grid(line, cell_size=0.1, buffer_cells=1)
+
+    # No duplicates, and cells are in order along the trail
+    assert len(np.unique(cells, axis=0)) == len(cells)
+    assert tuple(cells[0]) == (-1201, 349)
+    assert tuple(cells[-1]) == (-1194, 356)
+
+    # Every cell the trail passes through is included
+    lon, lat = cell_centers(cells, 0.1)
+    for x, y in [(-120.0, 35.25), (-119.75, 35.5)]:
+        assert np.any((np.abs(lon - x) < 0.1) & (np.abs(lat - y) < 0.1))
+
+
+def test_rasterize():
+    lon = np.array([0.5, 1.5, 2.5])
+    lat = np.array([0.5, 0.5, 0.5])
+    geometries = [box(0, 0, 2, 1), box(1, 0, 2, 1)]
+    values = rasterize(geometries, [1, 4], lon, lat)
+    assert values.tolist() == [1, 4, 0]
+
+
+def test_encode_decode():
+    values = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    start, decoded = decode_series(encode_series(450000, values))
+    assert start == 450000
+    assert np.array_equal(decoded, values)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='test-bucket')
+        yield client
+
+
+def _read(client, key):
+    body = client.get_object(Bucket='test-bucket', Key=key)['Body'].read()
+    return decode_series(gzip.decompress(body))
+
+
+def test_append_snapshot(client):
+    # 2020-09-10T00:00Z
+    day = 1599696000 // 3600
+    prefix = 'airnow/series/PM25'
+    for hour, value in [(day + 22, 1), (day + 23, 2), (day + 25, 3)]:
+        append_snapshot(
+            client, 'test-bucket', prefix, hour,
+            np.full(5, value, dtype=np.uint8), window=4)
+
+    start, values = _read(client, f'{prefix}/2020-09-10.bin')
+    assert start == day
+    assert values.shape == (24, 5)
+    assert values[22:, 0].tolist() == [1, 2]
+    assert np.all(values[:22] == MISSING)
+
+    start, values = _read(client, f'{prefix}/2020-09-11.bin')
+    assert start == day + 24
+    assert values[:2, 0].tolist() == [MISSING, 3]
+
+    # Rolling window of the 4 latest hours, with a gap for the missing hour
+    start, values = _read(client, f'{prefix}/latest.bin')
+    assert start == day + 22
+    assert values[:, 0].tolist() == [1, 2, MISSING, 3]
+
+    # A late snapshot fills in its hour without moving the window
+    append_snapshot(
+        client, 'test-bucket', prefix, day + 24,
+        np.full(5, 6, dtype=np.uint8), window=4)
+    start, values = _read(client, f'{prefix}/latest.bin')
+    assert start == day + 22
+    assert values[:, 0].tolist() == [1, 2, 6, 3]
@@ -0,0 +1,184 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, MultiPolygon, box
+
+from data_source import fire_history
+from data_source.fire_history import (
+    METERS_PER_MILE, FireHistory, find_overlapping,
+    intersect_line_with_polygons)
+
+
+def _fires(boxes, years):
+    return gpd.GeoDataFrame({
+        'year': years,
+        'geometry': [box(*b) for b in boxes]}, crs='EPSG:4326')
+
+
+def test_find_overlapping():
+    nifc = _fires([(-118.0, 34.0, -117.9, 34.1)], [2015])
+    calfire = _fires(
+        [
+            # Same fire
+            (-118.0, 34.0, -117.9, 34.1),
+            # Same area, another year
+            (-118.0, 34.0, -117.9, 34.1),
+            # Same year, overlapping 30% of its area
+            (-117.93, 34.0, -117.83, 34.1),
+            # Same year, elsewhere
+            (-119.0, 35.0, -118.9, 35.1),
+        ],
+        [2015, 2016, 2015, 2015])
+
+    duplicated = find_overlapping(calfire, nifc, min_overlap=0.5)
+    assert duplicated.tolist() == [True, False, False, False]
+
+    duplicated = find_overlapping(calfire, nifc, min_overlap=0.25)
+    assert duplicated.tolist() == [True, False, True, False]
+
+
+def test_find_overlapping_smaller_fire():
+    # A small fire inside a large one overlaps all of the smaller one's area
+    nifc = _fires([(-118.0, 34.0, -117.0, 35.0)], [2015])
+    calfire = _fires([(-117.6, 34.4, -117.5, 34.5)], [2015])
+    assert find_overlapping(calfire, nifc).tolist() == [True]
+
+
+def _line(reverse=False):
+    # Straight 10 km line with a vertex every 100 m, so that it is split into
+    # several pieces
+    xs = np.linspace(0, 10000, 101)
+    coords = np.column_stack([xs, np.zeros_like(xs)])
+    return LineString(coords[::-1] if reverse else coords)
+
+
+POLYGONS = [
+    # Crossed twice by the line
+    MultiPolygon([box(1000, -50, 2000, 50),
+                  box(3000, -50, 4000, 50)]),
+    box(5000, -50, 5500, 50),
+    # Not crossed
+    box(0, 1000, 100, 1100),
+]
+
+
+def test_intersect_line_with_polygons():
+    df = intersect_line_with_polygons(_line(), POLYGONS, n_coords=8)
+    assert df.index.tolist() == [0, 1]
+    assert df['length'].tolist() == pytest.approx([2000, 500])
+    assert df['start'].tolist() == pytest.approx([1000, 5000])
+    assert df['end'].tolist() == pytest.approx([4000, 5500])
+
+
+def test_intersect_line_with_polygons_follows_line_direction():
+    # Distances are along the line from its start, so a line drawn the other
+    # way reaches the polygons in the opposite order
+    df = intersect_line_with_polygons(
+        _line(reverse=True), POLYGONS, n_coords=8)
+    assert df['start'].tolist() == pytest.approx([6000, 4500])
+    assert df['end'].tolist() == pytest.approx([9000, 5000])
+    assert (df['start'] <= df['end']).all()
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setenv('ROOT_DIR', str(tmp_path))
+    return FireHistory()
+
+
+def test_trail_intersections(history, tmp_path, monkeypatch):
+    store_path = tmp_path / 'fires.parquet'
+    store_path.touch()
+    monkeypatch.setattr(FireHistory, 'store', lambda self: store_path)
+
+    # Fires around a trail heading north from 34N, in EPSG 4326
+    fires = gpd.GeoDataFrame({
+        'fire_id': ['nifc-a', 'calfire-b', 'nifc-c'],
+        'geometry': [
+            box(-118.01, 34.01, -117.99, 34.02),
+            box(-118.01, 34.05, -117.99, 34.06),
+            box(-117.5, 34.0, -117.4, 34.1)]}, crs='EPSG:4326')
+    n_reads = []
+
+    def read(self, start_year=None, bbox=None):
+        n_reads.append(1)
+        return fires
+
+    monkeypatch.setattr(FireHistory, 'read', read)
+
+    trail = LineString([(-118.0, 34.0), (-118.0, 34.1)])
+    df = history.trail_intersections(trail, crs=3310)
+    assert df.index.tolist() == ['nifc-a', 'calfire-b']
+    assert (df['start_mile'] < df['end_mile']).all()
+    assert df.loc['nifc-a', 'end_mile'] < df.loc['calfire-b', 'start_mile']
+
+    # About 1.1 km per 0.01 degree of latitude
+    lengths = df['length'] / 1000
+    assert lengths.tolist() == pytest.approx([1.11, 1.11], abs=0.01)
+    assert df.loc['nifc-a', 'start_mile'] == pytest.approx(
+        1110 / METERS_PER_MILE, abs=0.01)
+
+    # Cached until the trail or the store changes
+    assert history.trail_intersections(trail, crs=3310).equals(df)
+    assert len(n_reads) == 1
+    history.trail_intersections(trail, crs=3310, overwrite=True)
+    assert len(n_reads) == 2
+
+
+def test_store(history, tmp_path, monkeypatch):
+    nifc_path = tmp_path / 'nifc.parquet'
+    nifc = gpd.GeoDataFrame(
+        {
+            'uniquefire': ['2015-A', '2015-A', '2016-B'],
+            'datecurren': pd.to_datetime(
+                ['2015-08-01', '2015-08-10', '2016-07-01']),
+            'fireyear': [2015, 2015, 2016],
+            'incidentna': ['LAKE', 'LAKE', 'BLUE CUT'],
+            'gisacres': [100.0, 200.0, 300.0],
+            'firecode': ['A1', 'A1', 'B1'],
+            'inciwebid': ['1', '1', '2'],
+            'geometry': [
+                box(-118.0, 34.0, -117.95, 34.05),
+                box(-118.0, 34.0, -117.9, 34.1),
+                box(-117.5, 34.2, -117.4, 34.3)]},
+        crs='EPSG:4326')
+    nifc.to_parquet(nifc_path)
+    monkeypatch.setattr(
+        fire_history.NIFC, 'perimeters_cache', lambda self: nifc_path)
+
+    calfire = gpd.GeoDataFrame(
+        {
+            'year': [2015, 2015, 1990],
+            'name': ['Lake', 'Other', 'Old'],
+            'acres': [190.0, 10.0, 50.0],
+            'rx': [False, True, False],
+            'layer': ['firep18_1', 'rxburn18_1', 'firep18_1'],
+            'geometry': [
+                box(-118.0, 34.0, -117.9, 34.1),
+                box(-119.0, 35.0, -118.9, 35.1),
+                box(-118.0, 34.0, -117.9, 34.1)]},
+        index=[0, 0, 1],
+        crs='EPSG:4326')
+    monkeypatch.setattr(
+        fire_history.CalFire, 'read', lambda self, start_year=None: calfire)
+    calfire_zip = tmp_path / 'data' / 'raw' / 'calfire' / 'fire18_1.zip'
+    calfire_zip.parent.mkdir(parents=True, exist_ok=True)
+    calfire_zip.touch()
+
+    fires = history.read().set_index('fire_id').sort_index()
+
+    # The latest NIFC perimeter of each fire is kept, and the CalFire copy of
+    # the same fire is dropped, but not a fire of another year in the same
+    # place
+    assert fires.index.tolist() == [
+        'calfire-firep18_1-1', 'calfire-rxburn18_1-0', 'nifc-2015-A',
+        'nifc-2016-B']
+    assert fires.loc['nifc-2015-A', 'acres'] == 200
+    assert fires.loc['nifc-2015-A', 'name'] == 'Lake'
+    assert fires.loc['calfire-rxburn18_1-0', 'rx']
+    assert not fires.loc['nifc-2016-B', 'rx']
+
+    # Reads filter on year and bounding box
+    fires = history.read(start_year=2015, bbox=(-118.1, 33.9, -117.8, 34.2))
+    assert fires['fire_id'].tolist() == ['nifc-2015-A']
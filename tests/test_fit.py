@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from fit import read_fit_points
+
+sys.path.append('../code')
+
+TRACKS_DIR = Path(__file__).resolve().parents[1] / 'data' / 'raw' / 'tracks'
+
+
+def test_read_fit_points():
+    points = read_fit_points(
+        TRACKS_DIR / 'Move_2019_04_22_13_31_24_Hiking.fit')
+
+    assert len(points['time']) == 226
+    assert points['lat'].dtype == np.float32
+    assert np.all(np.diff(points['time']) > 0)
+
+    # Start of the PCT at the Mexican border, on April 22, 2019
+    start = np.datetime64('2019-04-22T20:32:23', 'ns').astype(np.int64)
+    assert points['time'][0] == start
+    assert abs(points['lat'][0] - 32.6063) < 1e-4
+    assert abs(points['lon'][0] - -116.4712) < 1e-4
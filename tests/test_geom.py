@@ -0,0 +1,55 @@
+import sys
+
+import geopandas as gpd
+from shapely.geometry import Point, Polygon
+
+import geom
+
+sys.path.append('../code')
+
+
+def test_validate_geom_gdf():
+    """Only invalid geometries are repaired, and reported"""
+    bowtie = Polygon([(0, 0), (1, 1), (1, 0), (0, 1), (0, 0)])
+    circle = Point(0, 0).buffer(1)
+    gdf = gpd.GeoDataFrame(
+        {'name': ['bowtie', 'circle']},
+        geometry=[bowtie, circle],
+        index=[10, 20],
+        crs=4326)
+
+    gdf = geom.validate_geom_gdf(gdf)
+    assert gdf.is_valid.all()
+    assert gdf.geometry[10].geom_type == 'MultiPolygon'
+    assert gdf.geometry[20].equals(circle)
+
+
+def test_to_2d_keeps_zero_coordinates():
+    gdf = gpd.GeoDataFrame(
+        geometry=[Point(0, 38.5, 1000), Point(-120.5, 0)], crs=4326)
+
+    gdf = geom.to_2d(gdf)
+    assert not gdf.has_z.any()
+    assert gdf.geometry[0].coords[0] == (0, 38.5)
+    assert gdf.geometry[1].coords[0] == (-120.5, 0)
+
+
+def test_minimum_enclosing_circle():
+    square = [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+    x, y, r = geom.minimum_enclosing_circle(square)
+    assert (x, y) == (1, 1)
+    assert abs(r - 2**0.5) < 1e-9
+
+
+def test_find_circles_that_tile_polygon():
+    polygon = Point(-120, 39).buffer(0.2)
+    points, radii = geom.find_circles_that_tile_polygon(polygon, radius=5000)
+
+    projected = geom.reproject(polygon, to_epsg=3488, from_epsg=4326)
+    circles = [
+        geom.reproject(p, to_epsg=3488, from_epsg=4326).buffer(r)
+        for p, r in zip(points, radii)]
+    uncovered = projected
+    for circle in circles:
+        uncovered = uncovered.difference(circle)
+    assert uncovered.area / projected.area < 1e-3
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from PIL import Image
+
+import images
+from images import MANIFEST_NAME, convert_photos
+
+
+def _photos(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    xw = {}
+    for i, color in enumerate(['red', 'blue']):
+        path = src / f'{i}.png'
+        Image.new('RGB', (40, 30), color).save(path)
+        xw[str(path)] = f'photo{i}'
+    return xw
+
+
+def _convert(xw, out_dir, **kwargs):
+    return convert_photos(
+        xw, out_dir, sizes={'thumb': 10}, n_workers=1, **kwargs)
+
+
+def test_skip_unchanged(tmp_path):
+    xw = _photos(tmp_path)
+    out_dir = tmp_path / 'out'
+    assert _convert(xw, out_dir) == {
+        'converted': 2, 'skipped': 0, 'failed': 0}
+    with Image.open(out_dir / 'photo0_thumb.jpeg') as img:
+        assert max(img.size) == 10
+
+    mtime = (out_dir / 'photo0.jpeg').stat().st_mtime_ns
+    assert _convert(xw, out_dir) == {
+        'converted': 0, 'skipped': 2, 'failed': 0}
+    assert (out_dir / 'photo0.jpeg').stat().st_mtime_ns == mtime
+
+    # A changed source is converted again
+    Image.new('RGB', (40, 30), 'green').save(next(iter(xw)))
+    assert _convert(xw, out_dir) == {
+        'converted': 1, 'skipped': 1, 'failed': 0}
+
+
+def test_changed_options(tmp_path):
+    xw = _photos(tmp_path)
+    out_dir = tmp_path / 'out'
+    _convert(xw, out_dir)
+    assert _convert(xw, out_dir, quality=50) == {
+        'converted': 2, 'skipped': 0, 'failed': 0}
+
+
+def test_corrupt_input(tmp_path):
+    xw = _photos(tmp_path)
+    bad = tmp_path / 'src' / 'bad.heic'
+    bad.write_bytes(b'not an image')
+    xw[str(bad)] = 'bad'
+    out_dir = tmp_path / 'out'
+
+    assert _convert(xw, out_dir) == {
+        'converted': 2, 'skipped': 0, 'failed': 1}
+    with open(out_dir / MANIFEST_NAME) as f:
+        assert sorted(json.load(f)) == ['photo0', 'photo1']
+
+    # Only the failed photo is tried again
+    assert _convert(xw, out_dir) == {
+        'converted': 0, 'skipped': 2, 'failed': 1}
+
+
+def test_manifest_saved_when_interrupted(tmp_path, monkeypatch):
+    xw = _photos(tmp_path)
+    out_dir = tmp_path / 'out'
+
+    # Interrupt the run at the first incremental save, after the first photo
+    monkeypatch.setattr(images, '_MANIFEST_SAVE_EVERY', 1)
+    save_manifest = images._save_manifest
+    calls = []
+
+    def save(manifest, path):
+        calls.append(dict(manifest))
+        save_manifest(manifest, path)
+        if len(calls) == 1:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(images, '_save_manifest', save)
+    with pytest.raises(KeyboardInterrupt):
+        _convert(xw, out_dir)
+
+    with open(out_dir / MANIFEST_NAME) as f:
+        assert list(json.load(f)) == ['photo0']
@@ -0,0 +1,52 @@
+from shapely.geometry import MultiPolygon, Point, Polygon, box
+
+from data_source.nifc_current import BBOX, bbox_indices, latest_indices
+
+
+def test_latest_indices():
+    properties = [
+        {'IRWINID': 'a', 'DateCurren': '2020-08-01T00:00:00Z'},
+        {'IRWINID': 'b', 'DateCurren': '2020-08-02T00:00:00+00:00'},
+        {'IRWINID': 'a', 'DateCurren': '2020-08-03T00:00:00Z'},
+        # Same date as the last record of 'b', written in another time zone
+        {'IRWINID': 'b', 'DateCurren': '2020-08-01T17:00:00-07:00'},
+        {'IRWINID': 'a', 'DateCurren': '2020-08-02T00:00:00Z'},
+    ]
+    # Latest of 'a', first of the two latest 'b'
+    assert latest_indices(properties).tolist() == [1, 2]
+
+
+def test_latest_indices_missing_keys():
+    properties = [
+        {'IRWINID': None, 'DateCurren': '2020-08-05T00:00:00Z'},
+        {'DateCurren': '2020-08-05T00:00:00Z'},
+        {'IRWINID': 'a', 'DateCurren': '2020-08-01T00:00:00Z'},
+        {'IRWINID': 'a', 'DateCurren': None},
+        {'IRWINID': 'a'},
+        {'IRWINID': 'b'},
+    ]
+    assert latest_indices(properties).tolist() == [2]
+    assert latest_indices(properties[:2]).tolist() == []
+    assert latest_indices([]).tolist() == []
+
+
+def test_bbox_indices():
+    geometries = [
+        # Within
+        box(-120, 35, -119, 36),
+        # Outside
+        box(-100, 35, -99, 36),
+        # Straddling the western edge
+        box(-126, 40, -125, 41),
+        # Bounds overlap the box, but not the geometry itself
+        MultiPolygon([box(-130, 30, -129, 31), box(-113, 50, -112, 51)]),
+        Point(-120, 35),
+    ]
+    assert bbox_indices(geometries, BBOX).tolist() == [0, 2, 4]
+    assert bbox_indices([], BBOX).tolist() == []
+
+
+def test_bbox_indices_empty_geometries():
+    geometries = [Polygon(), box(-120, 35, -119, 36), MultiPolygon()]
+    assert bbox_indices(geometries, BBOX).tolist() == [1]
+    assert bbox_indices([Polygon()], BBOX).tolist() == []
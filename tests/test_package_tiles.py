@@ -0,0 +1,189 @@
+import errno
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, box
+
+import package_tiles
+from geom import CA_ALBERS, WGS84, distance_in_meters, reproject
+from package_tiles import diff_manifests
+from tiles import tile_keys_for_polygon
+
+
+def test_diff_manifests():
+    old = {'2/omt/12/1/1': 'a', '2/omt/12/1/2': 'b', '2/omt/12/1/3': 'c'}
+    new = {'2/omt/12/1/1': 'a', '2/omt/12/1/2': 'x', '5/omt/12/1/4': 'd'}
+    assert diff_manifests(old, new) == {
+        'added': ['5/omt/12/1/4'],
+        'changed': ['2/omt/12/1/2'],
+        'deleted': ['2/omt/12/1/3']}
+
+
+def _tiles(src_dir):
+    tiles = []
+    for y in range(3):
+        path = src_dir / '12' / '1' / f'{y}.pbf'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'tile %d' % y)
+        tiles.append((12, 1, y, str(path)))
+    return tiles
+
+
+def test_place_tiles_without_manifest_reads_nothing(tmp_path, monkeypatch):
+    tiles = _tiles(tmp_path / 'src')
+
+    def fail(path):
+        raise AssertionError('tile was read')
+
+    monkeypatch.setattr(package_tiles, '_file_md5', fail)
+    package_tiles._place_tiles(
+        tiles, tmp_path / 'out', copy_mode='hardlink', hashes=None)
+    assert (tmp_path / 'out' / '12' / '1' / '2.pbf').read_bytes() == b'tile 2'
+
+
+def test_place_tiles_reuses_hashes_of_unchanged_tiles(tmp_path, monkeypatch):
+    tiles = _tiles(tmp_path / 'src')
+    first = package_tiles._TileHashes(manifest={}, stats={}, prefix='2/omt')
+    package_tiles._place_tiles(
+        tiles, tmp_path / 'out1', copy_mode='copy', hashes=first)
+    assert len(first.manifest) == 3
+
+    # Change one tile's size; the others keep their size and mtime
+    changed = tiles[1][3]
+    with open(changed, 'ab') as f:
+        f.write(b'!')
+
+    read = []
+    file_md5 = package_tiles._file_md5
+    monkeypatch.setattr(
+        package_tiles, '_file_md5', lambda p: read.append(p) or file_md5(p))
+
+    second = package_tiles._TileHashes(
+        manifest={},
+        stats={},
+        previous=first.manifest,
+        previous_stats=first.stats,
+        prefix='2/omt')
+    package_tiles._place_tiles(
+        tiles, tmp_path / 'out2', copy_mode='copy', hashes=second)
+
+    assert read == [changed]
+    assert diff_manifests(first.manifest, second.manifest)['changed'] == [
+        '2/omt/12/1/1']
+    assert [p.name for p in (tmp_path / 'out2' / '12' / '1').iterdir()] == [
+        '1.pbf']
+
+
+def _tile_tree(src_dir):
+    """Build a small z/x/y.pbf tree with a stray file of another extension"""
+    for z, x, y in [(11, 0, 0), (11, 0, 1), (12, 1, 0), (12, 1, 2)]:
+        path = src_dir / str(z) / str(x) / f'{y}.pbf'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(f'tile {z}/{x}/{y}'.encode())
+    (src_dir / '12' / '1' / '3.png').write_bytes(b'png')
+
+
+def test_find_tiles(tmp_path):
+    _tile_tree(tmp_path)
+    zs = [11, 11, 12, 12, 12]
+    xs = [0, 0, 1, 1, 1]
+    ys = [0, 1, 0, 2, 3]
+
+    tiles = package_tiles._find_tiles(tmp_path, xs, ys, zs, raise_errors=False)
+    assert [(z, x, y) for z, x, y, _ in tiles] == list(zip(zs, xs, ys))
+    assert tiles[-1][3] == str(tmp_path / '12' / '1' / '3.png')
+
+    tiles = package_tiles._find_tiles(
+        tmp_path, xs, ys, zs, raise_errors=False, ext='.pbf')
+    assert [(z, x, y) for z, x, y, _ in tiles] == list(zip(zs, xs, ys))[:4]
+    assert all(src.endswith('.pbf') for _, _, _, src in tiles)
+
+
+def test_find_tiles_missing(tmp_path):
+    _tile_tree(tmp_path)
+
+    # Missing tile in an existing directory, and a missing directory
+    for xs, ys, zs in [([1], [1], [12]), ([5], [0], [12])]:
+        assert package_tiles._find_tiles(
+            tmp_path, xs, ys, zs, raise_errors=False) == []
+        with pytest.raises(FileNotFoundError):
+            package_tiles._find_tiles(tmp_path, xs, ys, zs, raise_errors=True)
+
+    with pytest.raises(FileNotFoundError):
+        package_tiles._find_tiles(
+            tmp_path, [1], [3], [12], raise_errors=True, ext='.pbf')
+
+
+@pytest.mark.parametrize('copy_mode', package_tiles.COPY_MODES)
+def test_place_tiles_copy_modes(tmp_path, copy_mode):
+    src_dir = tmp_path / 'src'
+    _tile_tree(src_dir)
+    tiles = package_tiles._find_tiles(
+        src_dir, [0, 0, 1, 1], [0, 1, 0, 2], [11, 11, 12, 12],
+        raise_errors=True, ext='.pbf')
+
+    out_dir = tmp_path / 'out'
+    n_bytes = package_tiles._place_tiles(
+        tiles, out_dir, copy_mode=copy_mode, hashes=None, n_workers=2)
+
+    placed = sorted(p for p in out_dir.rglob('*') if not p.is_dir())
+    assert [p.relative_to(out_dir).as_posix() for p in placed] == [
+        '11/0/0.pbf', '11/0/1.pbf', '12/1/0.pbf', '12/1/2.pbf']
+    for path in placed:
+        z, x, y = path.relative_to(out_dir).with_suffix('').parts
+        assert path.read_bytes() == f'tile {z}/{x}/{y}'.encode()
+    assert n_bytes == sum(len(p.read_bytes()) for p in placed)
+
+    src = src_dir / '11' / '0' / '0.pbf'
+    dest = out_dir / '11' / '0' / '0.pbf'
+    assert dest.is_symlink() == (copy_mode == 'symlink')
+    assert dest.samefile(src) == (copy_mode in ('hardlink', 'symlink'))
+
+
+def test_reflink_falls_back_to_copy(tmp_path, monkeypatch):
+    src = tmp_path / 'src.pbf'
+    src.write_bytes(b'tile')
+
+    def ioctl(fd, request, arg):
+        raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+    monkeypatch.setattr(package_tiles.fcntl, 'ioctl', ioctl)
+    dest = tmp_path / 'dest.pbf'
+    assert package_tiles._reflink_file(str(src), str(dest)) == 4
+    assert dest.read_bytes() == b'tile'
+    assert not dest.samefile(src)
+
+
+def _tiles_for_polygon(polygon, zoom_levels):
+    # Tiles whose bounds intersect the polygon, instead of running supermercado
+    mercantile = pytest.importorskip('mercantile')
+    tiles = []
+    for z in zoom_levels:
+        for t in mercantile.tiles(*polygon.bounds, zooms=z):
+            if box(*mercantile.bounds(t)).intersects(polygon):
+                tiles.append((t.x, t.y, t.z))
+    return tiles
+
+
+def test_get_tile_indices(monkeypatch):
+    monkeypatch.setattr('tiles.tiles_for_polygon', _tiles_for_polygon)
+    gdf = gpd.GeoDataFrame(
+        geometry=[LineString([(-118.0, 34.0), (-117.9, 34.1)])], crs=WGS84)
+
+    indices = package_tiles.get_tile_indices(gdf, [5, 2], max_zoom=[10, 12])
+    inner, outer = indices[2], indices[5]
+    assert len(inner) and len(outer)
+    assert np.all(np.diff(inner.astype(np.int64)) > 0)
+    assert np.all(np.diff(outer.astype(np.int64)) > 0)
+
+    # The rings are disjoint, and together are every tile of the largest buffer
+    assert len(np.intersect1d(inner, outer)) == 0
+    assert not np.isin(inner, outer).any()
+    largest = reproject(
+        reproject(gdf, to_epsg=CA_ALBERS).unary_union.buffer(
+            distance_in_meters(5, 'mile')),
+        to_epsg=WGS84,
+        from_epsg=CA_ALBERS)
+    expected = tile_keys_for_polygon(largest, zoom_levels=range(13))
+    assert np.array_equal(np.union1d(inner, outer), expected)
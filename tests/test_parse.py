@@ -0,0 +1,194 @@
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from parse import Parse
+
+
+class FakeParseServer(ThreadingHTTPServer):
+    """In-memory Parse Server that supports batch requests and simple queries
+
+    The first `n_rate_limited` batch requests are answered with 429.
+    """
+    def __init__(self, n_rate_limited=0):
+        super(FakeParseServer, self).__init__(('127.0.0.1', 0), _Handler)
+        self.objects = {}
+        self.ids = itertools.count()
+        self.n_rate_limited = n_rate_limited
+        self.n_batch_requests = 0
+        self.lock = threading.Lock()
+
+    def apply(self, request):
+        parts = request['path'].split('/')
+        body = request.get('body', {})
+        if body.get('fail'):
+            return {'error': {'code': 111, 'error': 'invalid type'}}
+
+        if request['method'] == 'POST':
+            object_id = f'obj{next(self.ids):06d}'
+            self.objects[object_id] = dict(body, objectId=object_id)
+            return {'success': {'objectId': object_id}}
+
+        object_id = parts[-1]
+        if request['method'] == 'PUT':
+            self.objects[object_id].update(body)
+            return {'success': {'updatedAt': '2020-01-01T00:00:00.000Z'}}
+
+        del self.objects[object_id]
+        return {'success': {}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server = self.server
+        with server.lock:
+            server.n_batch_requests += 1
+            if server.n_batch_requests <= server.n_rate_limited:
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self._send(200, [server.apply(x) for x in body['requests']])
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        where = json.loads(params.get('where', ['{}'])[0])
+        with self.server.lock:
+            results = [
+                x for x in self.server.objects.values()
+                if all(_matches(x.get(k), c) for k, c in where.items())]
+        if 'order' in params:
+            results.sort(key=lambda x: x[params['order'][0]])
+        results = results[:int(params.get('limit', [100])[0])]
+        if 'keys' in params:
+            keys = ['objectId', *params['keys'][0].split(',')]
+            results = [{k: x[k] for k in keys if k in x} for x in results]
+        self._send(200, {'results': results})
+
+
+def _matches(value, condition):
+    if isinstance(condition, dict):
+        if '$in' in condition:
+            return value in condition['$in']
+        return value is not None and value > condition['$gt']
+    return value == condition
+
+
+@pytest.fixture
+def server():
+    server = FakeParseServer(n_rate_limited=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def parse(server):
+    host, port = server.server_address
+    return Parse(
+        app_id='app',
+        server_url=f'http://{host}:{port}/parse',
+        master_key='key',
+        backoff_factor=0)
+
+
+def waypoints(n):
+    data = {'wpt_id': range(n), 'name': [f'WP{i}' for i in range(n)]}
+    geometry = [Point(-120, 40, i) for i in range(n)]
+    return gpd.GeoDataFrame(data, geometry=geometry, crs=4326)
+
+
+def test_upload_gdf(server, parse):
+    result = parse.upload_gdf(waypoints(120), 'Waypoint')
+    assert result['created'] == 120
+    assert result['failed'] == []
+    # Three batches, after two rate limited responses
+    assert server.n_batch_requests == 5
+
+    obj = next(x for x in server.objects.values() if x['wpt_id'] == 3)
+    assert obj['alt'] == 3
+    assert obj['geometry'] == {
+        '__type': 'GeoPoint', 'latitude': 40, 'longitude': -120}
+
+
+def test_upload_gdf_upsert(server, parse):
+    gdf = waypoints(60)
+    parse.upload_gdf(gdf, 'Waypoint', id_column='wpt_id')
+
+    gdf['name'] = 'renamed'
+    result = parse.upload_gdf(gdf, 'Waypoint', id_column='wpt_id')
+    assert result['created'] == 0
+    assert result['updated'] == 60
+    assert len(server.objects) == 60
+    assert {x['name'] for x in server.objects.values()} == {'renamed'}
+
+
+def test_upload_gdf_failures(server, parse):
+    gdf = waypoints(3)
+    gdf['fail'] = [False, True, False]
+    result = parse.upload_gdf(gdf, 'Waypoint')
+    assert result['created'] == 2
+    assert len(result['failed']) == 1
+    assert result['failed'][0]['object']['wpt_id'] == 1
+    assert result['failed'][0]['error']['code'] == 111
+
+
+def test_upload_batch(server, parse):
+    objects = [{'wpt_id': i, 'fail': i == 60} for i in range(70)]
+    responses = parse.upload_batch(objects, 'Waypoint')
+    assert len(responses) == 70
+    assert sum('success' in r for r in responses) == 69
+    assert 'error' in responses[60]
+
+
+def test_query_all(server, parse):
+    parse.upload_gdf(waypoints(25), 'Waypoint')
+    results = parse.query_all('Waypoint', keys=['wpt_id'], page_size=10)
+    assert sorted(x['wpt_id'] for x in results) == list(range(25))
+    assert set(results[0]) == {'objectId', 'wpt_id'}
+
+
+def test_sync_gdf(server, parse):
+    gdf = waypoints(80)
+    result = parse.sync_gdf(gdf, 'Waypoint', id_column='wpt_id')
+    assert result['created'] == 80
+    n_batch_requests = server.n_batch_requests
+
+    # Nothing changed: nothing is sent
+    result = parse.sync_gdf(gdf, 'Waypoint', id_column='wpt_id')
+    assert result['unchanged'] == 80
+    assert server.n_batch_requests == n_batch_requests
+
+    gdf = gdf[gdf['wpt_id'] != 0].copy()
+    gdf.loc[gdf['wpt_id'] == 1, 'name'] = 'renamed'
+    gdf = pd.concat([gdf, waypoints(81).iloc[[80]]])
+    result = parse.sync_gdf(gdf, 'Waypoint', id_column='wpt_id')
+    assert result['created'] == 1
+    assert result['updated'] == 1
+    assert result['deleted'] == 1
+    assert result['unchanged'] == 78
+    assert sorted(x['wpt_id'] for x in server.objects.values()) == list(
+        range(1, 81))
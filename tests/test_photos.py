@@ -0,0 +1,106 @@
+import os
+import sys
+
+from data_source import photos
+
+
+class FakeExifTool:
+    """Stands in for a persistent exiftool process, recording which files
+    metadata is requested for
+    """
+    requested = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def execute_json(self, paths):
+        FakeExifTool.requested.extend(str(p) for p in paths)
+        return [{
+            'SourceFile': str(p),
+            'Content': open(p).read()} for p in paths]
+
+    def close(self):
+        pass
+
+
+def _library(tmp_path, monkeypatch):
+    monkeypatch.setattr(photos, 'ExifTool', FakeExifTool)
+    FakeExifTool.requested = []
+
+    library = photos.PhotosLibrary()
+    library.photos_dir = tmp_path
+    library.metadata_path = tmp_path / 'metadata.sqlite'
+    originals = tmp_path / 'Photos Library.photoslibrary' / 'originals'
+    originals.mkdir(parents=True)
+    return library, originals
+
+
+def test_metadata_index(tmp_path, monkeypatch):
+    library, originals = _library(tmp_path, monkeypatch)
+    (originals / 'a.heic').write_text('a')
+    (originals / 'b.heic').write_text('b')
+    (originals / '.hidden').write_text('x')
+
+    metadata = library.get_photos_metadata(batch_size=1)
+    assert [m['Content'] for m in metadata] == ['a', 'b']
+    assert len(FakeExifTool.requested) == 2
+
+    # Unchanged files are read from the index
+    FakeExifTool.requested = []
+    metadata = library.get_photos_metadata()
+    assert [m['Content'] for m in metadata] == ['a', 'b']
+    assert FakeExifTool.requested == []
+
+    # A file with a new mtime is rescanned, and removed files are dropped
+    path = originals / 'a.heic'
+    path.write_text('A')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    (originals / 'b.heic').unlink()
+    metadata = library.get_photos_metadata()
+    assert [m['Content'] for m in metadata] == ['A']
+    assert FakeExifTool.requested == [str(path)]
+
+    # overwrite rescans every file
+    FakeExifTool.requested = []
+    library.get_photos_metadata(overwrite=True)
+    assert FakeExifTool.requested == [str(path)]
+
+
+FAKE_EXIFTOOL = '''
+import json
+import sys
+
+args = []
+for line in sys.stdin:
+    line = line.rstrip('\\n')
+    if line == '-stay_open':
+        continue
+    if line == 'False':
+        break
+    if line != '-execute':
+        args.append(line)
+        continue
+
+    paths = [a for a in args if not a.startswith('-')]
+    print(json.dumps([{'SourceFile': p, 'Args': args} for p in paths]))
+    print('{ready}', flush=True)
+    args = []
+'''
+
+
+def test_exiftool_stay_open(tmp_path):
+    script = tmp_path / 'exiftool'
+    script.write_text(f'#!{sys.executable}\n{FAKE_EXIFTOOL}')
+    script.chmod(0o755)
+
+    with photos.ExifTool(executable=str(script)) as exiftool:
+        first = exiftool.execute_json(['a.heic', 'b.heic'])
+        second = exiftool.execute_json(['c.arw'])
+        process = exiftool.process
+
+    # One process answers every request
+    assert [m['SourceFile'] for m in first] == ['a.heic', 'b.heic']
+    assert first[0]['Args'] == ['-j', '-n', 'a.heic', 'b.heic']
+    assert [m['SourceFile'] for m in second] == ['c.arw']
+    assert process.returncode == 0
@@ -0,0 +1,107 @@
+import gzip
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import geojson
+import pytest
+import requests
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+# `lambda` is a keyword, so the handlers' directory can't be imported as a
+# package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'code' / 'lambda'))
+
+from publish import (
+    CONTENT_HASH, SOURCE_ETAG, head_metadata, publish_geojson)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.n_requests += 1
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.body.encode()
+        self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.n_requests = 0
+    server.etag = '"v1"'
+    server.body = '{"type": "FeatureCollection", "features": []}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='test-bucket')
+        yield client
+
+
+def test_publish_geojson(server, client):
+    host, port = server.server_address
+    url = f'http://{host}:{port}/data'
+    n_parsed = []
+
+    def publish():
+        def parse(content):
+            n_parsed.append(1)
+            return geojson.loads(content)
+
+        return publish_geojson(
+            client,
+            'test-bucket',
+            'current.geojson',
+            fetch=lambda headers: requests.get(url, headers=headers),
+            parse=parse)
+
+    assert publish() == 'updated'
+    obj = client.get_object(Bucket='test-bucket', Key='current.geojson')
+    assert obj['ContentEncoding'] == 'gzip'
+    assert json.loads(gzip.decompress(obj['Body'].read())) == {
+        'type': 'FeatureCollection', 'features': []}
+
+    # Upstream hasn't changed: not downloaded or parsed again
+    assert publish() == 'not_modified'
+    assert len(n_parsed) == 1
+
+    # Upstream changed, but output is the same: only metadata is updated
+    server.etag = '"v2"'
+    server.body = '{"features": [], "type": "FeatureCollection"}'
+    content_hash = head_metadata(
+        client, 'test-bucket', 'current.geojson')[CONTENT_HASH]
+    assert publish() == 'unchanged'
+    metadata = head_metadata(client, 'test-bucket', 'current.geojson')
+    assert metadata[SOURCE_ETAG] == '"v2"'
+    assert metadata[CONTENT_HASH] == content_hash
+
+    server.etag = '"v3"'
+    server.body = '{"type": "FeatureCollection", "features": [{}]}'
+    assert publish() == 'updated'
+    assert server.n_requests == 4
@@ -0,0 +1,86 @@
+import gzip
+import json
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+import s3
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = s3.s3_client()
+        client.create_bucket(Bucket='test-bucket')
+        yield client
+
+
+def test_upload_directory_to_s3(client, tmp_path):
+    (tmp_path / '0' / '0').mkdir(parents=True)
+    (tmp_path / '0' / '0' / '0.pbf').write_bytes(gzip.compress(b'tile'))
+    (tmp_path / 'tile.json').write_text('{}')
+
+    uploaded = s3.upload_directory_to_s3(
+        tmp_path, 'layer', bucket_name='test-bucket', client=client)
+    assert sorted(uploaded) == ['layer/0/0/0.pbf', 'layer/tile.json']
+
+    head = client.head_object(Bucket='test-bucket', Key='layer/0/0/0.pbf')
+    assert head['ContentType'] == 'application/x-protobuf'
+    assert head['ContentEncoding'] == 'gzip'
+
+    # Only changed files are uploaded again
+    (tmp_path / 'tile.json').write_text('{"name": "layer"}')
+    uploaded = s3.upload_directory_to_s3(
+        tmp_path, 'layer', bucket_name='test-bucket', client=client)
+    assert uploaded == ['layer/tile.json']
+
+
+def test_upload_directory_to_s3_logs_skipped(client, tmp_path, caplog):
+    (tmp_path / 'tile.json').write_text('{}')
+    s3.upload_directory_to_s3(
+        tmp_path, 'layer', bucket_name='test-bucket', client=client)
+
+    with caplog.at_level('INFO'):
+        uploaded = s3.upload_directory_to_s3(
+            tmp_path,
+            'layer',
+            bucket_name='test-bucket',
+            client=client,
+            verbose=True)
+
+    assert uploaded == []
+    assert 'Uploaded 0 of 1 files (1 unchanged skipped)' in caplog.text
+
+
+def test_upload_geojson_to_s3_python_engine(client):
+    fc = {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [-120, 35]},
+            'properties': {'name': 'a'}}]}
+    s3.upload_geojson_to_s3(
+        json.dumps(fc),
+        'layer',
+        bucket_name='test-bucket',
+        engine='python',
+        max_zoom=2,
+        client=client)
+
+    keys = [
+        obj['Key'] for obj in client.list_objects_v2(
+            Bucket='test-bucket')['Contents']]
+    assert sorted(keys) == ['layer/0/0/0.pbf', 'layer/1/0/0.pbf',
+                            'layer/2/0/1.pbf']
+
+    obj = client.get_object(Bucket='test-bucket', Key='layer/2/0/1.pbf')
+    assert obj['ContentEncoding'] == 'gzip'
+    # A tile message with one layer, named after the last part of the path
+    tile = gzip.decompress(obj['Body'].read())
+    assert tile[0] == (3 << 3) | 2
+    assert b'layer' in tile
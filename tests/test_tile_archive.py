@@ -0,0 +1,97 @@
+import gzip
+import random
+import sqlite3
+
+import pytest
+
+import tile_archive
+from tiles import tile_bounds
+
+
+def test_zxy_to_tileid():
+    tile_ids = [
+        tile_archive.zxy_to_tileid(0, 0, 0),
+        tile_archive.zxy_to_tileid(1, 0, 0),
+        tile_archive.zxy_to_tileid(1, 0, 1),
+        tile_archive.zxy_to_tileid(1, 1, 1),
+        tile_archive.zxy_to_tileid(1, 1, 0),
+        tile_archive.zxy_to_tileid(2, 0, 0)]
+    assert tile_ids == [0, 1, 2, 3, 4, 5]
+
+
+def test_mbtiles_dedup(tmp_path):
+    path = tmp_path / 'test.mbtiles'
+    with tile_archive.MBTilesWriter(path, tile_format='pbf') as writer:
+        writer.add_tile(1, 0, 0, b'a')
+        writer.add_tile(1, 1, 0, b'a')
+        writer.add_tile(1, 1, 1, b'b')
+
+    conn = sqlite3.connect(str(path))
+    assert conn.execute('SELECT COUNT(*) FROM images').fetchone() == (2, )
+
+    # Rows are stored in TMS coordinates
+    rows = conn.execute(
+        'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles '
+        'ORDER BY tile_column, tile_row').fetchall()
+    assert rows == [(1, 0, 1, b'a'), (1, 1, 0, b'b'), (1, 1, 1, b'a')]
+
+
+def test_pmtiles_round_trip(tmp_path):
+    reader = pytest.importorskip('pmtiles.reader')
+
+    # Enough tiles that the root directory doesn't fit in the first 16 KiB,
+    # added out of tile ID order. Every seventh tile, and every tile of a
+    # block of zoom 8, is a duplicate "ocean" tile.
+    tiles = {}
+    for x in range(40, 140):
+        for y in range(80, 200):
+            data = f'8/{x}/{y}'.encode()
+            if (x * y) % 7 == 0 or (x < 50 and y < 100):
+                data = b'ocean'
+            tiles[(8, x, y)] = data
+    for x in range(10, 35):
+        for y in range(20, 50):
+            tiles[(6, x, y)] = f'6/{x}/{y}'.encode()
+    keys = list(tiles)
+    random.Random(0).shuffle(keys)
+
+    path = tmp_path / 'test.pmtiles'
+    metadata = {'name': 'test', 'vector_layers': [{'id': 'layer'}]}
+    with tile_archive.PMTilesWriter(path, tile_format='pbf',
+                                    metadata=metadata) as writer:
+        for z, x, y in keys:
+            writer.add_tile(z, x, y, tiles[(z, x, y)])
+
+    with open(path, 'rb') as f:
+        r = reader.Reader(reader.MmapSource(f))
+        header = r.header()
+        assert header['leaf_directory_length'] > 0
+        assert header['addressed_tiles_count'] == len(tiles)
+        assert header['tile_contents_count'] == len(set(tiles.values()))
+        # Runs of ocean tiles share a directory entry
+        assert header['tile_entries_count'] < len(tiles)
+        assert header['tile_data_length'] == sum(
+            len(data) for data in set(tiles.values()))
+
+        assert (header['min_zoom'], header['max_zoom']) == (6, 8)
+        minx, miny, _, _ = tile_bounds(10, 49, 6)
+        _, _, maxx, maxy = tile_bounds(34, 20, 6)
+        assert header['min_lon_e7'] == pytest.approx(minx * 1e7, abs=1)
+        assert header['min_lat_e7'] == pytest.approx(miny * 1e7, abs=1)
+        assert header['max_lon_e7'] == pytest.approx(maxx * 1e7, abs=1)
+        assert header['max_lat_e7'] == pytest.approx(maxy * 1e7, abs=1)
+
+        assert r.metadata()['name'] == 'test'
+        assert r.metadata()['minzoom'] == 6
+        # Looking up a tile goes through the root and a leaf directory
+        for zxy in [(6, 10, 20), (8, 40, 80), (8, 139, 199), (8, 77, 91)]:
+            assert r.get(*zxy) == tiles[zxy]
+        assert r.get(8, 0, 0) is None
+        assert r.get(7, 50, 100) is None
+
+        # Directories are gzipped, and every tile is listed once with its data
+        assert gzip.decompress(
+            r.get_bytes(header['root_offset'], header['root_length']))
+        read = list(reader.all_tiles(r.get_bytes))
+        assert len(read) == len(tiles)
+        assert dict(read) == tiles
@@ -20,3 +20,15 @@ def test_cell():
     cell = Polygon(cell)
     blocks_dict = tiles.create_blocks_dict([cell])
     assert blocks_dict == {'48120': ['485212052']}
+
+
+def test_pack_tiles_roundtrip():
+    x = [0, 2800, 163]
+    y = [0, 6200, 353]
+    z = [0, 14, 10]
+    keys = tiles.pack_tiles(x, y, z)
+    assert keys.dtype == 'uint64'
+    assert [list(a) for a in tiles.unpack_tiles(keys)] == [x, y, z]
+
+    # Sorted keys are ordered by zoom first
+    assert list(keys.argsort()) == [0, 2, 1]
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from shapely.geometry import box
+
+from data_source import transit_land
+
+
+def _point(x, y):
+    return {'type': 'Point', 'coordinates': [x, y]}
+
+
+def _stop(onestop_id, x, y, routes):
+    return {
+        'onestop_id': onestop_id,
+        'geometry': _point(x, y),
+        'routes_serving_stop': [{'route_onestop_id': r} for r in routes]}
+
+
+OPERATORS = [{
+    'onestop_id': 'o-a',
+    'geometry': {
+        'type': 'Polygon',
+        'coordinates': [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]]}}]
+
+STOPS = [
+    _stop('s-1', 1, 1, ['r-1']),
+    _stop('s-2', 2, 2, ['r-1']),
+    _stop('s-3', 8, 8, ['r-1', 'r-2']),
+]
+
+ROUTES = {
+    'r-1': {
+        'onestop_id': 'r-1',
+        'stops_served_by_route': [
+            {'stop_onestop_id': s} for s in ['s-1', 's-2', 's-3']]},
+    'r-2': {
+        'onestop_id': 'r-2',
+        'stops_served_by_route': [
+            {'stop_onestop_id': s} for s in ['s-3', 's-4']]},
+}
+
+OTHER_STOPS = {'s-4': _stop('s-4', 20, 20, ['r-2'])}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with server.lock:
+            server.requests.append(url.path)
+            rate_limited = server.n_rate_limited > 0
+            server.n_rate_limited -= 1
+
+        if rate_limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        path = url.path[len('/api/v1'):]
+        if path == '/operators':
+            body = self._page('operators', OPERATORS, params)
+        elif path == '/stops':
+            body = self._page('stops', STOPS, params)
+        elif path.startswith('/onestop_id/'):
+            onestop_id = path.split('/')[-1]
+            body = ROUTES.get(onestop_id) or OTHER_STOPS[onestop_id]
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _page(self, key, items, params):
+        offset = int(params.get('offset', 0))
+        per_page = int(params['per_page'])
+        meta = {'offset': offset, 'per_page': per_page}
+        if offset + per_page < len(items):
+            host, port = self.server.server_address
+            meta['next'] = (
+                f'http://{host}:{port}{urlparse(self.path).path}?'
+                f'offset={offset + per_page}&per_page={per_page}')
+        return {key: items[offset:offset + per_page], 'meta': meta}
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.n_rate_limited = 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_transit(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('ROOT_DIR', str(tmp_path))
+    host, port = server.server_address
+
+    def make_transit(**kwargs):
+        return transit_land.Transit(
+            api_url=f'http://{host}:{port}/api/v1',
+            rate=100,
+            per_page=2,
+            **kwargs)
+
+    return make_transit
+
+
+def test_download(server, make_transit):
+    transit = make_transit()
+    nearby_stops, all_stops, routes = transit.download(box(0, 0, 5, 5))
+
+    assert set(nearby_stops) == {'s-1', 's-2'}
+    assert set(routes) == {'r-1'}
+    assert set(all_stops) == {'s-1', 's-2', 's-3'}
+
+    # The rate limited request is retried, stops are paged through, and stops
+    # listed for the operator aren't fetched again by id
+    assert server.requests.count('/api/v1/operators') == 2
+    assert server.requests.count('/api/v1/stops') == 2
+    assert server.requests.count('/api/v1/onestop_id/s-3') == 0
+
+    # Overlapping geometries reuse operator stops and routes
+    n_requests = len(server.requests)
+    nearby_stops, all_stops, routes = transit.download(box(0, 0, 10, 10))
+    assert set(routes) == {'r-1', 'r-2'}
+    assert set(all_stops) == {'s-1', 's-2', 's-3', 's-4'}
+    assert server.requests[n_requests:] == [
+        '/api/v1/operators',
+        '/api/v1/onestop_id/r-2',
+        '/api/v1/onestop_id/s-4']
+
+    # Annotating results doesn't change later results
+    routes['r-1']['_trail'] = True
+    assert '_trail' not in transit.download(box(0, 0, 5, 5))[2]['r-1']
+
+
+def test_cache(server, make_transit):
+    make_transit().download(box(0, 0, 5, 5))
+    n_requests = len(server.requests)
+
+    # A new client reads every response from the disk cache
+    make_transit().download(box(0, 0, 5, 5))
+    assert len(server.requests) == n_requests
+
+    # Responses older than cache_max_age are fetched again
+    transit = make_transit()
+    for path in transit.cache_dir.iterdir():
+        mtime = path.stat().st_mtime - transit_land.CACHE_MAX_AGE - 1
+        os.utime(path, (mtime, mtime))
+    transit.download(box(0, 0, 5, 5))
+    refetched = server.requests[n_requests:]
+    assert sorted(set(refetched)) == sorted(set(server.requests[:n_requests]))
+
+    # Unless they are kept forever
+    n_requests = len(server.requests)
+    make_transit(cache_max_age=None).download(box(0, 0, 5, 5))
+    assert len(server.requests) == n_requests
+
+
+def test_token_bucket():
+    bucket = transit_land.TokenBucket(rate=100, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.tokens < 1
+
+    bucket.throttle(0)
+    assert bucket.rate == 50
+    for _ in range(20):
+        bucket.recover()
+    assert bucket.rate == 100
@@ -0,0 +1,288 @@
+import gzip
+import json
+import struct
+
+from shapely.geometry import (
+    LineString, MultiLineString, MultiPoint, MultiPolygon, Point, Polygon, box)
+
+from vector_tiles import encode_tile, geojson_to_vector_tiles
+
+# Tile whose coordinates are tile coordinates with y flipped, so that a point
+# (x, y) is encoded at (x, 4096 - y)
+BOUNDS = (0, 0, 4096, 4096)
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """Read protobuf fields as (field number, wire type, value)"""
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _read_varint(buf, pos)
+        field, wire_type = tag >> 3, tag & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f'unexpected wire type {wire_type}')
+        yield field, wire_type, value
+
+
+def _packed(buf):
+    values = []
+    pos = 0
+    while pos < len(buf):
+        value, pos = _read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _decode_value(buf):
+    ((field, _, value), ) = list(_fields(buf))
+    if field == 1:
+        return value.decode('utf-8')
+    if field == 2:
+        return struct.unpack('<f', value)[0]
+    if field == 3:
+        return struct.unpack('<d', value)[0]
+    if field == 4:
+        return value - (1 << 64) if value >= 1 << 63 else value
+    if field == 5:
+        return value
+    if field == 6:
+        return _unzigzag(value)
+    if field == 7:
+        return bool(value)
+    raise ValueError(f'unexpected value field {field}')
+
+
+def decode_tile(data):
+    """Decode single-layer vector tile into a dict"""
+    ((field, _, layer_buf), ) = list(_fields(data))
+    assert field == 3
+
+    layer = {'keys': [], 'values': [], 'features': []}
+    for field, _, value in _fields(layer_buf):
+        if field == 15:
+            layer['version'] = value
+        elif field == 1:
+            layer['name'] = value.decode('utf-8')
+        elif field == 2:
+            feature = {}
+            for f, _, v in _fields(value):
+                if f == 2:
+                    feature['tags'] = _packed(v)
+                elif f == 3:
+                    feature['type'] = v
+                elif f == 4:
+                    feature['geometry'] = _packed(v)
+            layer['features'].append(feature)
+        elif field == 3:
+            layer['keys'].append(value.decode('utf-8'))
+        elif field == 4:
+            layer['values'].append(_decode_value(value))
+        elif field == 5:
+            layer['extent'] = value
+
+    for feature in layer['features']:
+        tags = feature['tags']
+        feature['properties'] = {
+            layer['keys'][k]: layer['values'][v]
+            for k, v in zip(tags[::2], tags[1::2])}
+        feature['paths'] = decode_geometry(feature['geometry'])
+
+    return layer
+
+
+def decode_geometry(commands):
+    """Decode geometry commands into paths of absolute tile coordinates
+
+    Returns:
+        list of (list of (x, y), closed) for each MoveTo
+    """
+    paths = []
+    x = y = 0
+    i = 0
+    while i < len(commands):
+        command_id, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command_id == 7:
+            assert count == 1
+            coords, closed = paths[-1]
+            paths[-1] = (coords, True)
+            continue
+
+        assert command_id in (1, 2)
+        for _ in range(count):
+            x += _unzigzag(commands[i])
+            y += _unzigzag(commands[i + 1])
+            i += 2
+            if command_id == 1:
+                paths.append(([(x, y)], False))
+            else:
+                paths[-1][0].append((x, y))
+
+    return paths
+
+
+def _area(coords):
+    """Signed area in tile coordinates, by the surveyor's formula"""
+    return sum(
+        x0 * y1 - x1 * y0
+        for (x0, y0), (x1, y1) in zip(coords, coords[1:] + coords[:1])) / 2
+
+
+def _encode(geometries, properties=None, **kwargs):
+    if properties is None:
+        properties = [{} for _ in geometries]
+    data = encode_tile('layer', geometries, properties, BOUNDS, **kwargs)
+    return decode_tile(data)
+
+
+def test_command_packing_and_zigzag():
+    line = LineString([(10, 4086), (20, 4076), (15, 4071)])
+    layer = _encode([line])
+    assert layer['version'] == 2
+    assert layer['name'] == 'layer'
+    assert layer['extent'] == 4096
+
+    (feature, ) = layer['features']
+    assert feature['type'] == 2
+    # MoveTo(1) +10,+10; LineTo(2) +10,+10 -5,+5
+    assert feature['geometry'] == [9, 20, 20, 18, 20, 20, 9, 10]
+
+
+def test_polygon_ring_winding():
+    exterior = [(100, 100), (1000, 100), (1000, 1000), (100, 1000)]
+    interior = [(200, 200), (200, 300), (300, 300), (300, 200)]
+
+    # Winding is normalized whatever the input orientation
+    for ext, hole in [(exterior, interior), (exterior[::-1], interior[::-1])]:
+        layer = _encode([Polygon(ext, [hole])])
+        (feature, ) = layer['features']
+        assert feature['type'] == 3
+
+        (ext_coords, ext_closed), (hole_coords, hole_closed) = \
+            feature['paths']
+        assert ext_closed and hole_closed
+        # Closing point is implied by ClosePath, not repeated
+        assert len(ext_coords) == 4 and len(hole_coords) == 4
+        assert _area(ext_coords) > 0
+        assert _area(hole_coords) < 0
+        assert sorted(ext_coords) == sorted(
+            (x, 4096 - y) for x, y in exterior)
+
+
+def test_multi_geometries():
+    points = MultiPoint([(10, 4086), (30, 4066)])
+    lines = MultiLineString([
+        [(0, 4096), (10, 4096)],
+        [(20, 4086), (20, 4076)]])
+    polygons = MultiPolygon([
+        box(0, 0, 100, 100),
+        box(200, 200, 300, 300)])
+    layer = _encode([points, lines, polygons])
+    point_f, line_f, polygon_f = layer['features']
+
+    # One MoveTo with a count of 2
+    assert point_f['type'] == 1
+    assert point_f['geometry'][0] == (2 << 3) | 1
+    assert [c for c, _ in point_f['paths']] == [[(10, 10)], [(30, 30)]]
+
+    # Deltas continue from the end of the previous part
+    assert line_f['type'] == 2
+    assert [c for c, _ in line_f['paths']] == [
+        [(0, 0), (10, 0)],
+        [(20, 10), (20, 20)]]
+
+    assert polygon_f['type'] == 3
+    assert len(polygon_f['paths']) == 2
+    assert all(closed for _, closed in polygon_f['paths'])
+    assert all(_area(c) > 0 for c, _ in polygon_f['paths'])
+
+
+def test_clipping_at_buffer():
+    crossing = LineString([(-1000, 2048), (5000, 2048)])
+    in_buffer = Point(-32, 2048)
+    outside_buffer = Point(-100, 2048)
+    layer = _encode(
+        [crossing, in_buffer, outside_buffer],
+        [{'n': 1}, {'n': 2}, {'n': 3}],
+        buffer=64)
+
+    assert [f['properties']['n'] for f in layer['features']] == [1, 2]
+    ((coords, _), ) = layer['features'][0]['paths']
+    assert coords == [(-64, 2048), (4160, 2048)]
+
+    # Nothing in the tile or its buffer
+    assert encode_tile(
+        'layer', [outside_buffer], [{}], BOUNDS, buffer=64) is None
+
+
+def test_value_types_and_dedup():
+    properties = [
+        {'flag': True, 'count': 5, 'delta': -3, 'ratio': 1.5, 'name': 'a'},
+        {'flag': True, 'count': 1, 'delta': -3, 'ratio': 1.5, 'name': 'b'},
+        {'flag': False, 'count': 5, 'name': 'a', 'missing': None},
+    ]
+    points = [Point(10, 10), Point(20, 20), Point(30, 30)]
+    layer = _encode(points, properties)
+
+    decoded = [f['properties'] for f in layer['features']]
+    expected = [{k: v for k, v in p.items() if v is not None}
+                for p in properties]
+    assert decoded == expected
+    for props, exp in zip(decoded, expected):
+        assert {k: type(v) for k, v in props.items()} == {
+            k: type(v) for k, v in exp.items()}
+
+    # Each key and value is stored once in the layer tables, and True isn't
+    # merged with the int 1
+    assert sorted(layer['keys']) == ['count', 'delta', 'flag', 'name', 'ratio']
+    assert len(layer['values']) == 8
+    assert sum(v is True for v in layer['values']) == 1
+    assert sum(type(v) is int and v == 1 for v in layer['values']) == 1
+
+
+def test_geojson_to_vector_tiles():
+    fc = {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[-120, 35], [-119, 35], [-119, 36],
+                                 [-120, 36], [-120, 35]]]},
+            'properties': {'name': 'fire'}}]}
+    tiles = list(
+        geojson_to_vector_tiles(
+            json.dumps(fc), 'fires', min_zoom=0, max_zoom=6))
+
+    assert [(z, x, y) for z, x, y, _ in tiles if z < 3] == [
+        (0, 0, 0), (1, 0, 0), (2, 0, 1)]
+    for z, x, y, data in tiles:
+        layer = decode_tile(gzip.decompress(data))
+        assert layer['name'] == 'fires'
+        (feature, ) = layer['features']
+        assert feature['properties'] == {'name': 'fire'}
+        assert all(closed for _, closed in feature['paths'])